@@ -0,0 +1,219 @@
+# archive.py
+import gzip
+import io
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+INDEX_FILE = "index.json"
+
+
+class OperationArchive:
+    '''
+    Moves old Operation (audit log) rows out of the database into
+    compressed, append-only archive segments, and reads them back.
+
+    Rows older than retention_days (counted in whole days) are written to one
+    gzip'd JSONL segment per day, operations-YYYY-MM-DD.jsonl.gz, and then
+    deleted from Operation. Each run appends a new gzip member to a segment,
+    so existing bytes are never rewritten. index.json records every
+    segment's committed size, row count and time range, plus the last row
+    archived.
+
+    Each batch is archived inside one BEGIN IMMEDIATE transaction. That also
+    keeps two workers from archiving the same rows. The segment is written
+    and fsynced, then the index is replaced, and only then are the rows
+    deleted. If a run dies part way, the next run starts by cutting every
+    segment back to its indexed size and deleting any rows the index says
+    were already archived, so no row is lost or archived twice. Each batch
+    also cuts the segments it appends to back to their indexed size, in case
+    another worker died mid-batch since.
+
+    Attributes:
+        directory (str): Where segments and the index file live.
+        db_manager_factory (callable): Returns the DatabaseManager to archive from.
+        retention_days (int): Days of operations kept in the database.
+        batch_size (int): Rows archived per transaction.
+
+    Methods:
+        run(now): Archive every operation older than the retention horizon.
+        segments(since, until): Index entries of segments overlapping a range.
+        read(user, type, since, until): Iterate archived operations, oldest first.
+    '''
+
+    def __init__(self, directory, db_manager_factory, retention_days=90, batch_size=5000):
+        self.directory = directory
+        self.db_manager_factory = db_manager_factory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self.archived = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load_index(self):
+        """The archive index, or an empty one if nothing was archived yet"""
+        try:
+            with open(self._path(INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": {}, "archived_through": None, "max_operation_id": 0}
+
+    def _save_index(self, index):
+        # write a new file and rename it over the old one, so readers and a
+        # crashed run only ever see a complete index
+        tmp = self._path(INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(INDEX_FILE))
+
+    def _truncate(self, name, segment):
+        # drop bytes a crashed run appended after the last index update
+        path = self._path(name)
+        if os.path.exists(path) and os.path.getsize(path) > segment["size"]:
+            with open(path, "r+b") as f:
+                f.truncate(segment["size"])
+
+    def _recover(self):
+        db_manager = self.db_manager_factory()
+        with db_manager.transaction():
+            index = self.load_index()
+            for name, segment in index["segments"].items():
+                self._truncate(name, segment)
+            for name in os.listdir(self.directory):
+                if name.startswith("operations-") and name not in index["segments"]:
+                    os.remove(self._path(name))
+            if index["archived_through"] is not None:
+                # rows of a batch whose delete never committed
+                db_manager.execute_statement("""
+                    DELETE FROM Operation
+                    WHERE (timestamp, operation_id) <= (?, ?) AND operation_id <= ?
+                    """, (*index["archived_through"], index["max_operation_id"]))
+
+    def cutoff(self, now=None):
+        """Operations before this 'YYYY-MM-DD HH:MM:SS' time are archived"""
+        day = ((now or datetime.now()) - timedelta(days=self.retention_days)).date()
+        return f"{day.isoformat()} 00:00:00"
+
+    def run(self, now=None):
+        """
+        Archive every operation older than the retention horizon.
+
+        Args:
+            now (datetime): The current time, for tests.
+
+        Returns:
+            int: The number of operations archived.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        cutoff = self.cutoff(now)
+        archived = 0
+        with self._lock:
+            self._recover()
+            while True:
+                moved = self._archive_batch(cutoff)
+                archived += moved
+                if moved < self.batch_size:
+                    break
+        self.archived += archived
+        return archived
+
+    def _archive_batch(self, cutoff):
+        db_manager = self.db_manager_factory()
+        with db_manager.transaction():
+            index = self.load_index()
+            rows = db_manager.execute_query("""
+                SELECT o.operation_id, o.user_id, u.username, o.timestamp, o.type, o.description
+                FROM Operation o LEFT JOIN User u ON u.user_id = o.user_id
+                WHERE o.timestamp < ?
+                ORDER BY o.timestamp, o.operation_id
+                LIMIT ?
+                """, (cutoff, self.batch_size))
+            if not rows:
+                return 0
+
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(row["timestamp"][:10], []).append(row)
+            for day, day_rows in by_day.items():
+                name = f"operations-{day}.jsonl.gz"
+                if name in index["segments"]:
+                    self._truncate(name, index["segments"][name])
+                data = "".join(json.dumps(row) + "\n" for row in day_rows).encode()
+                with open(self._path(name), "ab") as f:
+                    f.write(gzip.compress(data))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = f.tell()
+                segment = index["segments"].setdefault(name, {
+                    "day": day, "rows": 0,
+                    "first_timestamp": day_rows[0]["timestamp"],
+                    "last_timestamp": day_rows[-1]["timestamp"]})
+                segment["size"] = size
+                segment["rows"] += len(day_rows)
+                segment["first_timestamp"] = min(segment["first_timestamp"], day_rows[0]["timestamp"])
+                segment["last_timestamp"] = max(segment["last_timestamp"], day_rows[-1]["timestamp"])
+            index["archived_through"] = [rows[-1]["timestamp"], rows[-1]["operation_id"]]
+            index["max_operation_id"] = max(row["operation_id"] for row in rows)
+            self._save_index(index)
+
+            placeholders = ", ".join("?" for _ in rows)
+            db_manager.execute_statement(
+                f"DELETE FROM Operation WHERE operation_id IN ({placeholders})",
+                tuple(row["operation_id"] for row in rows))
+        return len(rows)
+
+    def segments(self, since=None, until=None):
+        """Index entries (with their file name) of segments overlapping [since, until)"""
+        index = self.load_index()
+        matches = []
+        for name, segment in sorted(index["segments"].items()):
+            if since is not None and segment["last_timestamp"] < since:
+                continue
+            if until is not None and segment["first_timestamp"] >= until:
+                continue
+            matches.append({"name": name, **segment})
+        return matches
+
+    def read_segment(self, segment, user=None, type=None, since=None, until=None):
+        """The archived operations in one segment that match the filters"""
+        with open(self._path(segment["name"]), "rb") as f:
+            # only the indexed bytes; a run in progress may be appending
+            data = f.read(segment["size"])
+        rows = []
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+            for line in f:
+                row = json.loads(line)
+                if user is not None and row["username"] != user:
+                    continue
+                if type is not None and row["type"] != type:
+                    continue
+                if since is not None and row["timestamp"] < since:
+                    continue
+                if until is not None and row["timestamp"] >= until:
+                    continue
+                rows.append(row)
+        rows.sort(key=lambda row: (row["timestamp"], row["operation_id"]))
+        return rows
+
+    def read(self, user=None, type=None, since=None, until=None):
+        """
+        Iterate archived operations matching the filters, oldest first.
+
+        Only the segments whose time range overlaps [since, until) are opened.
+
+        Args:
+            user (str): Only operations by this username.
+            type (str): Only operations of this type.
+            since (str): Only operations at or after this 'YYYY-MM-DD HH:MM:SS' time.
+            until (str): Only operations before this 'YYYY-MM-DD HH:MM:SS' time.
+
+        Yields:
+            dict: One archived operation.
+        """
+        for segment in self.segments(since, until):
+            yield from self.read_segment(segment, user, type, since, until)
@@ -0,0 +1,277 @@
+# audit.py
+import queue
+import sqlite3
+import threading
+import time
+
+from modules import encode_cursor, decode_cursor
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class AuditLogWriter:
+    '''
+    Writes Operation (audit log) rows from a background thread.
+
+    Routes only put an entry on a bounded in-memory queue. A writer thread
+    takes entries off the queue in batches of up to batch_size and inserts
+    each batch with one executemany in a single transaction, at least every
+    flush_interval seconds. Usernames are resolved to user ids once and then
+    served from a cache.
+
+    log() never blocks the caller: when the queue is full the entry is
+    dropped and counted, so a slow disk can neither stall the event loop nor
+    grow memory without bound. A batch whose INSERT fails with a transient
+    error (database locked or busy) is retried up to retries times, waiting
+    retry_delay seconds and doubling the wait each time, before it is
+    dropped and counted. stop() drains and commits everything still queued.
+
+    Attributes:
+        db_manager_factory (callable): Returns the DatabaseManager to write through.
+        batch_size (int): Maximum rows per INSERT batch.
+        flush_interval (float): Seconds a queued entry may wait before being written.
+        max_queue (int): Maximum number of queued entries.
+        retries (int): Extra attempts at writing a batch after a transient error.
+        retry_delay (float): Seconds before the first retry; doubled after each one.
+
+    Methods:
+        log(username, type, description, timestamp): Queue an operation.
+        flush(): Write everything queued so far.
+        start(): Start the writer thread.
+        stop(): Stop the writer thread after flushing.
+        forget_user(username): Drop a cached user id.
+        stats(): Return queue and write counters.
+    '''
+
+    def __init__(self, db_manager_factory, batch_size=200, flush_interval=0.5,
+                 max_queue=10000, retries=3, retry_delay=0.1):
+        self.db_manager_factory = db_manager_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._user_ids = {}
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # log() runs on request threads and the event loop, _write on the
+        # writer thread; _write_lock is held across whole writes, so the
+        # counters get a lock of their own that is never held for long
+        self._counter_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def log(self, username, type, description, timestamp):
+        """Queue an operation to be written; returns False if it was dropped"""
+        self.start()
+        entry = (username, type, description, timestamp.strftime(TIMESTAMP_FORMAT))
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self._count("dropped", 1)
+            print("Audit log queue is full, dropping operation: ", type)
+            return False
+
+    def start(self):
+        """Start the writer thread if it is not running"""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the writer thread and write whatever is still queued"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        self._stopping.set()
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write([first] + self._take(self.batch_size - 1))
+
+    def _take(self, limit):
+        entries = []
+        while len(entries) < limit:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def flush(self):
+        """Write every entry queued so far"""
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def forget_user(self, username):
+        """Drop a cached user id, e.g. after the user was removed"""
+        self._user_ids.pop(username, None)
+
+    def _resolve_user_ids(self, db_manager, usernames):
+        missing = [name for name in usernames if name not in self._user_ids]
+        if missing:
+            placeholders = ", ".join("?" for _ in missing)
+            rows = db_manager.execute_query(
+                f"SELECT user_id, username FROM User WHERE username IN ({placeholders})",
+                tuple(missing))
+            for row in rows:
+                self._user_ids[row['username']] = row['user_id']
+        return self._user_ids
+
+    def _write(self, batch):
+        with self._write_lock:
+            delay = self.retry_delay
+            for attempt in range(self.retries + 1):
+                try:
+                    self._insert(batch)
+                    return
+                except sqlite3.OperationalError as e:  # locked or busy, may succeed later
+                    if attempt == self.retries:
+                        error = e
+                        break
+                    print(f"Failed to log operations, retrying in {delay}s: ", str(e))
+                    time.sleep(delay)
+                    delay *= 2
+                except sqlite3.Error as e:
+                    error = e
+                    break
+            self._count("dropped", len(batch))
+            print(f"Failed to log {len(batch)} operations: ", str(error))
+
+    def _insert(self, batch):
+        db_manager = self.db_manager_factory()
+        user_ids = self._resolve_user_ids(db_manager, {entry[0] for entry in batch})
+        rows = [(user_ids[username], type, description, timestamp)
+                for username, type, description, timestamp in batch if username in user_ids]
+        if rows:
+            with db_manager.transaction() as conn:
+                conn.executemany("""
+                    INSERT INTO Operation (user_id, type, description, timestamp)
+                    VALUES (?, ?, ?, ?)
+                    """, rows)
+            self._count("written", len(rows))
+        for username, *_ in batch:
+            if username not in user_ids:
+                self._count("skipped", 1)
+                print(f"Failed to log operation: unknown user {username}")
+
+    def _count(self, counter, amount):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def stats(self):
+        """Return queue depth and counters"""
+        with self._counter_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "skipped": self.skipped,
+            }
+
+
+class OperationLog:
+    '''
+    Reads Operation (audit log) rows newest first, one page at a time.
+
+    Pages are keyset paginated on (timestamp, operation_id): a page ends
+    with a cursor naming its last row, and the next page starts right after
+    it. Unlike OFFSET this costs the same on page 1 and on page 100000, and
+    rows logged between two calls never shift a page. Filters on user,
+    type and time range are served by the Operation indexes.
+
+    Attributes:
+        db (DatabaseManager): The database to read from.
+
+    Methods:
+        page(user, type, since, until, cursor, limit, oldest_first): One page of operations.
+        iter_pages(...): Every page matching the filters, one after another.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def encode_cursor(row):
+        """An opaque cursor pointing just after row"""
+        return encode_cursor(row['timestamp'], row['operation_id'])
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """The (timestamp, operation_id) a cursor points after; ValueError if malformed"""
+        return decode_cursor(cursor, str, int)
+
+    def page(self, user=None, type=None, since=None, until=None, cursor=None, limit=100, oldest_first=False):
+        """
+        Return one page of operations, newest first unless oldest_first.
+
+        Args:
+            user (str): Only operations by this username.
+            type (str): Only operations of this type.
+            since (str): Only operations at or after this 'YYYY-MM-DD HH:MM:SS' time.
+            until (str): Only operations before this 'YYYY-MM-DD HH:MM:SS' time.
+            cursor (str): Start after the row this cursor names.
+            limit (int): Maximum number of operations.
+            oldest_first (bool): Page forward in time instead; cursors only
+                work with pages in the same order.
+
+        Returns:
+            tuple: (list of operation dicts, cursor of the next page or None).
+        """
+        conditions, params = [], []
+        if user is not None:
+            # a scalar lookup keeps user_id = ? usable on the (user_id, timestamp) index
+            conditions.append("o.user_id = (SELECT user_id FROM User WHERE username = ?)")
+            params.append(user)
+        if type is not None:
+            conditions.append("o.type = ?")
+            params.append(type)
+        if since is not None:
+            conditions.append("o.timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("o.timestamp < ?")
+            params.append(until)
+        if cursor is not None:
+            conditions.append(f"(o.timestamp, o.operation_id) {'>' if oldest_first else '<'} (?, ?)")
+            params.extend(self.decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "ASC" if oldest_first else "DESC"
+        # one row more than asked for tells whether there is a next page
+        rows = self.db.execute_query(f"""
+            SELECT o.operation_id, u.username, o.timestamp, o.type, o.description
+            FROM Operation o JOIN User u ON u.user_id = o.user_id
+            {where}
+            ORDER BY o.timestamp {order}, o.operation_id {order}
+            LIMIT ?
+            """, (*params, limit + 1))
+        if len(rows) > limit:
+            return rows[:limit], self.encode_cursor(rows[limit - 1])
+        return rows, None
+
+    def iter_pages(self, user=None, type=None, since=None, until=None, cursor=None, limit=1000,
+                   oldest_first=False):
+        """Yield every page of operations matching the filters"""
+        while True:
+            rows, cursor = self.page(user, type, since, until, cursor, limit, oldest_first)
+            if rows:
+                yield rows
+            if cursor is None:
+                return
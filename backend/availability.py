@@ -0,0 +1,155 @@
+# availability.py
+import threading
+import weakref
+from bisect import bisect_left, insort
+
+
+class MachineIntervals:
+    '''
+    The reservations of one machine type, kept sorted by start time.
+    Times are minutes since the epoch (see modules.epoch_minutes), so every
+    comparison below is an integer comparison.
+
+    Intervals are closed, like the SQL overlap test in
+    ReservationCalendar.retrieve: a booking ending at 12:00 and one starting
+    at 12:00 share that minute, so back-to-back bookings conflict.
+
+    Every stored interval is at most max_length long, so an interval that
+    overlaps [start, end] must begin at or after start - max_length. A query
+    therefore bisects to that window and only walks the k intervals inside
+    it, which is O(log n + k) instead of a scan over every reservation.
+
+    Attributes:
+        intervals (list of tuple): (start, end, reservation_id) sorted by start.
+        max_length (int): The longest interval ever stored (only grows until rebuilt).
+    '''
+
+    def __init__(self):
+        self.intervals = []
+        self.max_length = None
+
+    def add(self, start, end, reservation_id):
+        insort(self.intervals, (start, end, reservation_id))
+        length = end - start
+        if self.max_length is None or length > self.max_length:
+            self.max_length = length
+
+    def remove(self, start, end, reservation_id):
+        position = bisect_left(self.intervals, (start, end, reservation_id))
+        if position < len(self.intervals) and self.intervals[position] == (start, end, reservation_id):
+            del self.intervals[position]
+            return True
+        return False
+
+    def overlapping(self, start, end):
+        """Yield (start, end) of every interval that overlaps [start, end]"""
+        if not self.intervals:
+            return
+        low = bisect_left(self.intervals, (start - self.max_length,))
+        high = bisect_left(self.intervals, (end + 1,))
+        for interval_start, interval_end, _ in self.intervals[low:high]:
+            if interval_end >= start:
+                yield interval_start, interval_end
+
+    def peak(self, start, end):
+        """Maximum number of intervals in use at the same time during [start, end]"""
+        events = []
+        for interval_start, interval_end in self.overlapping(start, end):
+            events.append((max(interval_start, start), 0))
+            events.append((min(interval_end, end), 1))
+        # intervals are closed, so at equal times a start sorts before a release
+        events.sort()
+        in_use = highest = 0
+        for _, release in events:
+            in_use += -1 if release else 1
+            highest = max(highest, in_use)
+        return highest
+
+
+class AvailabilityIndex:
+    '''
+    An in-memory index of reservations per machine type, used to answer
+    "how many machines of type X are reserved at the same time during
+    [start, end]".
+
+    The index remembers the version of the Reservation table it reflects
+    (the DataVersion row maintained by triggers, see migrations.py). Callers
+    compare it with the stored version before each lookup and rebuild the
+    index when another connection or process has changed the table.
+
+    Attributes:
+        version (int): Reservation table version the index reflects, or None if stale.
+
+    Methods:
+        for_database(db_manager): Return the index shared by a database.
+        load(rows, version): Replace the contents of the index.
+        add(machine, reservation_id, start, end, version): Record a new reservation.
+        remove(reservation_id, version): Forget a reservation.
+        peak(machine, start, end): Peak concurrent reservations of a machine.
+    '''
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.version = None
+        self._machines = {}
+        self._by_id = {}  # reservation_id -> (machine, start, end)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def for_database(cls, db_manager):
+        """Return the index shared by every calendar using db_manager"""
+        with cls._shared_lock:
+            index = cls._shared.get(db_manager)
+            if index is None:
+                index = cls._shared[db_manager] = cls()
+            return index
+
+    def load(self, rows, version):
+        """
+        Replace the contents of the index.
+
+        Args:
+            rows (iterable): (reservation_id, machine, start, end) tuples, times in epoch minutes.
+            version (int): The Reservation table version the rows were read at.
+        """
+        machines = {}
+        by_id = {}
+        for reservation_id, machine, start, end in rows:
+            machines.setdefault(machine, MachineIntervals()).add(start, end, reservation_id)
+            by_id[reservation_id] = (machine, start, end)
+        with self._lock:
+            self._machines = machines
+            self._by_id = by_id
+            self.version = version
+
+    def _advance(self, version):
+        # A change is only applied on top of the version right before it;
+        # anything else means we missed a change and must rebuild.
+        if self.version is None or version != self.version + 1:
+            self.version = None
+            return False
+        self.version = version
+        return True
+
+    def add(self, machine, reservation_id, start, end, version):
+        """Record a reservation saved at the given table version"""
+        with self._lock:
+            if self._advance(version):
+                self._machines.setdefault(machine, MachineIntervals()).add(start, end, reservation_id)
+                self._by_id[reservation_id] = (machine, start, end)
+
+    def remove(self, reservation_id, version):
+        """Forget a reservation deleted at the given table version"""
+        with self._lock:
+            if self._advance(version) and reservation_id in self._by_id:
+                machine, start, end = self._by_id.pop(reservation_id)
+                self._machines[machine].remove(start, end, reservation_id)
+
+    def peak(self, machine, start, end):
+        """Peak number of concurrent reservations of machine during [start, end]"""
+        with self._lock:
+            intervals = self._machines.get(machine)
+            if intervals is None:
+                return 0
+            return intervals.peak(start, end)
@@ -0,0 +1,214 @@
+# connection_pool.py
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Applied to every pooled connection when it is opened. WAL lets readers keep
+# going while a writer commits, and NORMAL sync is durable across application
+# crashes in WAL mode (only an OS crash can lose the last transactions).
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,          # milliseconds
+    "cache_size": -16000,          # negative values are KiB, so ~16MB
+    "mmap_size": 268435456,        # 256MB
+    "temp_store": "MEMORY",
+}
+
+
+def apply_pragmas(conn, pragmas):
+    """Apply a {name: value} PRAGMA profile to a connection"""
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class PoolError(Exception):
+    """Base class for connection pool errors."""
+    pass
+
+class PoolTimeoutError(PoolError):
+    """Raised when no connection becomes available before the timeout."""
+    pass
+
+class PoolClosedError(PoolError):
+    """Raised when a connection is requested from a closed pool."""
+    pass
+
+
+class ConnectionPool:
+    '''
+    A bounded pool of long-lived SQLite connections.
+
+    Connections are checked out by a caller and checked back in when the caller
+    is done, so any thread may use any connection (they are opened with
+    check_same_thread=False). Up to max_size connections are kept open between
+    requests. When all of them are busy the pool may open up to max_overflow
+    extra connections, which are closed as soon as they are checked back in.
+    Once both limits are reached, callers wait up to timeout seconds before a
+    PoolTimeoutError is raised.
+
+    Attributes:
+        db_path (str): Path to the database file.
+        max_size (int): Number of connections kept open while idle.
+        max_overflow (int): Number of temporary connections allowed above max_size.
+        timeout (float): Seconds to wait for a free connection.
+        recycle (float): Connections older than this many seconds are reopened.
+        ping_interval (float): Idle connections unused for this many seconds are
+            health checked with "SELECT 1" before being handed out.
+        on_connect (callable): Optional hook called with every new connection.
+
+    Methods:
+        checkout(): Take a connection out of the pool.
+        checkin(conn): Return a connection to the pool.
+        connection(): Context manager wrapping checkout/checkin.
+        stats(): Return counters describing the pool.
+        close(): Close every idle connection and refuse further checkouts.
+    '''
+
+    def __init__(self, db_path, max_size=5, max_overflow=5, timeout=5.0,
+                 recycle=3600, ping_interval=30, on_connect=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if max_overflow < 0:
+            raise ValueError("max_overflow cannot be negative")
+
+        self.db_path = db_path
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.on_connect = on_connect
+
+        self._idle = []  # stack of (connection, created_at, last_used)
+        self._created = {}  # id(connection) -> created_at for checked out connections
+        self._size = 0
+        self._waiting = 0  # callers blocked in checkout()
+        self._closed = False
+        self._condition = threading.Condition(threading.Lock())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            if self.on_connect:
+                self.on_connect(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Failed to close pooled connection: {e}")
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def checkout(self):
+        """Take a connection out of the pool, opening one if allowed"""
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed")
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size + self.max_overflow:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout} seconds")
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        now = time.monotonic()
+        if conn is not None:
+            # Idle connections are reused unless they are too old or fail a ping
+            expired = self.recycle is not None and now - created_at > self.recycle
+            stale = now - last_used > self.ping_interval
+            if expired or (stale and not self._is_healthy(conn)):
+                self._discard(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            created_at = now
+
+        with self._condition:
+            self._created[id(conn)] = created_at
+        return conn
+
+    def checkin(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._release(conn, keep=False)
+                return
+        self._release(conn, keep=True)
+
+    def _release(self, conn, keep):
+        with self._condition:
+            created_at = self._created.pop(id(conn), time.monotonic())
+            # Connections above max_size are overflow and are not kept around
+            if keep and not self._closed and self._size <= self.max_size:
+                self._idle.append((conn, created_at, time.monotonic()))
+                conn = None
+            else:
+                self._size -= 1
+            self._condition.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with block"""
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def stats(self):
+        """Return the number of open, idle and checked out connections and waiting callers"""
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "checked_out": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+                "max_overflow": self.max_overflow,
+            }
+
+    def close(self):
+        """Close all idle connections; busy ones are closed on checkin"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
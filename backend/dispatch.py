@@ -0,0 +1,79 @@
+# dispatch.py
+import asyncio
+import functools
+import threading
+import weakref
+
+import anyio
+from anyio import from_thread, to_thread
+
+
+class BlockingDispatcher:
+    '''
+    Runs blocking calls (sqlite3 through the managers) on worker threads so
+    async routes never block the event loop.
+
+    sqlite3 releases the GIL while a statement runs, so readers on other
+    threads keep making progress while a writer holds the database. The
+    number of calls running at once is capped at max_threads; keep that at
+    the connection pool size plus overflow, since a thread without a
+    connection would only wait on the pool.
+
+    Attributes:
+        max_threads (int): Blocking calls allowed to run at the same time.
+
+    Methods:
+        run(func, *args, **kwargs): Await func(*args, **kwargs) on a worker thread.
+        iterate(func, *args, **kwargs): Iterate a blocking generator on a worker thread.
+    '''
+
+    def __init__(self, max_threads=10):
+        self.max_threads = max_threads
+        self._limiters = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _limiter(self):
+        # a CapacityLimiter belongs to the event loop it was created on
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            limiter = self._limiters.get(loop)
+            if limiter is None:
+                limiter = self._limiters[loop] = anyio.CapacityLimiter(self.max_threads)
+            return limiter
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking function on a worker thread and return its result"""
+        return await to_thread.run_sync(functools.partial(func, *args, **kwargs),
+                                        limiter=self._limiter())
+
+    async def iterate(self, func, *args, buffer=1, **kwargs):
+        """
+        Iterate func(*args, **kwargs), a blocking generator, on one worker thread.
+
+        The generator runs start to finish on the same thread, so it may hold
+        a connection or cursor across items. At most buffer items wait for
+        the consumer; a slow client pauses the generator instead of letting
+        items pile up in memory. If the consumer stops early the generator
+        is closed on its own thread.
+        """
+        send, receive = anyio.create_memory_object_stream(buffer)
+
+        def produce():
+            with send:
+                for item in func(*args, **kwargs):
+                    try:
+                        from_thread.run(send.send, item)
+                    except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                        return  # the consumer went away
+
+        producer = asyncio.ensure_future(self.run(produce))
+        try:
+            async with receive:
+                async for item in receive:
+                    yield item
+        finally:
+            receive.close()
+            await producer
+
+
+default_dispatcher = BlockingDispatcher()
@@ -0,0 +1,187 @@
+# federation.py
+import asyncio
+import time
+
+import httpx
+
+
+class CircuitBreaker:
+    '''
+    Stops calling a partner facility that keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens and the
+    peer is skipped for reset_timeout seconds. Then one trial request is let
+    through (half-open): success closes the breaker, failure opens it again.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the breaker.
+        reset_timeout (float): Seconds to wait before trying an open peer again.
+        failures (int): Current run of consecutive failures.
+
+    Methods:
+        allow(): Whether a request may be sent now.
+        record_success(): Close the breaker.
+        record_failure(): Count a failure, opening the breaker at the threshold.
+        record_cancelled(): Forget a request that was cancelled before it finished.
+    '''
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Whether a request may be sent to the peer now"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_cancelled(self):
+        # a cancelled trial request says nothing about the peer's health
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class FederationClient:
+    '''
+    Books reservations at partner facilities through their /outside-requests
+    endpoints.
+
+    A request is sent at the same time to every partner whose circuit
+    breaker lets it through, over one pooled keep-alive HTTP client, each
+    with its own timeout. The first partner that books the reservation wins and the
+    requests still in flight are cancelled. /outside-requests has no way to
+    undo a booking, so a partner that accepted at the same moment as the
+    winner is reported in "late", and a cancelled request may still have
+    been booked by its partner without us hearing about it.
+
+    Attributes:
+        peers (list of str): Base URLs of the partner facilities.
+        api_key (str): Sent in the API-Key header.
+        timeout (float): Seconds one partner has to answer.
+        breakers (dict): Peer URL -> CircuitBreaker.
+
+    Methods:
+        reserve(payload): Book at the first partner that accepts payload.
+        stats(): Breaker state and latency per partner.
+        aclose(): Close the pooled HTTP connections.
+    '''
+
+    def __init__(self, peers, api_key, timeout=3.0, failure_threshold=3,
+                 reset_timeout=30.0, transport=None):
+        self.peers = [peer.rstrip("/") for peer in peers]
+        self.api_key = api_key
+        self.timeout = timeout
+        self.breakers = {peer: CircuitBreaker(failure_threshold, reset_timeout) for peer in self.peers}
+        self.latency = {peer: None for peer in self.peers}  # last latency in ms
+        self._transport = transport
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={"API-Key": self.api_key},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=max(len(self.peers), 1) * 2),
+                transport=self._transport)
+        return self._client
+
+    async def _ask(self, peer, payload):
+        client = self._get_client()
+        began = time.perf_counter()
+        try:
+            # a deadline for the whole exchange, not just each socket operation
+            response = await asyncio.wait_for(
+                client.post(f"{peer}/outside-requests", json=payload), self.timeout)
+            response.raise_for_status()
+            answer = response.json()
+        except asyncio.CancelledError:
+            self.breakers[peer].record_cancelled()
+            raise
+        except (httpx.HTTPError, ValueError, asyncio.TimeoutError):
+            self.latency[peer] = round((time.perf_counter() - began) * 1000, 2)
+            self.breakers[peer].record_failure()
+            raise
+        self.latency[peer] = round((time.perf_counter() - began) * 1000, 2)
+        self.breakers[peer].record_success()
+        return answer
+
+    async def reserve(self, payload):
+        """
+        Ask every available partner to book payload; the first to accept wins.
+
+        Args:
+            payload (dict): A RemoteRequest body.
+
+        Returns:
+            dict: "peer" (URL of the partner that booked, or None), "response"
+            (its answer), "late" (partners that also booked in the same round),
+            "latency_ms" (per partner, None if cancelled) and "errors" (per partner).
+        """
+        tasks = {asyncio.create_task(self._ask(peer, payload)): peer
+                 for peer in self.peers if self.breakers[peer].allow()}
+        result = {"peer": None, "response": None, "late": [], "latency_ms": {}, "errors": {}}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    peer = tasks[task]
+                    if task.exception() is not None:
+                        result["errors"][peer] = str(task.exception()) or type(task.exception()).__name__
+                        continue
+                    answer = task.result()
+                    if not answer.get("reservation_made_success"):
+                        result["errors"][peer] = answer.get("message", "reservation refused")
+                    elif result["peer"] is None:
+                        result["peer"], result["response"] = peer, answer
+                    else:
+                        result["late"].append(peer)
+                if result["peer"] is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task, peer in tasks.items():
+            result["latency_ms"][peer] = None if task.cancelled() else self.latency[peer]
+        for peer in self.peers:
+            if peer not in tasks.values():
+                result["errors"][peer] = "circuit open"
+        return result
+
+    def stats(self):
+        """Breaker state, consecutive failures and last latency per partner"""
+        return {peer: {"state": self.breakers[peer].state,
+                       "failures": self.breakers[peer].failures,
+                       "latency_ms": self.latency[peer]}
+                for peer in self.peers}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
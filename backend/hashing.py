@@ -0,0 +1,102 @@
+# hashing.py
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import PBKDF2_SECONDS
+
+PBKDF2_ITERATIONS = 100000
+
+
+class HashingBusyError(Exception):
+    """Raised when too many password hashes are already queued."""
+    pass
+
+
+class PasswordHasher:
+    '''
+    Runs PBKDF2 password hashing on a small dedicated thread pool.
+
+    A PBKDF2 hash deliberately burns tens of milliseconds of CPU. Running it
+    on the event loop stalls every other request, so the async methods hand
+    the work to max_workers threads instead (hashlib releases the GIL while
+    hashing, so other requests keep running). At most max_pending hashes may
+    be queued or running at once; beyond that HashingBusyError is raised
+    straight away, so a login storm is turned away early instead of piling
+    up behind the pool.
+
+    Attributes:
+        iterations (int): PBKDF2 iteration count.
+        max_workers (int): Threads hashing in parallel.
+        max_pending (int): Hashes allowed to be queued or running at once.
+
+    Methods:
+        hash(password, salt): Hash a password on the calling thread.
+        hash_async(password, salt): Hash a password on the worker pool.
+        verify_async(password, password_hash, salt): Check a password on the worker pool.
+        shutdown(): Stop the worker threads.
+    '''
+
+    def __init__(self, iterations=PBKDF2_ITERATIONS, max_workers=2, max_pending=32):
+        self.iterations = iterations
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def hash(self, password, salt):
+        """Hashes a password using PBKDF2"""
+        began = time.perf_counter()
+        password_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), self.iterations).hex()
+        PBKDF2_SECONDS.observe(time.perf_counter() - began)
+        return password_hash
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="pbkdf2")
+            return self._executor
+
+    async def hash_async(self, password, salt):
+        """Hash a password on the worker pool without blocking the event loop"""
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                raise HashingBusyError("Too many password checks in progress, try again shortly")
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(self.hash, password, salt)
+        except BaseException:
+            self._release()
+            raise
+        # the slot is held until the thread is done hashing, even if the awaiter is cancelled
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future=None):
+        with self._pending_lock:
+            self._pending -= 1
+
+    async def verify_async(self, password, password_hash, salt):
+        """Verify a plaintext password against the hashed version"""
+        computed_hash = await self.hash_async(password, salt)
+        return hmac.compare_digest(computed_hash, password_hash)
+
+    def pending(self):
+        """Number of hashes queued or running"""
+        return self._pending
+
+    def shutdown(self):
+        """Stop the worker threads; they are restarted on the next hash"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+default_hasher = PasswordHasher()
@@ -3,18 +3,29 @@ import urllib.parse
 import sqlite3
 from datetime import datetime
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+import json
 from fastapi.staticfiles import StaticFiles
-from webbuilder import WebBuilder
+from webbuilder import role_menu
 
 from fastapi.security.api_key import APIKeyHeader
-import requests
-from dateutil import parser, tz
 import os
+import asyncio
+from contextlib import asynccontextmanager
 
-from permissions import validate_user, role_required
-from modules import Reservation, ReservationCalendar, UserManager, BusinessManager, DateRange, DatabaseManager
+from permissions import validate_user, validate_user_token, role_required, revocation_store, token_cache
+from modules import Reservation, ReservationCalendar, UserManager, BusinessManager, DateRange, DatabaseManager, UnavailableError, parse_datetime, format_db_datetime
 from token_manager import create_access_token
+from hashing import PasswordHasher, HashingBusyError
+from audit import AuditLogWriter, OperationLog
+from archive import OperationArchive
+from reservation_cache import ReservationCache
+from dispatch import BlockingDispatcher
+from federation import FederationClient
+from timezones import convert_timezone, convert_timezones
+from metrics import MetricsMiddleware, registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import RequestIdMiddleware, default_tracer
+from profiling import RequestProfiler, ProfilingMiddleware
 
 from schema import Reservation_Req, User, UserRole, UserLogin, Activation, BusinessRule, RemoteRequest
 
@@ -25,66 +36,202 @@ api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
 TIMEZONE = "GMT-5"
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-def convert_timezone(date_string, from_timezone, to_timezone):
-    """
-    Converts a datetime string from one timezone to another ."""
-
-    # dateutil uses opposite sign conventions
-    if "+" in from_timezone:
-        from_timezone = from_timezone.replace("+","-")
-    else:
-        from_timezone = from_timezone.replace("-","+")
-    
-    datetime_obj = parser.parse(date_string + ' ' + from_timezone)
-
-    to_timezone = tz.gettz(to_timezone)
-
-    # Convert the datetime object to the target timezone
-    datetime_obj = datetime_obj.astimezone(to_timezone)
+DB_PATH = os.environ.get("RESERVATION_DB", "../reservationDB.db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_OVERFLOW = int(os.environ.get("DB_POOL_OVERFLOW", 5))
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 300))  # seconds
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get("REVOCATION_REFRESH_INTERVAL", 1))  # seconds
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", 2))
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", 32))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 200))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 0.5))  # seconds
+AUDIT_MAX_QUEUE = int(os.environ.get("AUDIT_MAX_QUEUE", 10000))
+# comma separated base URLs of partner facilities, e.g. "http://a:8000,http://b:8000"
+FEDERATION_PEERS = [peer for peer in os.environ.get("FEDERATION_PEERS", "").split(",") if peer]
+FEDERATION_TIMEOUT = float(os.environ.get("FEDERATION_TIMEOUT", 3))  # seconds per partner
+OUTSIDE_BATCH_LIMIT = int(os.environ.get("OUTSIDE_BATCH_LIMIT", 500))  # requests per batch call
+OPERATIONS_PAGE_LIMIT = int(os.environ.get("OPERATIONS_PAGE_LIMIT", 1000))  # rows per /operations page
+RESERVATIONS_PAGE_LIMIT = int(os.environ.get("RESERVATIONS_PAGE_LIMIT", 1000))  # rows per /reservations page
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))  # rows fetched at a time by exports
+RESERVATION_CACHE_ENTRIES = int(os.environ.get("RESERVATION_CACHE_ENTRIES", 1024))  # 0 disables the cache
+RESERVATION_CACHE_MB = float(os.environ.get("RESERVATION_CACHE_MB", 64))
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", 0))  # 0 keeps every operation
+AUDIT_ARCHIVE_DIR = os.environ.get("AUDIT_ARCHIVE_DIR", "../archive")
+AUDIT_ARCHIVE_INTERVAL = float(os.environ.get("AUDIT_ARCHIVE_INTERVAL", 3600))  # seconds
+SQL_TRACE = os.environ.get("SQL_TRACE", "0") == "1"  # record every statement per request
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))  # 0 disables the slow-query log
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "")  # JSON lines file, empty keeps it in memory only
+PROFILING = os.environ.get("PROFILING", "0") == "1"  # installs the request profiler
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # share of requests profiled unasked
+PROFILE_MAX = int(os.environ.get("PROFILE_MAX", 50))  # profiles kept in memory
+
+# PBKDF2 runs on its own bounded pool so logins cannot starve reservation traffic
+password_hasher = PasswordHasher(max_workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING)
+
+# sqlite3 calls run on worker threads, at most one per pooled connection
+dispatcher = BlockingDispatcher(max_threads=DB_POOL_SIZE + DB_POOL_OVERFLOW)
+run_blocking = dispatcher.run
+
+# books at partner facilities when a machine is not available here
+federation = FederationClient(FEDERATION_PEERS, API_KEY, timeout=FEDERATION_TIMEOUT)
+
+# statements per request and slow statements with their query plans; the
+# shared tracer is configured in place because DatabaseManager is a singleton
+sql_tracer = default_tracer
+sql_tracer.enabled = SQL_TRACE
+sql_tracer.slow_query_ms = SLOW_QUERY_MS
+sql_tracer.log_path = SLOW_QUERY_LOG or None
+
+def is_admin_token(authorization):
+    """Whether an Authorization header belongs to an admin, who may ask for profiles"""
+    try:
+        return validate_user_token(authorization)[1] == "admin"
+    except HTTPException:
+        return False
 
-    # Format the datetime object back to string
-    return datetime_obj.strftime('%Y-%m-%d %H:%M')
+# cProfile for requests sent with X-Profile: 1 by an admin, or sampled
+request_profiler = RequestProfiler(sample_rate=PROFILE_SAMPLE_RATE, max_profiles=PROFILE_MAX,
+                                   authorize=is_admin_token)
 
 def get_db_manager():
-    return DatabaseManager('../reservationDB.db')
+    # DatabaseManager is a singleton, so every request shares one connection pool
+    return DatabaseManager(DB_PATH, pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_OVERFLOW,
+                           tracer=sql_tracer)
+
+# audit rows are written in batches off the request path
+audit_log = AuditLogWriter(get_db_manager, batch_size=AUDIT_BATCH_SIZE,
+                           flush_interval=AUDIT_FLUSH_INTERVAL, max_queue=AUDIT_MAX_QUEUE)
+
+# GET /reservations results, dropped when an overlapping booking changes
+reservation_cache = ReservationCache(max_entries=RESERVATION_CACHE_ENTRIES,
+                                     max_bytes=int(RESERVATION_CACHE_MB * 1024 * 1024))
+
+# old audit rows are moved out of the database into compressed segments
+operation_archive = OperationArchive(AUDIT_ARCHIVE_DIR, get_db_manager, retention_days=AUDIT_RETENTION_DAYS)
+
+# logged-out tokens are shared with every worker through the database
+revocation_store.attach(get_db_manager)
+
+def pool_stats():
+    pool = get_db_manager().pool
+    if pool is None:
+        return {}
+    stats = pool.stats()
+    return {(state,): stats[state] for state in ("idle", "checked_out", "waiting")}
+
+def cache_counts(cache):
+    stats = cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+# read at scrape time, so serving a request costs nothing extra
+registry.gauge("db_pool_connections", "Pooled database connections by state, and callers waiting for one",
+               pool_stats, ("state",))
+registry.gauge("dispatcher_threads_max", "Blocking calls allowed to run at once", lambda: dispatcher.max_threads)
+registry.gauge("audit_log_queue_depth", "Audit log rows waiting to be written", lambda: audit_log.stats()["queued"])
+registry.gauge("audit_log_rows_total", "Audit log rows by outcome",
+               lambda: {(outcome,): count for outcome, count in audit_log.stats().items() if outcome != "queued"},
+               ("outcome",), type="counter")
+registry.gauge("pbkdf2_hashes_pending", "Password hashes queued or running", password_hasher.pending)
+registry.gauge("reservation_cache_lookups_total", "GET /reservations cache lookups by result",
+               lambda: cache_counts(reservation_cache), ("result",), type="counter")
+registry.gauge("reservation_cache_hit_ratio", "Share of GET /reservations cache lookups that hit",
+               lambda: reservation_cache.stats()["hit_ratio"])
+registry.gauge("reservation_cache_bytes", "Approximate memory held by the GET /reservations cache",
+               lambda: reservation_cache.stats()["bytes"])
+registry.gauge("token_cache_lookups_total", "Verified token cache lookups by result",
+               lambda: cache_counts(token_cache), ("result",), type="counter")
+
+async def checkpoint_periodically(interval):
+    """Fold the WAL back into the database file every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(get_db_manager().checkpoint, "PASSIVE")
+        except sqlite3.Error as e:
+            print("Failed to checkpoint database: ", str(e))
+
+async def refresh_revocations_periodically(interval):
+    """Pick up tokens other workers revoked every interval seconds, off the event loop"""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(revocation_store.refresh)
+
+async def archive_periodically(interval):
+    """Move operations past the retention horizon to the archive every interval seconds"""
+    while True:
+        try:
+            await asyncio.to_thread(operation_archive.run)
+        except (sqlite3.Error, OSError) as e:
+            print("Failed to archive operations: ", str(e))
+        await asyncio.sleep(interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_db_manager().apply_migrations()
+    # warm the in-memory availability index before the first booking
+    ReservationCalendar(get_db_manager()).sync_availability()
+    audit_log.start()
+    # validate_user only reads the in-memory revocations; load and refresh them here
+    await asyncio.to_thread(revocation_store.refresh)
+    revocation_refresher = asyncio.create_task(refresh_revocations_periodically(REVOCATION_REFRESH_INTERVAL))
+    checkpointer = asyncio.create_task(checkpoint_periodically(CHECKPOINT_INTERVAL))
+    archiver = None
+    if AUDIT_RETENTION_DAYS > 0:
+        archiver = asyncio.create_task(archive_periodically(AUDIT_ARCHIVE_INTERVAL))
+    yield
+    revocation_refresher.cancel()
+    checkpointer.cancel()
+    if archiver is not None:
+        archiver.cancel()
+    # commit queued audit rows before the database is closed
+    await asyncio.to_thread(audit_log.stop)
+    await federation.aclose()
+    db_manager = get_db_manager()
+    try:
+        # leave an empty WAL behind so the database file is self-contained
+        db_manager.checkpoint("TRUNCATE")
+    except sqlite3.Error as e:
+        print("Failed to checkpoint database: ", str(e))
+    # close pooled connections on shutdown
+    db_manager.close()
+    password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+if PROFILING:
+    # innermost, so a profile holds only the request itself
+    app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+# per-route latency histograms, exposed on GET /metrics
+app.add_middleware(MetricsMiddleware)
+# X-Request-ID, which groups the statements of a request in the SQL trace
+app.add_middleware(RequestIdMiddleware)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
 
 def get_business_manager(db_manager: DatabaseManager = Depends(get_db_manager)):
     return BusinessManager(db_manager)
 
 def get_user_manager(db_manager: DatabaseManager = Depends(get_db_manager)):
-    return UserManager(db_manager)
+    return UserManager(db_manager, password_hasher, dispatcher)
 
-def get_calendar(db_manager: DatabaseManager = Depends(get_db_manager)):
-    return ReservationCalendar(db_manager)
+def get_operation_log(db_manager: DatabaseManager = Depends(get_db_manager)):
+    return OperationLog(db_manager)
 
+def get_calendar(db_manager: DatabaseManager = Depends(get_db_manager),
+                 business_manager: BusinessManager = Depends(get_business_manager)):
+    # FastAPI resolves get_business_manager once per request, so the calendar
+    # shares the route's BusinessManager instead of building its own
+    return ReservationCalendar(db_manager, business_manager, reservation_cache)
 
 
-# async def log_operation(username, type, description, timestamp, db_manager: DatabaseManager = Depends(get_db_manager)):
 def log_operation(username, type, description, timestamp):
     """
-    Logs user operations to the database
-    """
-    try:
-        timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        
-        with sqlite3.connect('../reservationDB.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id FROM USER WHERE username = ?",(username,))
-            user_id = cursor.fetchone()[0]
-            query = """
-                    INSERT INTO Operation (user_id, type, description, timestamp)
-                    VALUES (?, ?, ?, ?)
-                    """
-            cursor.execute(query, (user_id, type, description, timestamp))
-            conn.commit()
-
+    Logs user operations to the database.
 
-    except sqlite3.Error as e:
-        print("Failed to log operation: ", str(e))
+    The row is queued and written by the audit log writer in the background,
+    so the request does not wait for the INSERT to commit.
+    """
+    audit_log.log(username, type, description, timestamp)
 
 
 @app.get("/")
@@ -93,30 +240,33 @@ async def root(request: Request):
 
 
 @app.get("/login-form", response_class=JSONResponse)
-async def get_login_form():
-    menu = WebBuilder()
-    menuJson = menu.build_menu()
-    if menuJson is not None:
-        return JSONResponse(content=menuJson)
- 
-    return JSONResponse(content={"error": "Login form not found"}, status_code=404)
+async def get_login_form(request: Request):
+    menu = role_menu('unverified')
+    # the form only changes with the code; clients revalidate with If-None-Match
+    headers = {"ETag": menu.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == menu.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=menu.body, media_type="application/json", headers=headers)
 
 
 @app.post("/login")
-async def login(userlog: UserLogin,
+async def login(request: Request,
+                userlog: UserLogin,
                 user_manager: UserManager = Depends(get_user_manager)):
     """
     Authenticate a user and return an access token.
 
     Args:
+        request (Request): The request object. If its If-None-Match header
+            matches the role's interface_etag, the interface is left out.
         userlog (UserLogin): The user's login credentials.
         user_manager (UserManager): The user manager dependency.
 
     Returns:
-        dict: The access token, token type, and user interface.
+        dict: The access token, token type, interface ETag and user interface.
     """
     try:
-        user = user_manager.authenticate_user(userlog.username, userlog.password)
+        user = await user_manager.authenticate_user_async(userlog.username, userlog.password)
         if not user:
             raise HTTPException(status_code=401, detail="Incorrect username or password")
         if user and userlog.password.startswith('_temp'):
@@ -126,13 +276,19 @@ async def login(userlog: UserLogin,
                                                     })
         log_operation(user['username'],"login", f"{user['username']} logged in", datetime.now())
         
-        menu = WebBuilder(user['role'])
-        menuJson = menu.build_menu()
-        
-        return {"access_token": access_token, "token_type": "bearer", "interface": menuJson}
+        menu = role_menu(user['role'])
+        payload = {"access_token": access_token, "token_type": "bearer", "interface_etag": menu.etag}
+        if request.headers.get("If-None-Match") == menu.etag:
+            # the client already holds this interface
+            return payload
+        return Response(content=menu.embed(payload), media_type="application/json")
     
     except HTTPException as http_exc:
         raise http_exc
+
+    except HashingBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=str(e), headers={"Retry-After": "1"})
     
     except Exception as e:
         # Log the exception details for debugging purposes
@@ -154,6 +310,18 @@ async def logout(request: Request):
     Returns:
         dict: A message indicating successful logout.
     """
+    token = request.headers.get('Authorization')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    # validate_user already verified the token; reuse its claims
+    claims = request.state.claims
+    try:
+        if claims.get("jti"):
+            await run_blocking(revocation_store.revoke, claims["jti"], claims["exp"])
+        token_cache.discard(token)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'Failed to log out due to {e}')
 
     log_operation(request.state.user, "logout", f"{request.state.user} logged out", datetime.now())
     return {"message": "Logged out successfully"}
@@ -183,9 +351,12 @@ async def add_user(request: Request,
     try:
         salt = 'salty'
         pwd = '_temp'+user_request.password
-        user_manager.add_user(user_request.username, pwd, user_request.role, salt)  
+        await user_manager.add_user_async(user_request.username, pwd, user_request.role, salt)  
         log_operation(request.state.user, "add user", f"{user_request.username} user added", datetime.now())
         return {"message": f'{user_request.username} added successfully'}
+    except HashingBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f'Failed to add user due to {e}')
@@ -235,7 +406,7 @@ async def configure_business_rules(request: Request,
 
     try:
 
-        bizManager.update_rule(rule, value) 
+        await run_blocking(bizManager.update_rule, rule, value)
         #calendar.update_settings(**update_data)  
         return {"message": f'business rules updated successfully'}
     except Exception as e:
@@ -254,29 +425,30 @@ add_reservation_permissions = {
 }
 
 
-# def attempt_remote_reservation(reservation):
-#     try:
-#         data={
-#             "start_time":reservation.daterange.start_date,
-#             "end_time":reservation.daterange.end_date,
-#             "client_name":reservation.customer,
-#             "machine_name":reservation.machine,
-#             "time_zone":"GMT-5",
-#             "blocks":"Null"
-#         }
-
-#         remote_endpoints = [] # store urls for the 3 teams' endpoints here
-#         headers={"API-Key":API_KEY}
-#         for url in remote_endpoints:
-#             response = requests.post(url, headers=headers,json=data)
-#             if response.json()['reservation_made_success']:
-#                 return {"message": "Reservation added successfully at a remote facility!"}
-    
-#         return {"message":"Reservation was not made due to unavailable resources"}
-    
-#     except Exception as e:
-#         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-#                              detail=f'Failed to add reservation due to {e}')
+async def attempt_remote_reservation(reservation):
+    """
+    Book a reservation at the first partner facility that has the machine available.
+
+    Returns:
+        dict: The partner's answer and per-partner details, or None if no partner booked it.
+    """
+    if not federation.peers:
+        return None
+    data={
+        "start_time":reservation.daterange.start_date.strftime('%Y-%m-%d %H:%M'),
+        "end_time":reservation.daterange.end_date.strftime('%Y-%m-%d %H:%M'),
+        "client_name":reservation.customer,
+        "machine_name":reservation.machine,
+        "time_zone":TIMEZONE,
+        "blocks":"Null"
+    }
+    result = await federation.reserve(data)
+    if result["late"]:
+        print(f"Reservation for {reservation.customer} was also booked at {result['late']}")
+    if result["peer"] is None:
+        print("No partner facility could take the reservation: ", result["errors"])
+        return None
+    return result
 
 
 @app.post("/reservations", status_code=status.HTTP_201_CREATED)
@@ -306,7 +478,7 @@ async def add_reservation(request: Request,
         if request.state.role == "customer" and reservation_request.customer is None:
             reservation_request.customer = request.state.user
 
-        if not user_manager.is_user_active(reservation_request.customer) or not user_manager.is_user_active(request.state.user): #Need to come back to. 
+        if not await run_blocking(user_manager.is_user_active, reservation_request.customer) or not await run_blocking(user_manager.is_user_active, request.state.user): #Need to come back to. 
             # reservation cannot be made by/for deactivated users
             raise HTTPException(status_code=400, 
                                 detail="This user is deactivated and cannot make reservations.")
@@ -314,7 +486,19 @@ async def add_reservation(request: Request,
         reservation_date = DateRange(reservation_request.start_date, reservation_request.end_date)
         reservation = Reservation(reservation_request.customer, reservation_request.machine, reservation_date, business_manager)
 
-        calendar.add_reservation(reservation)
+        try:
+            await run_blocking(calendar.add_reservation, reservation)
+        except UnavailableError:
+            remote = await attempt_remote_reservation(reservation)
+            if remote is None:
+                raise
+            log_operation(request.state.user,
+                          "add remote reservation",
+                          f"reservation for machine {reservation_request.machine} added at {remote['peer']}",
+                          datetime.now())
+            return {"message": "Reservation added successfully at a remote facility!",
+                    "facility": remote["peer"],
+                    "details": remote["response"]["message"]}
 
         log_operation(request.state.user, 
                       "add reservation", 
@@ -323,7 +507,6 @@ async def add_reservation(request: Request,
         return {"message": "Reservation added successfully!"}
    
     except Exception as e:
-        # attempt_remote_reservation(reservation) # change this to catch specific error of no availability
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f'Failed to add reservation due to {e}')
 
@@ -337,6 +520,17 @@ get_reservations_prmissions = {
     "customer": is_customer_accessing_own_data
 }
 
+def render_reservations(reservations, next_cursor):
+    # the encoded body is what the reservation cache keeps, so a repeated
+    # poll skips both the query and JSON encoding
+    if reservations:
+        return json.dumps({"reservations": reservations}).encode()
+    else:
+        return json.dumps({"message": "No reservations found for the given criteria."}).encode()
+
+def render_reservations_page(reservations, next_cursor):
+    return json.dumps({"reservations": reservations, "next_cursor": next_cursor}).encode()
+
 @app.get("/reservations", status_code=status.HTTP_200_OK)
 @validate_user
 @role_required(get_reservations_prmissions)
@@ -345,20 +539,31 @@ async def get_reservations(request: Request,
                            machine: str = Query(None, description="Machine to get records for"),
                            start_date: str = Query(..., description="Start date of the reservation period"),
                            end_date: str = Query(..., description="End date of the reservation period"),
+                           limit: int = Query(None, ge=1, description="Reservations per page"),
+                           cursor: str = Query(None, description="next_cursor of the previous page"),
+                           fields: str = Query(None, description="Comma separated columns to return"),
                            calendar: ReservationCalendar = Depends(get_calendar)):
     """
     Retrieve reservations based on customer, machine, and date range.
 
+    Without limit every matching reservation is returned. With limit the
+    reservations come in pages ordered by start date, and next_cursor is
+    passed back as cursor to get the next page.
+
     Args:
         request (Request): The request object.
         customer (str): The customer name.
         machine (str): The machine name.
         start_date (str): The start date of the reservation period.
         end_date (str): The end date of the reservation period.
+        limit (int): Reservations per page, at most RESERVATIONS_PAGE_LIMIT.
+        cursor (str): The next_cursor of the previous page.
+        fields (str): Comma separated columns to return, e.g. "reservation_id,start_date".
         calendar (ReservationCalendar): The reservation calendar dependency.
 
     Returns:
-        dict: The reservations that match the given criteria.
+        dict: The reservations that match the given criteria, and the cursor
+        of the next page when limit is given.
     """
 
     try:
@@ -371,30 +576,37 @@ async def get_reservations(request: Request,
         start = urllib.parse.unquote(start_date)
         end = urllib.parse.unquote(end_date)
         daterange = DateRange(start, end)
+        paginated = limit is not None or cursor is not None
+        if paginated:
+            limit = min(limit or RESERVATIONS_PAGE_LIMIT, RESERVATIONS_PAGE_LIMIT)
+        if fields is not None:
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
 
         if customer and machine:
-            reservations = calendar.retrieve_by_machine_and_customer(daterange, machine, customer)
             logstring = f'Listed reservations for customer: {customer}, machine: {machine}'
         elif customer:
-            reservations = calendar.retrieve_by_customer(daterange, customer)
             logstring = f'Listed reservations for customer: {customer} in daterange: {daterange}'
         elif machine:
-            reservations = calendar.retrieve_by_machine(daterange, machine)
             logstring = f'Listed reservations for machine: {machine} in daterange: {daterange}'
         else:
-            reservations = calendar.retrieve_by_date(daterange)
             logstring = f'Listed reservations in daterange: {daterange}'
+        try:
+            body = await run_blocking(calendar.retrieve, daterange, machine, customer,
+                                      fields=fields, cursor=cursor, limit=limit,
+                                      render=render_reservations_page if paginated else render_reservations)
+        except ValueError as e:
+            # an unknown field or a malformed cursor
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
         log_operation(request.state.user,
                       "list reservations",
                       logstring,
                       datetime.now())
 
-        if reservations:
-            return {"reservations": reservations}
-        else:
-            return {"message": "No reservations found for the given criteria."}
+        return Response(content=body, media_type="application/json")
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f'Failed to get reservations due to {e}')
@@ -402,6 +614,76 @@ async def get_reservations(request: Request,
 
 
 
+reservation_cache_permissions = {
+    "admin": None
+}
+@app.get("/reservations/cache", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(reservation_cache_permissions)
+async def reservation_cache_stats(request: Request):
+    """
+    Report how well the GET /reservations result cache is doing.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        dict: Hit, miss, eviction and invalidation counters and the cache size.
+    """
+    return reservation_cache.stats()
+
+
+@app.get("/reservations/export", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(get_reservations_prmissions)
+async def export_reservations(request: Request,
+                              customer: str = Query(None, description="Customer name"),
+                              machine: str = Query(None, description="Machine to get records for"),
+                              start_date: str = Query(..., description="Start date of the reservation period"),
+                              end_date: str = Query(..., description="End date of the reservation period"),
+                              format: str = Query("ndjson", description="ndjson or csv"),
+                              fields: str = Query(None, description="Comma separated columns to export"),
+                              calendar: ReservationCalendar = Depends(get_calendar)):
+    """
+    Stream every reservation in a date range as NDJSON or CSV.
+
+    Rows are read from the database cursor in chunks and sent as they are
+    encoded, so exporting a whole quarter uses no more memory than a page.
+
+    Args:
+        request (Request): The request object.
+        customer (str): The customer name.
+        machine (str): The machine name.
+        start_date (str): The start date of the reservation period.
+        end_date (str): The end date of the reservation period.
+        format (str): "ndjson" (one JSON object per line) or "csv".
+        fields (str): Comma separated columns to export, all columns if omitted.
+        calendar (ReservationCalendar): The reservation calendar dependency.
+
+    Returns:
+        StreamingResponse: The reservations ordered by start date.
+    """
+    if request.state.role == "customer" and customer is None:
+        customer = request.state.user
+    try:
+        daterange = DateRange(urllib.parse.unquote(start_date), urllib.parse.unquote(end_date))
+        if fields is not None:
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+        # check the fields before the response starts; errors cannot be sent once it has
+        calendar.validate_query(fields, format)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    log_operation(request.state.user,
+                  "export reservations",
+                  f'Exported reservations for customer: {customer}, machine: {machine} in daterange: {daterange}',
+                  datetime.now())
+
+    chunks = dispatcher.iterate(calendar.export, daterange, machine, customer, fields, format, EXPORT_CHUNK_SIZE)
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="reservations.{format}"'})
+
+
 def is_customer_deleting_their_data(user_username, **kwargs):
     customer_name = kwargs.get('customer')
     return user_username == customer_name
@@ -432,7 +714,7 @@ async def cancel_reservation(request: Request,
         or HTTP 404 error if reservation not found
     """
     try:
-        refund = calendar.remove_reservation(reservation_id)
+        refund = await run_blocking(calendar.remove_reservation, reservation_id)
         if refund is not False: # reservation was removed and refund amount returned
             log_operation(request.state.user,
                       "cancel reservation", 
@@ -470,7 +752,8 @@ async def remove_user(request: Request,
         dict: A message indicating successful deletion of the user.
     """
     try:
-        user_manager.remove_user(username)
+        await run_blocking(user_manager.remove_user, username)
+        audit_log.forget_user(username)
         log_operation(request.state.user,
                       "remove user", 
                       f"{username} user removed", 
@@ -506,7 +789,7 @@ async def update_user_role(request: Request,
     """
     
     try:
-        user_manager.update_user_role(role_request.role, role_request.username)
+        await run_blocking(user_manager.update_user_role, role_request.role, role_request.username)
         log_operation(request.state.user,
                       "change user role", 
                       f"{role_request.username} role changed to {role_request.role}", 
@@ -564,7 +847,7 @@ async def update_user_password(request: Request,
         if request.state.role == "admin" and user_request.username is not request.state.user:
             pwd = '_temp'+pwd
         
-        user_manager.update_password(user_request.username, pwd, salt)
+        await user_manager.update_password_async(user_request.username, pwd, salt)
 
         log_operation(request.state.user,
                       "change user password", 
@@ -572,6 +855,9 @@ async def update_user_password(request: Request,
                       datetime.now())
         return {"message": f"password for {user_request.username} was changed successfully"}
 
+    except HashingBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=str(e), headers={"Retry-After": "1"})
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -603,13 +889,16 @@ async def update_temp_password(request: Request,
         elif user_request.salt == None:
             user_request.salt = os.urandom(32).hex()
 
-        user_manager.update_password(user_request.username, user_request.password, user_request.salt)
+        await user_manager.update_password_async(user_request.username, user_request.password, user_request.salt)
         log_operation(user_request.username,
                       "change user password", 
                       f"Password changed for {user_request.username}", 
                       datetime.now())
         return {"message": f"password for {user_request.username} was changed successfully"}
 
+    except HashingBusyError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=str(e), headers={"Retry-After": "1"})
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -641,7 +930,7 @@ async def deactivate_user(request: Request,
         dict: A message indicating successful deactivation of the user.
     """
     try:
-        user_manager.deactivate_user(user_request.username)
+        await run_blocking(user_manager.deactivate_user, user_request.username)
         log_operation(request.state.user,
                       "deactivate user", 
                       f"Deactivated user {user_request.username}", 
@@ -673,7 +962,7 @@ async def activate_user(request: Request,
     """
     
     try:
-        user_manager.activate_user(user_request.username)
+        await run_blocking(user_manager.activate_user, user_request.username)
         log_operation(request.state.user,
                       "activate user", 
                       f"Activated user {user_request.username}", 
@@ -705,7 +994,7 @@ async def list_users(request: Request,
 
 
     try:
-        users_status = user_manager.list_users()
+        users_status = await run_blocking(user_manager.list_users)
         print(f'users_status: {users_status}')
         log_operation(request.state.user,
                       "list users' status", 
@@ -718,6 +1007,115 @@ async def list_users(request: Request,
                     detail=f'Failed to list users due to {e}')
     
 
+view_operations_permissions = {
+    "admin": None
+}
+@app.get("/operations", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(view_operations_permissions)
+async def list_operations(request: Request,
+                          username: str = Query(None, description="Only operations by this user"),
+                          type: str = Query(None, description="Only operations of this type"),
+                          since: str = Query(None, description="Only operations at or after this time"),
+                          until: str = Query(None, description="Only operations before this time"),
+                          cursor: str = Query(None, description="next_cursor of the previous page"),
+                          limit: int = Query(100, ge=1, description="Operations per page"),
+                          stream: bool = Query(False, description="Stream every matching operation as NDJSON"),
+                          operation_log: OperationLog = Depends(get_operation_log)):
+    """
+    List audit log operations, newest first.
+
+    Args:
+        request (Request): The request object.
+        username (str): Only operations by this user.
+        type (str): Only operations of this type.
+        since (str): Only operations at or after this 'YYYY-MM-DD HH:MM' time.
+        until (str): Only operations before this 'YYYY-MM-DD HH:MM' time.
+        cursor (str): The next_cursor of the previous page.
+        limit (int): Operations per page, at most OPERATIONS_PAGE_LIMIT.
+        stream (bool): Stream every matching operation, one JSON object per line.
+        operation_log (OperationLog): The operation log dependency.
+
+    Returns:
+        dict: One page of operations and the cursor of the next page, or a
+        streamed NDJSON response.
+    """
+    try:
+        filters = {"user": username, "type": type,
+                   "since": format_db_datetime(parse_datetime(since)) if since else None,
+                   "until": format_db_datetime(parse_datetime(until)) if until else None}
+        if cursor is not None:
+            OperationLog.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    limit = min(limit, OPERATIONS_PAGE_LIMIT)
+
+    log_operation(request.state.user,
+                  "list operations",
+                  f"Listed operations for user: {username}, type: {type}, since: {since}, until: {until}",
+                  datetime.now())
+
+    if stream:
+        async def lines(cursor):
+            # each page is read on its own, so no connection is held between pages
+            while True:
+                rows, cursor = await run_blocking(operation_log.page, cursor=cursor, limit=limit, **filters)
+                if rows:
+                    yield "".join(json.dumps(row) + "\n" for row in rows)
+                if cursor is None:
+                    return
+        return StreamingResponse(lines(cursor), media_type="application/x-ndjson")
+
+    try:
+        operations, next_cursor = await run_blocking(operation_log.page, cursor=cursor, limit=limit, **filters)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'Failed to list operations due to {e}')
+    return {"operations": operations, "next_cursor": next_cursor}
+
+
+@app.get("/operations/archive", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(view_operations_permissions)
+async def list_archived_operations(request: Request,
+                                   username: str = Query(None, description="Only operations by this user"),
+                                   type: str = Query(None, description="Only operations of this type"),
+                                   since: str = Query(None, description="Only operations at or after this time"),
+                                   until: str = Query(None, description="Only operations before this time")):
+    """
+    Stream archived audit log operations, oldest first, as NDJSON.
+
+    Args:
+        request (Request): The request object.
+        username (str): Only operations by this user.
+        type (str): Only operations of this type.
+        since (str): Only operations at or after this 'YYYY-MM-DD HH:MM' time.
+        until (str): Only operations before this 'YYYY-MM-DD HH:MM' time.
+
+    Returns:
+        StreamingResponse: One JSON object per line.
+    """
+    try:
+        since = format_db_datetime(parse_datetime(since)) if since else None
+        until = format_db_datetime(parse_datetime(until)) if until else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    log_operation(request.state.user,
+                  "list archived operations",
+                  f"Listed archived operations for user: {username}, type: {type}, since: {since}, until: {until}",
+                  datetime.now())
+
+    archive = operation_archive
+    async def lines():
+        # one segment (one day) is decompressed at a time, off the event loop
+        for segment in await run_blocking(archive.segments, since, until):
+            rows = await run_blocking(archive.read_segment, segment, username, type, since, until)
+            if rows:
+                yield "".join(json.dumps(row) + "\n" for row in rows)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 def api_key_auth(api_key: str = Security(api_key_header)):
     if api_key == API_KEY:
         return api_key
@@ -728,6 +1126,138 @@ def api_key_auth(api_key: str = Security(api_key_header)):
         )
 
 
+@app.get("/metrics")
+async def metrics(api_key: str = Depends(api_key_auth)):
+    """
+    Expose request, query, pool, queue and cache metrics in the Prometheus
+    text format. Scrapers authenticate with the same API key as partner
+    facilities.
+
+    Returns:
+        Response: The text exposition of every metric.
+    """
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+sql_trace_permissions = {
+    "admin": None
+}
+@app.get("/debug/sql", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(sql_trace_permissions)
+async def list_sql_traces(request: Request):
+    """
+    List the requests whose SQL was traced (SQL_TRACE=1), newest first.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        dict: Whether tracing is on, and each request's statement count and total SQL time.
+    """
+    return {"enabled": sql_tracer.enabled, "requests": sql_tracer.requests()}
+
+
+@app.get("/debug/sql/{request_id}", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(sql_trace_permissions)
+async def get_sql_trace(request: Request, request_id: str):
+    """
+    Return every statement a request ran, in order.
+
+    Args:
+        request (Request): The request object.
+        request_id (str): The X-Request-ID of the traced request.
+
+    Returns:
+        dict: The statements with their duration, row count and calling method.
+    """
+    trace = sql_tracer.trace(request_id)
+    if trace is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"No SQL trace for request {request_id}")
+    return trace
+
+
+@app.get("/debug/slow-queries", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(sql_trace_permissions)
+async def list_slow_queries(request: Request):
+    """
+    Return the statements that took SLOW_QUERY_MS or longer, newest first.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        dict: The threshold and the slow statements with their query plans.
+    """
+    return {"threshold_ms": sql_tracer.slow_query_ms, "queries": sql_tracer.slow_queries()}
+
+
+profile_permissions = {
+    "admin": None
+}
+@app.get("/debug/profiles", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(profile_permissions)
+async def list_profiles(request: Request):
+    """
+    List the kept request profiles, newest first.
+
+    With PROFILING=1, an admin request sent with an X-Profile: 1 header is
+    profiled, and so is a PROFILE_SAMPLE_RATE share of all requests.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        dict: Whether profiling is on, and each profile's id, route, status and duration.
+    """
+    return {"enabled": PROFILING, "profiles": request_profiler.profiles()}
+
+
+@app.get("/debug/profiles/{profile_id}", status_code=status.HTTP_200_OK)
+@validate_user
+@role_required(profile_permissions)
+async def get_profile(request: Request, profile_id: int,
+                      format: str = Query("text", description="text or pstats"),
+                      sort: str = "cumulative",
+                      limit: int = Query(50, ge=1)):
+    """
+    Return one request profile.
+
+    Args:
+        request (Request): The request object.
+        profile_id (int): The id listed by GET /debug/profiles.
+        format (str): text for a pstats report, pstats for the raw data
+            (load it with pstats.Stats or snakeviz).
+        sort (str): pstats sort key of the text report, e.g. cumulative or tottime.
+        limit (int): Functions listed in the text report.
+
+    Returns:
+        Response: The report or the pstats file.
+    """
+    if format not in ("text", "pstats"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown profile format: {format}")
+    if format == "pstats":
+        data = request_profiler.pstats_data(profile_id)
+        if data is not None:
+            return Response(content=data, media_type="application/octet-stream",
+                            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'})
+    else:
+        try:
+            data = request_profiler.text(profile_id, sort, limit)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown sort key: {sort}")
+        if data is not None:
+            return Response(content=data, media_type="text/plain")
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"No profile {profile_id}")
+
+
 @app.post("/outside-requests")
 async def handle_requests(request:Request, remote_request: RemoteRequest, 
                           calendar: ReservationCalendar = Depends(get_calendar),
@@ -762,7 +1292,7 @@ async def handle_requests(request:Request, remote_request: RemoteRequest,
                                   reservation_date,
                                   business_manager)
         
-        calendar.add_reservation(reservation, True)
+        await run_blocking(calendar.add_reservation, reservation, True)
         return {"reservation_made_success":True,
                 "message":f"({reservation.cost},{reservation.down_payment})"} 
     
@@ -774,6 +1304,79 @@ async def handle_requests(request:Request, remote_request: RemoteRequest,
 
 
    
+@app.post("/outside-requests/batch")
+async def handle_batch_requests(request: Request, remote_requests: list[RemoteRequest],
+                                calendar: ReservationCalendar = Depends(get_calendar),
+                                api_key: str = Depends(api_key_auth),
+                                business_manager: BusinessManager = Depends(get_business_manager)
+                                ):
+    """
+    Handle many outside reservation requests in one call.
+
+    Args:
+        request (Request): The request object.
+        remote_requests (list[RemoteRequest]): The remote reservation requests.
+        calendar (ReservationCalendar): The reservation calendar dependency.
+        api_key (str): The API key for authentication.
+        business_manager (BusinessManager): The business manager dependency.
+
+    Returns:
+        dict: One result per request, in order, with success, cost and down payment.
+    """
+    if len(remote_requests) > OUTSIDE_BATCH_LIMIT:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {OUTSIDE_BATCH_LIMIT} requests per batch")
+
+    # convert every time sent in the same time zone at once
+    by_zone = {}
+    for remote_request in remote_requests:
+        by_zone.setdefault(remote_request.time_zone, set()).update(
+            (remote_request.start_time, remote_request.end_time))
+    converted = {}
+    for time_zone, times in by_zone.items():
+        times = list(times)
+        try:
+            converted.update(zip(((time, time_zone) for time in times),
+                                 convert_timezones(times, time_zone, TIMEZONE)))
+        except ValueError:
+            pass  # left to convert one at a time so only the bad requests fail
+
+    def local_time(time, time_zone):
+        if (time, time_zone) not in converted:
+            converted[(time, time_zone)] = convert_timezone(time, time_zone, TIMEZONE)
+        return converted[(time, time_zone)]
+
+    reservations = []
+    for remote_request in remote_requests:
+        try:
+            reservation_date = DateRange(local_time(remote_request.start_time, remote_request.time_zone),
+                                         local_time(remote_request.end_time, remote_request.time_zone))
+            reservations.append(Reservation(remote_request.client_name,
+                                            remote_request.machine_name,
+                                            reservation_date,
+                                            business_manager))
+        except Exception as e:
+            reservations.append(e)
+
+    try:
+        outcomes = await run_blocking(calendar.add_remote_reservations, reservations)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'Failed to add reservations due to {e}')
+
+    results = []
+    for reservation, error in zip(reservations, outcomes):
+        if error is None:
+            results.append({"reservation_made_success": True,
+                            "cost": reservation.cost,
+                            "down_payment": reservation.down_payment,
+                            "message": f"({reservation.cost},{reservation.down_payment})"})
+        else:
+            results.append({"reservation_made_success": False,
+                            "message": f"{error}"})
+    return {"results": results}
+
+
 del_remote_reservation_permissions = {
     "admin": None,
     "scheduler": None
@@ -800,7 +1403,7 @@ async def cancel_remote_reservation(request: Request,
 
    
     try:
-        refund = calendar.remove_remote_reservation(reservation_id)
+        refund = await run_blocking(calendar.remove_remote_reservation, reservation_id)
         print(f'refund: {refund} in cancel_reservation')
         if refund is not False: # reservation was removed and refund amount returned
             return {"message": "Reservation cancelled successfully", "refund": refund}
@@ -833,7 +1436,7 @@ async def list_remote(request: Request,
     """
 
     try:
-        reservations = calendar.list_remote_reservations()
+        reservations = await run_blocking(calendar.list_remote_reservations)
         if reservations:
             return {"reservations":reservations}
         else:
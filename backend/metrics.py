@@ -0,0 +1,332 @@
+# metrics.py
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+# seconds; from a cached lookup up to a slow PBKDF2 login
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    # Every thread records into its own dict, so recording never takes a
+    # lock or contends with another thread; collect() adds the shards up.
+    # Worker threads come and go, so once a thread has exited its shard is
+    # folded into a retired total and dropped, keeping the list short.
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        # called with _shards_lock held; a dead thread's shard no longer changes
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _merge(self, totals, shard):
+        raise NotImplementedError
+
+    def _snapshot(self):
+        with self._shards_lock:
+            self._retire_dead()
+            shards = [shard for _, shard in self._shards]
+            retired = {}
+            self._merge(retired, self._retired)
+        # copy each shard first; its thread may add labels while we read
+        return [retired] + [dict(shard) for shard in shards]
+
+    def _totals(self):
+        totals = {}
+        for shard in self._snapshot():
+            self._merge(totals, shard)
+        return totals
+
+
+class Counter(_Sharded):
+    '''
+    A monotonically increasing count, optionally split by labels.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): One line description.
+        labels (tuple of str): Label names.
+
+    Methods:
+        inc(*labels, amount=1): Add amount to the count of a label set.
+        collect(): Exposition text lines.
+    '''
+
+    def __init__(self, name, help, labels=()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def values(self):
+        """Total count per label set"""
+        return self._totals()
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Sharded):
+    '''
+    Counts observations (usually durations in seconds) into cumulative
+    buckets, optionally split by labels.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): One line description.
+        labels (tuple of str): Label names.
+        buckets (tuple of float): Upper bounds of the buckets.
+
+    Methods:
+        observe(value, *labels): Record one observation.
+        time(*labels): Context manager observing the duration of a block.
+        collect(): Exposition text lines.
+    '''
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def _merge(self, totals, shard):
+        for labels, counts in shard.items():
+            counts = list(counts)
+            total = totals.setdefault(labels, [0] * len(counts))
+            for i, value in enumerate(counts):
+                total[i] += value
+
+    def values(self):
+        """Per label set: (per-bucket counts including +Inf, sum)"""
+        return {labels: (total[:-1], total[-1]) for labels, total in self._totals().items()}
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "began")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.began, *self.labels)
+
+
+class Gauge:
+    '''
+    A value read at scrape time from a callback, e.g. a pool size. With
+    type="counter" it exposes a count some other object already keeps.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): One line description.
+        labels (tuple of str): Label names.
+        read (callable): Returns a number, or a dict of label tuple -> number.
+        type (str): "gauge" or "counter".
+
+    Methods:
+        collect(): Exposition text lines.
+    '''
+
+    def __init__(self, name, help, read, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = tuple(labels)
+        self.type = type
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"Failed to read metric {self.name}: {e}")
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in sorted(values.items()):
+            if number is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(number)}")
+        return lines
+
+
+class Registry:
+    '''
+    The metrics exposed on /metrics.
+
+    Methods:
+        counter(name, help, labels): Create and register a Counter.
+        histogram(name, help, labels, buckets): Create and register a Histogram.
+        gauge(name, help, read, labels, type): Register a Gauge read at scrape time.
+        render(): The Prometheus text exposition of every metric.
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # re-registering a name (e.g. a reloaded module) replaces it
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, labels=(), type="gauge"):
+        return self.register(Gauge(name, help, read, labels, type))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Time spent running one SQL statement", ("statement",))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Time from request to the end of the response",
+    ("method", "route", "status"))
+PBKDF2_SECONDS = registry.histogram(
+    "pbkdf2_hash_duration_seconds", "Time spent hashing one password with PBKDF2",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z_0-9]*)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def statement_name(query):
+    """A low-cardinality label for a SQL statement, e.g. 'select_reservation'"""
+    words = query.split(None, 1)
+    if not words:
+        return "empty"
+    verb = words[0].lower()
+    if verb in ("pragma", "begin", "commit", "rollback", "explain"):
+        return verb
+    table = _TABLE.search(query)
+    return f"{verb}_{table.group(1).lower()}" if table else verb
+
+
+class MetricsMiddleware:
+    '''
+    ASGI middleware recording the latency of every HTTP request, labelled
+    with the method, the route template (not the raw path, so ids and query
+    strings do not multiply the series) and the response status.
+    '''
+
+    def __init__(self, app, histogram=HTTP_REQUEST_SECONDS):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        began = time.perf_counter()
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "unmatched")
+            self.histogram.observe(time.perf_counter() - began, scope["method"], path, status[0])
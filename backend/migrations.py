@@ -0,0 +1,122 @@
+# migrations.py
+import sqlite3
+
+# Each entry upgrades the schema by one version. The database records the
+# number of migrations already applied in PRAGMA user_version, so entries
+# must only ever be appended, never edited or reordered.
+MIGRATIONS = [
+    # 1: store reservation times as fixed-width 'YYYY-MM-DD HH:MM:SS' text so
+    # they compare correctly as plain strings, and index the interval columns
+    """
+    UPDATE Reservation
+    SET start_date = COALESCE(datetime(start_date), start_date),
+        end_date = COALESCE(datetime(end_date), end_date);
+
+    UPDATE Remote_Reservation
+    SET start_date = COALESCE(datetime(start_date), start_date),
+        end_date = COALESCE(datetime(end_date), end_date);
+
+    CREATE INDEX IF NOT EXISTS idx_reservation_machine_dates
+        ON Reservation (machine_id, start_date, end_date);
+    CREATE INDEX IF NOT EXISTS idx_reservation_customer_start
+        ON Reservation (customer, start_date);
+    CREATE INDEX IF NOT EXISTS idx_reservation_dates
+        ON Reservation (start_date, end_date);
+    """,
+
+    # 2: a version counter per table, bumped by triggers on every change, so
+    # in-process caches can cheaply tell whether another connection or worker
+    # has modified the table since they were filled
+    """
+    CREATE TABLE IF NOT EXISTS DataVersion (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO DataVersion (name, version) VALUES ('Reservation', 0);
+
+    CREATE TRIGGER IF NOT EXISTS reservation_version_insert AFTER INSERT ON Reservation
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'Reservation';
+    END;
+    CREATE TRIGGER IF NOT EXISTS reservation_version_update AFTER UPDATE ON Reservation
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'Reservation';
+    END;
+    CREATE TRIGGER IF NOT EXISTS reservation_version_delete AFTER DELETE ON Reservation
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'Reservation';
+    END;
+    """,
+
+    # 3: version the business rules too, so workers notice rule changes
+    # made by another worker without reloading the rules on every request
+    """
+    INSERT OR IGNORE INTO DataVersion (name, version) VALUES ('BusinessRules', 0);
+
+    CREATE TRIGGER IF NOT EXISTS business_rules_version_insert AFTER INSERT ON BusinessRules
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'BusinessRules';
+    END;
+    CREATE TRIGGER IF NOT EXISTS business_rules_version_update AFTER UPDATE ON BusinessRules
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'BusinessRules';
+    END;
+    CREATE TRIGGER IF NOT EXISTS business_rules_version_delete AFTER DELETE ON BusinessRules
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'BusinessRules';
+    END;
+    """,
+
+    # 4: revoked access tokens (by jti claim), kept until the token would
+    # have expired anyway; only inserts bump the version, pruning does not
+    """
+    CREATE TABLE IF NOT EXISTS RevokedToken (
+        jti TEXT PRIMARY KEY,
+        expires_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_revoked_token_expires ON RevokedToken (expires_at);
+
+    INSERT OR IGNORE INTO DataVersion (name, version) VALUES ('RevokedToken', 0);
+    CREATE TRIGGER IF NOT EXISTS revoked_token_version_insert AFTER INSERT ON RevokedToken
+    BEGIN
+        UPDATE DataVersion SET version = version + 1 WHERE name = 'RevokedToken';
+    END;
+    """,
+
+    # 5: index the audit log for newest-first keyset pagination; operation_id
+    # is the rowid, so every index already ends in it as a tie-breaker
+    """
+    CREATE INDEX IF NOT EXISTS idx_operation_timestamp ON Operation (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_operation_user_timestamp ON Operation (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_operation_type_timestamp ON Operation (type, timestamp);
+    """,
+]
+
+
+def schema_version(conn):
+    """Return the number of migrations applied to a database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    """
+    Apply every pending migration, each in its own transaction.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database to upgrade.
+
+    Returns:
+        int: The schema version after upgrading.
+    """
+    version = schema_version(conn)
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            # executescript commits any pending transaction first, so the
+            # BEGIN/COMMIT below wraps exactly this migration
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Migration {number} failed: {e}")
+            raise
+    return schema_version(conn)
@@ -1,30 +1,133 @@
 import uuid
+import sys
+import base64
+import csv
+import io
+import json
 from datetime import datetime, date
 import sqlite3
-import hashlib
+import hmac
+import threading
+import time
+import random
+import weakref
+from types import MappingProxyType
 from contextlib import contextmanager
 
+from connection_pool import ConnectionPool, DEFAULT_PRAGMAS, apply_pragmas
+from migrations import apply_migrations
+from availability import AvailabilityIndex
+from reservation_cache import ReservationCache
+from hashing import default_hasher
+from dispatch import default_dispatcher
+from metrics import DB_QUERY_SECONDS, statement_name
+from tracing import default_tracer
+
+# Reservation times are stored in this fixed-width form (see migrations.py),
+# so comparing the text columns directly orders them chronologically
+DB_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# The form the API accepts, e.g. '2024-06-03 10:00'
+API_DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Columns GET /reservations can project; machine_name needs the Machine join
+RESERVATION_FIELDS = {
+    "reservation_id": "Reservation.reservation_id",
+    "customer": "Reservation.customer",
+    "machine_id": "Reservation.machine_id",
+    "machine_name": "Machine.name",
+    "start_date": "Reservation.start_date",
+    "end_date": "Reservation.end_date",
+    "total_cost": "Reservation.total_cost",
+    "down_payment": "Reservation.down_payment",
+}
+
+
+def parse_datetime(text, fmt=API_DATETIME_FORMAT):
+    """
+    Parse a 'YYYY-MM-DD HH:MM' (or, with DB_DATETIME_FORMAT, 'YYYY-MM-DD HH:MM:SS')
+    string. Zero-padded input, which is what the frontend and the database
+    produce, takes the fromisoformat fast path; anything else falls back to
+    strptime so the accepted inputs are exactly the same as before.
+    """
+    if len(text) == len(fmt) + 2 and text[4] == '-' and text[7] == '-' and text[10] == ' ':
+        try:
+            value = datetime.fromisoformat(text)
+            if value.tzinfo is None:
+                return value
+        except ValueError:
+            pass
+    return datetime.strptime(text, fmt)
+
+
+def format_db_datetime(value):
+    """Format a datetime the way reservation times are stored"""
+    return value.isoformat(' ', 'seconds')
+
+
+def encode_cursor(*values):
+    """An opaque keyset pagination cursor holding the sort key of the last row"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """The sort key in a cursor; ValueError unless it holds values of the given types"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(value, kind) for value, kind in zip(values, types))):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(values)
+
+
+def epoch_minutes(value):
+    """Whole minutes since 1970-01-01 00:00 of a naive datetime"""
+    return (value.toordinal() - _EPOCH_ORDINAL) * 1440 + value.hour * 60 + value.minute
+
+
+class UnavailableError(ValueError):
+    """Raised when the requested machine is not available in the requested period."""
+    pass
+
+
 class UserManager:
     '''
     A class to manage funtions that need to effect a user.
 
     This class provides a way to add a user, get a user, 
     verify a password, authenticate a user, and update their password.
+    The *_async variants hash passwords on the hasher's worker pool and run
+    their queries through the dispatcher, so async routes do not block the
+    event loop while PBKDF2 or sqlite3 runs.
 
     Attributes:
         db_path (str): Path to the database file.
         db_manager (DatabaseManager): An instance of the DatabaseManager class.
+        hasher (PasswordHasher): Hashes passwords, on a worker pool for the async methods.
+        dispatcher (BlockingDispatcher): Runs the async methods' queries on worker threads.
         
     '''
 
-    def __init__(self, DatabaseManager):
+    def __init__(self, DatabaseManager, hasher=None, dispatcher=None):
         self.db_manager = DatabaseManager
+        self.hasher = hasher or default_hasher
+        self.dispatcher = dispatcher or default_dispatcher
         
 
     def add_user(self, username, password, role, salt):
         """Adds a new user to the database"""
+        password_hash = self.hash_password(password, salt)
+        return self._insert_user(username, password_hash, role, salt)
+
+    async def add_user_async(self, username, password, role, salt):
+        """Adds a new user to the database, hashing off the event loop"""
+        password_hash = await self.hasher.hash_async(password, salt)
+        return await self.dispatcher.run(self._insert_user, username, password_hash, role, salt)
+
+    def _insert_user(self, username, password_hash, role, salt):
         try:
-            password_hash = self.hash_password(password, salt)
             query = "INSERT INTO User (username, password_hash, role, salt) VALUES (?, ?, ?, ?)"
             self.db_manager.execute_statement(query, (username, password_hash, role, salt))
             return True
@@ -37,7 +140,7 @@ class UserManager:
 
     def hash_password(self, password, salt):
         """Hashes a password using PBKDF2"""
-        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000).hex()
+        return self.hasher.hash(password, salt)
 
     def get_user(self, username):
         """Retrieve user details from the database."""
@@ -54,7 +157,7 @@ class UserManager:
     def verify_password(self, plain_password, password_hash, salt):
         """Verify a plaintext password against the hashed version."""
         computed_hash = self.hash_password(plain_password, salt)
-        return password_hash == computed_hash
+        return hmac.compare_digest(password_hash, computed_hash)
 
     def authenticate_user(self, username: str, password: str):
         """Authenticate a user using username and password."""
@@ -64,12 +167,28 @@ class UserManager:
             return user
         return False
 
+    async def authenticate_user_async(self, username: str, password: str):
+        """Authenticate a user, verifying the password off the event loop."""
+
+        user = await self.dispatcher.run(self.get_user, username)
+        if user and await self.hasher.verify_async(password, user['password_hash'], user['salt']):
+            return user
+        return False
+
     def update_password(self, username, password, salt):
         """Update a user's password in the database."""
 
         password_hash = self.hash_password(password, salt)
+        return self._store_password(username, password_hash, salt)
+
+    async def update_password_async(self, username, password, salt):
+        """Update a user's password, hashing off the event loop."""
+
+        password_hash = await self.hasher.hash_async(password, salt)
+        return await self.dispatcher.run(self._store_password, username, password_hash, salt)
+
+    def _store_password(self, username, password_hash, salt):
         try:
-            password_hash = self.hash_password(password, salt)
             query = "UPDATE User SET password_hash = ?, salt = ? WHERE username = ?"
             self.db_manager.execute_statement(query, (password_hash, salt, username))
             return True
@@ -158,14 +277,40 @@ class DatabaseManager:
     '''
     A class to manage database operations and connections.
 
-    Need to get back to this!
+    Connections to the database file come from a bounded ConnectionPool that
+    is shared by every manager in the process, so a request reuses warm
+    connections instead of opening a new one for each statement. When an
+    existing connection is passed in (as the tests do with an in-memory
+    database) that single connection is used instead, guarded by a lock so
+    only one thread talks to it at a time.
+
+    Every pooled connection gets the PRAGMA profile in pragmas applied when it
+    is opened (WAL journaling by default). In WAL mode the server is expected
+    to call checkpoint() periodically to fold the log back into the database.
 
-    Raises:
-        AttributeError: _description_
-        ValueError: _description_
+    Every statement's latency is recorded in the db_query_duration_seconds
+    histogram (see metrics.py), labelled with a name like "select_reservation".
+    The tracer (see tracing.py) can also record each statement per request,
+    and it logs slow statements with their query plan.
 
-    Returns:
-        _type_: _description_
+    Attributes:
+        db_path (str): Path to the database file.
+        connection (sqlite3.Connection): Externally managed connection, if any.
+        pool (ConnectionPool): Pool of connections to db_path, if no connection was given.
+        pragmas (dict): PRAGMA profile applied to new pooled connections.
+        tracer (SQLTracer): Per-request statement tracing and the slow-query log.
+
+    Methods:
+        get_connection(): Context manager yielding a connection.
+        execute_query(query, params): Run a query and return rows as dicts.
+        iter_query(query, params, chunk_size): Run a query and yield its rows in chunks.
+        execute_statement(query, params): Run a non-query and return the row count.
+        execute_insert(query, params): Run an INSERT and return the new rowid.
+        transaction(): Context manager running statements in one BEGIN IMMEDIATE transaction.
+        get_data_version(name): Return the change counter of a table.
+        checkpoint(mode): Run a WAL checkpoint.
+        apply_migrations(): Bring the schema up to date.
+        close(): Close the pooled connections.
     '''
     _instance = None
 
@@ -174,26 +319,126 @@ class DatabaseManager:
             cls._instance = super(DatabaseManager, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, db_path='../reservationDB.db', connection=None):
+    def __init__(self, db_path='../reservationDB.db', connection=None,
+                 pool_size=5, max_overflow=5, pool_timeout=5.0, pragmas=None, tracer=None):
   
         if not hasattr(self, 'initialized'):
             self.connection = connection
+            self.tracer = tracer or default_tracer
             self.db_path = db_path if connection is None else None
+            self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+            self.pool = None
+            self._pool_settings = {"max_size": pool_size, "max_overflow": max_overflow, "timeout": pool_timeout}
+            if connection is None:
+                self.pool = self._new_pool()
+            self._connection_lock = threading.RLock()
+            self._local = threading.local()
             self.initialized = True
 
     @contextmanager
     def get_connection(self):
-        if self.connection:
-            yield self.connection
+        transaction_conn = getattr(self._local, 'transaction', None)
+        if transaction_conn is not None:
+            # statements inside transaction() share its connection
+            yield transaction_conn
+        elif self.connection:
+            with self._connection_lock:
+                yield self.connection
         else:
-            conn = sqlite3.connect(self.db_path)
+            with self.pool.connection() as conn:
+                try:
+                    yield conn
+                except sqlite3.Error as e:
+                    print(f"Database error: {e}")
+                    raise
+
+    def _commit(self, conn):
+        # inside transaction() the commit is left to the end of the block
+        if getattr(self._local, 'transaction', None) is None:
+            conn.commit()
+
+    @contextmanager
+    def transaction(self, retries=5, backoff=0.05):
+        """
+        Run a block of statements as one BEGIN IMMEDIATE transaction.
+
+        The write lock is taken up front, so reads made inside the block cannot
+        be invalidated by another writer before the block commits. Every
+        execute_* call made by this thread inside the block uses the same
+        connection. If the database stays locked past busy_timeout, BEGIN is
+        retried with exponential backoff and jitter.
+
+        Args:
+            retries (int): How many times to retry BEGIN on SQLITE_BUSY.
+            backoff (float): Initial delay between retries in seconds.
+
+        Yields:
+            sqlite3.Connection: The connection the transaction runs on.
+        """
+        if getattr(self._local, 'transaction', None) is not None:
+            raise RuntimeError("Nested transactions are not supported")
+
+        with self.get_connection() as conn:
+            for attempt in range(retries + 1):
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    busy = getattr(e, 'sqlite_errorcode', None) == sqlite3.SQLITE_BUSY or 'locked' in str(e)
+                    if not busy or attempt == retries:
+                        raise
+                    time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+            self._local.transaction = conn
             try:
                 yield conn
-            except sqlite3.Error as e:
-                print(f"Database error: {e}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
                 raise
             finally:
-                conn.close()
+                self._local.transaction = None
+
+    def _configure_connection(self, conn):
+        apply_pragmas(conn, self.pragmas)
+
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Copy committed WAL frames back into the database file.
+
+        Args:
+            mode (str): PASSIVE, FULL, RESTART or TRUNCATE.
+
+        Returns:
+            dict: busy flag, frames in the log and frames checkpointed.
+        """
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        with self.get_connection() as conn:
+            busy, log, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {"busy": busy, "log": log, "checkpointed": checkpointed}
+
+    def apply_migrations(self):
+        """Apply pending schema migrations and return the schema version"""
+        with self.get_connection() as conn:
+            return apply_migrations(conn)
+
+    def _new_pool(self):
+        return ConnectionPool(self.db_path, on_connect=self._configure_connection, **self._pool_settings)
+
+    def close(self):
+        """Close pooled connections; the next statement opens them again in a fresh pool"""
+        if self.pool:
+            pool, self.pool = self.pool, self._new_pool()
+            pool.close()
+
+    def _record(self, conn, query, params, began, rows):
+        # called from the execute_* method, so the frame two up issued the statement
+        duration = time.perf_counter() - began
+        DB_QUERY_SECONDS.observe(duration, statement_name(query))
+        tracer = self.tracer
+        if tracer.enabled or duration >= tracer.slow_threshold:
+            tracer.record(conn, query, params, duration, rows, sys._getframe(2))
 
     def execute_query(self, query, params=None):
         """
@@ -208,12 +453,14 @@ class DatabaseManager:
         """
         with self.get_connection() as conn:
                 cursor = conn.cursor()
+                began = time.perf_counter()
+                rows = None
                 try:
                     if params:
                         cursor.execute(query, params)
                     else:
                         cursor.execute(query)
-                    conn.commit()
+                    self._commit(conn)
                     rows = cursor.fetchall()
                     if rows:
                         return [dict(zip([column[0] for column in cursor.description], row)) for row in rows]
@@ -221,6 +468,44 @@ class DatabaseManager:
                 except sqlite3.Error as e:
                     print(f"Failed to execute query: {e}")
                     raise
+                finally:
+                    self._record(conn, query, params, began, None if rows is None else len(rows))
+
+    def iter_query(self, query, params=None, chunk_size=1000):
+        """
+        Execute a query and yield its rows chunk_size at a time.
+
+        Rows are read from the open cursor with fetchmany, so memory use does
+        not depend on the size of the result. The connection stays checked
+        out until the generator is exhausted or closed, so close it on the
+        thread that opened it.
+
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to bind to the query.
+            chunk_size (int): Rows per chunk.
+
+        Yields:
+            tuple: (column names, list of row tuples) for each chunk.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # only the time to the first row; the rest is paced by the consumer
+                began = time.perf_counter()
+                cursor.execute(query, params or ())
+                self._record(conn, query, params, began, None)
+                columns = [column[0] for column in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    yield columns, rows
+            except sqlite3.Error as e:
+                print(f"Failed to execute query: {e}")
+                raise
+            finally:
+                cursor.close()
 
     def execute_statement(self, query, params=None):
         """
@@ -235,46 +520,96 @@ class DatabaseManager:
         """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            began = time.perf_counter()
             try:
                 if params:
                     cursor.execute(query, params)
                 else:
                     cursor.execute(query)
-                conn.commit()
+                self._commit(conn)
                 return cursor.rowcount
             except sqlite3.Error as e:
                 print(f"Failed to execute non-query: {e}")
                 raise
+            finally:
+                self._record(conn, query, params, began, cursor.rowcount)
+
+    def execute_insert(self, query, params=None):
+        """
+        Execute an INSERT and return the rowid of the new row.
+
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to bind to the query.
+
+        Returns:
+            int: The rowid of the inserted row.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            began = time.perf_counter()
+            try:
+                cursor.execute(query, params or ())
+                self._commit(conn)
+                return cursor.lastrowid
+            except sqlite3.Error as e:
+                print(f"Failed to execute insert: {e}")
+                raise
+            finally:
+                self._record(conn, query, params, began, cursor.rowcount)
+
+    def get_data_version(self, name):
+        """Return the change counter of a table (see DataVersion in migrations.py)"""
+        rows = self.execute_query("SELECT version FROM DataVersion WHERE name = ?", (name,))
+        return rows[0]['version'] if rows else None
 
 
 class BusinessManager:
     """
     A class to manage business rules of the facility
 
+    The rules are read into one immutable snapshot shared by every
+    BusinessManager of a database. Creating a manager only compares the
+    stored BusinessRules version (see DataVersion in migrations.py) with
+    the snapshot's, and reloads the rules when they were changed by another
+    worker. update_rule swaps in a new snapshot.
+
+    Rules are available as attributes, e.g. biz_manager.harvester_price.
+
     Attributes:
     db_manager : DatabaseManager
+    rules : mapping of rule name to value (read-only)
     """
+    _snapshots = weakref.WeakKeyDictionary()  # db_manager -> (version, rules)
+    _snapshot_lock = threading.Lock()
+
     def __init__(self, db_manager):
         self.db_manager = db_manager
         self.load_business_rules()
 
-    def load_business_rules(self):
-        """Load business rules values form database"""
-
-        # Get the column names from the BusinessRules table
-        query = "PRAGMA table_info(BusinessRules)"
-        column_info = self.db_manager.execute_query(query)
-        column_names = [col['name'] for col in column_info]
+    def __getattr__(self, name):
+        # only called for names that are not regular attributes
+        rules = self.__dict__.get('rules')
+        if rules is not None and name in rules:
+            return rules[name]
+        raise AttributeError(f"'BusinessManager' object has no attribute '{name}'")
 
+    def _read_rules(self):
         # Select the first row from the BusinessRules table
         query = "SELECT * FROM BusinessRules LIMIT 1"
         row = self.db_manager.execute_query(query)
-        
-        if row:
-            row = row[0]  # Get the first row
-            # Create instance attributes for each column
-            for column_name in column_names:
-                setattr(self, column_name, row[column_name])
+        return MappingProxyType(row[0] if row else {})
+
+    def load_business_rules(self, force=False):
+        """Load business rules values form database, reusing the shared
+        snapshot unless the rules have changed"""
+        version = self.db_manager.get_data_version('BusinessRules')
+        with self._snapshot_lock:
+            snapshot = self._snapshots.get(self.db_manager)
+            if force or snapshot is None or version is None or snapshot[0] != version:
+                snapshot = (version, self._read_rules())
+                self._snapshots[self.db_manager] = snapshot
+        self.rules = snapshot[1]
 
     def get_rule(self, field_name):
         """Get the value of a business rule"""
@@ -282,10 +617,11 @@ class BusinessManager:
 
     def update_rule(self, field_name, value):
         """Update the value of a business rule"""
-        setattr(self, field_name, value)
+        if field_name not in self.rules:
+            raise ValueError(f"Unknown business rule: {field_name}")
         query = f"UPDATE BusinessRules SET {field_name} = ? WHERE rowid = 1"
         self.db_manager.execute_statement(query, (value,))
-
+        self.load_business_rules(force=True)
 
 
 
@@ -367,142 +703,232 @@ class ReservationCalendar:
 
     Methods:
         load_reservations(): Loads reservations from a data source outside of backend folder at path: ../calendar.pkl.
+        retrieve(daterange, machine, customer, fields, cursor, limit): Retrieves a page of reservations.
+        export(daterange, machine, customer, fields, format): Yields reservations as NDJSON or CSV chunks.
+        validate_query(fields, format): Checks query arguments before a streamed export starts.
         retrieve_by_date(daterange): Retrieves reservations by date range.
         retrieve_by_machine(daterange, machine): Retrieves reservations by machine within a date range.
         retrieve_by_customer(daterange, customer): Retrieves reservations by customer within a date range.
         add_reservation(reservation): Adds a new reservation to the calendar.
+        add_remote_reservations(reservations): Adds a batch of reservations for other facilities.
         remove_reservation(reservation_id): Removes a reservation from the calendar.
         save_reservations(): Saves current reservations to a data source.
+        sync_availability(): Rebuilds the availability index if the Reservation table changed.
+
+    Results of retrieve() are kept in a ReservationCache shared per database
+    (or the cache passed in), which saving and cancelling reservations
+    invalidate.
     '''
 
-    def __init__(self, DatabaseManager):
+    def __init__(self, DatabaseManager, business_manager=None, cache=None):
         
         self.db_manager = DatabaseManager
-        self.biz_manager = BusinessManager(DatabaseManager)
+        self.biz_manager = business_manager or BusinessManager(DatabaseManager)
+        self.availability = AvailabilityIndex.for_database(DatabaseManager)
+        self.cache = cache or ReservationCache.for_database(DatabaseManager)
+
+    def sync_availability(self):
+        """Make sure the availability index reflects the Reservation table"""
+        version = self.db_manager.get_data_version('Reservation')
+        if version is not None and version == self.availability.version:
+            return
+        # read the version before the rows, so the rows are never older than it
+        query = """
+            SELECT 
+                Reservation.reservation_id,
+                Machine.name AS machine_name,
+                Reservation.start_date,
+                Reservation.end_date
+            FROM Reservation
+            JOIN Machine ON Reservation.machine_id = Machine.machine_id
+            """
+        rows = self.db_manager.execute_query(query)
+        self.availability.load(
+            ((row['reservation_id'], row['machine_name'],
+              epoch_minutes(parse_datetime(row['start_date'], DB_DATETIME_FORMAT)),
+              epoch_minutes(parse_datetime(row['end_date'], DB_DATETIME_FORMAT)))
+             for row in rows),
+            version)
 
 
+    def retrieve(self, daterange, machine=None, customer=None, fields=None, cursor=None, limit=None,
+                 render=None):
+        """
+        Retrieve reservations overlapping a date range, ordered by start date.
 
-    def retrieve_by_date(self, daterange):
-        """Retrieve reservations within a date range"""
+        Pages are keyset paginated on (start_date, reservation_id), so a page
+        deep into a busy month costs the same as the first one. Results are
+        cached until a booking overlapping daterange changes.
 
+        Args:
+            daterange (DateRange): The period to look in.
+            machine (str): Only reservations of this machine.
+            customer (str): Only reservations of this customer.
+            fields (list of str): Columns to return (see RESERVATION_FIELDS);
+                every column plus machine_name if None.
+            cursor (str): Start after the reservation this cursor names.
+            limit (int): Maximum number of reservations; no limit if None.
+            render (callable): If given, render(rows, next_cursor) is returned
+                and cached instead, e.g. to cache an encoded response body.
+
+        Returns:
+            tuple: (list of reservation dicts, cursor of the next page or None),
+            or what render returned.
+        """
         try:
-            start = daterange.start_date.strftime('%Y-%m-%d %H:%M')
-            end = daterange.end_date.strftime('%Y-%m-%d %H:%M')
-            
-            query = """
-                SELECT 
-                    Reservation.*, 
-                    Machine.Name AS machine_name
-                FROM Reservation
-                JOIN Machine ON Reservation.machine_id = Machine.machine_id
-                WHERE datetime(Reservation.start_date) <= datetime(?) 
-                    AND datetime(Reservation.end_date) >= datetime(?)
-                """
-            params = (end, start) 
-            
-            result = self.db_manager.execute_query(query, params)
+            key = (render, machine, customer, None if fields is None else tuple(fields), cursor, limit,
+                   daterange.start_minute, daterange.end_minute)
+            # read the version before the rows, so the rows are never older than it
+            version = self.db_manager.get_data_version('Reservation')
+            cached = self.cache.get(key, version)
+            if cached is not None:
+                return cached
+
+            query, params = self._reservation_query(daterange, machine, customer, fields, cursor)
+            if limit is not None:
+                # one row more than asked for tells whether there is a next page
+                query += " LIMIT ?"
+                params.append(limit + 1)
+
+            rows = self.db_manager.execute_query(query, tuple(params))
+            next_cursor = None
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1]['start_date'], rows[-1]['reservation_id'])
+            if fields is not None:
+                rows = [{field: row[field] for field in fields} for row in rows]
+            if render is None:
+                result, size = (rows, next_cursor), ReservationCache.estimate_size(rows)
+            else:
+                result = render(rows, next_cursor)
+                size = sys.getsizeof(result)
+            self.cache.put(key, result, size, daterange.start_minute, daterange.end_minute, version)
             return result
 
         except sqlite3.Error as e:
             print("Database error: ", str(e))
             raise
 
-        except Exception as e:
-            print(f"Error: {e}")
-            raise
-    
-     
+    @staticmethod
+    def validate_query(fields=None, format=None):
+        """
+        Check the fields and export format of a reservation query.
+
+        export() is a generator and only runs its query once iterated, so
+        callers streaming it can check their arguments up front with this.
+
+        Args:
+            fields (list of str): Requested columns, or None for all of them.
+            format (str): Export format, if the query is for export().
+
+        Raises:
+            ValueError: If a field or the format is unknown.
+        """
+        if fields is not None:
+            unknown = [field for field in fields if field not in RESERVATION_FIELDS]
+            if unknown or not fields:
+                raise ValueError(f"Unknown reservation fields: {', '.join(unknown)}")
+        if format is not None and format not in ("ndjson", "csv"):
+            raise ValueError(f"Unknown export format: {format}")
+
+    def _reservation_query(self, daterange, machine=None, customer=None, fields=None, cursor=None,
+                           json_lines=False):
+        # SELECT for reservations overlapping daterange, ordered by (start_date,
+        # reservation_id); with json_lines each row is one JSON object built by SQLite
+        self.validate_query(fields)
+        if json_lines:
+            columns = "json_object({}) AS line".format(
+                ", ".join(f"'{field}', {RESERVATION_FIELDS[field]}" for field in fields))
+            join = "machine_name" in fields
+        elif fields is None:
+            columns = "Reservation.*, Machine.name AS machine_name"
+            join = True
+        else:
+            # the sort key is always read so the next cursor can be built
+            selected = list(dict.fromkeys([*fields, "start_date", "reservation_id"]))
+            columns = ", ".join(f"{RESERVATION_FIELDS[field]} AS {field}" for field in selected)
+            join = "machine_name" in fields
+
+        conditions = ["Reservation.start_date <= ?", "Reservation.end_date >= ?"]
+        params = [format_db_datetime(daterange.end_date), format_db_datetime(daterange.start_date)]
+        if machine is not None:
+            conditions.append("Reservation.machine_id = (SELECT machine_id FROM Machine WHERE name = ?)")
+            params.append(machine)
+        if customer is not None:
+            conditions.append("Reservation.customer = ?")
+            params.append(customer)
+        if cursor is not None:
+            conditions.append("(Reservation.start_date, Reservation.reservation_id) > (?, ?)")
+            params.extend(decode_cursor(cursor, str, int))
+
+        query = f"""
+            SELECT {columns}
+            FROM Reservation
+            {"JOIN Machine ON Reservation.machine_id = Machine.machine_id" if join else ""}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY Reservation.start_date, Reservation.reservation_id
+            """
+        return query, params
+
+    def export(self, daterange, machine=None, customer=None, fields=None, format="ndjson", chunk_size=1000):
+        """
+        Yield reservations overlapping a date range as encoded NDJSON or CSV chunks.
+
+        Rows come straight from the database cursor one chunk at a time, so
+        memory use stays the same however many reservations match.
+
+        Args:
+            daterange (DateRange): The period to look in.
+            machine (str): Only reservations of this machine.
+            customer (str): Only reservations of this customer.
+            fields (list of str): Columns to export; all of RESERVATION_FIELDS if None.
+            format (str): "ndjson" or "csv".
+            chunk_size (int): Rows fetched and encoded at a time.
+
+        Yields:
+            bytes: The next part of the export.
+        """
+        self.validate_query(fields, format)
+        fields = list(RESERVATION_FIELDS) if fields is None else fields
+        json_lines = format == "ndjson"
+        query, params = self._reservation_query(daterange, machine, customer, fields, json_lines=json_lines)
+        header = True
+        for columns, rows in self.db_manager.iter_query(query, tuple(params), chunk_size):
+            if json_lines:
+                # encoding in SQL saves building and dumping a dict per row
+                yield "".join(row[0] + "\n" for row in rows).encode()
+                continue
+            # the sort key columns may have been added behind the requested ones
+            rows = [row[:len(fields)] for row in rows]
+            out = io.StringIO()
+            writer = csv.writer(out)
+            if header:
+                writer.writerow(fields)
+                header = False
+            writer.writerows(rows)
+            yield out.getvalue().encode()
+        if format == "csv" and header:
+            yield (",".join(fields) + "\r\n").encode()
+
+    def retrieve_by_date(self, daterange):
+        """Retrieve reservations within a date range"""
+        return self.retrieve(daterange)[0]
+
     def retrieve_by_machine(self, daterange, machine):
         """Retrieve reservations for a particular machine
            within a date range"""
-        try:
-            start = daterange.start_date.strftime('%Y-%m-%d %H:%M')
-            end = daterange.end_date.strftime('%Y-%m-%d %H:%M')
-            
-            query = """
-            SELECT
-                Reservation.*,
-                Machine.name AS machine_name
-            FROM Reservation
-            JOIN Machine ON Reservation.machine_id = Machine.machine_id
-            WHERE Machine.name = ?
-            AND datetime(Reservation.start_date) <= datetime(?)
-            AND datetime(Reservation.end_date) >= datetime(?)
-            """
-            
-            params = (machine, end, start)
-            
-            result = self.db_manager.execute_query(query, params)
-            return result
-        
-        except sqlite3.Error as e:
-            print("Database error: ",str(e))
-            raise
-        
-    
+        return self.retrieve(daterange, machine=machine)[0]
+
     def retrieve_by_customer(self, daterange, customer):
         """Retrieve reservations for a particular cutsomer
            within a date range"""
-        try:
-            start = daterange.start_date.strftime('%Y-%m-%d %H:%M')
-            end = daterange.end_date.strftime('%Y-%m-%d %H:%M')
-            
-            query = """
-            SELECT 
-                Reservation.*, 
-                Machine.name AS machine_name
-            FROM Reservation
-            JOIN Machine ON Reservation.machine_id = Machine.machine_id
-            WHERE customer = ? 
-            AND datetime(Reservation.start_date) <= datetime(?)
-            AND datetime(Reservation.end_date) >= datetime(?)
-            """
-            params = (customer, end, start)
-            
-            result = self.db_manager.execute_query(query, params)
-            print(f"Result: {result}")
-            return result
-
-        except sqlite3.Error as e:
-            print("Database error: ", str(e))
-            raise
-        except Exception as e:
-            print(f"Error: {e}")
-            raise
+        return self.retrieve(daterange, customer=customer)[0]
 
-    
     def retrieve_by_machine_and_customer(self, daterange, machine, customer):
         """Retrieve reservations for a particular machine
            and customer within a date range"""
-        try:
-            start = daterange.start_date.strftime('%Y-%m-%d %H:%M')
-            end = daterange.end_date.strftime('%Y-%m-%d %H:%M')
-            
-            query = """
-            SELECT
-                Reservation.*,
-                Machine.name AS machine_name
-            FROM Reservation
-            JOIN Machine ON Reservation.machine_id = Machine.machine_id
-            WHERE Machine.name = ?
-            AND customer = ?
-            AND datetime(Reservation.start_date) <= datetime(?)
-            AND datetime(Reservation.end_date) >= datetime(?)
-            """
-            
-            params = (machine, customer, end, start)
-            
-            result = self.db_manager.execute_query(query, params)
-            return result
-        
-        except sqlite3.Error as e:
-            print("Database error: ", str(e))
-            raise
-        except Exception as e:
-            print(f"Error: {e}")
-            raise
+        return self.retrieve(daterange, machine=machine, customer=customer)[0]
 
-       
     def list_remote_reservations(self):
         """List reservations made for 
         other facilities"""
@@ -519,22 +945,79 @@ class ReservationCalendar:
             # check if reservation is to be made during wokring hours
             self._verify_business_hours(reservation) 
 
-            # check if machine is available
-            self._check_equipment_availability(reservation)
+            # check availability and save in one write transaction, so a
+            # concurrent booking cannot take the machine in between
+            with self.db_manager.transaction():
+                # check if machine is available
+                self._check_equipment_availability(reservation)
 
-            # save reservation in database
-            self._save_reservation(reservation, machine_id, outside_reservation)
+                # save reservation in database
+                self._save_reservation(reservation, machine_id, outside_reservation)
         except ValueError as e:
             print(f"Error: {e}")
             raise
         
     
+    def add_remote_reservations(self, reservations):
+        """
+        Add a batch of reservations for other facilities in one transaction.
+
+        Remote reservations do not take up local capacity, so availability
+        only depends on the machine and time window; it is checked once per
+        distinct window no matter how many requests share it. Every accepted
+        row is inserted with one executemany and committed together.
+
+        Args:
+            reservations (list): Reservation objects; an Exception in place of
+                a reservation is passed through as that item's result.
+
+        Returns:
+            list: For each item, None if it was booked or the exception that refused it.
+        """
+        results = [None] * len(reservations)
+        rows = []
+        machine_ids = {}
+        availability = {}
+        with self.db_manager.transaction() as conn:
+            for position, reservation in enumerate(reservations):
+                if isinstance(reservation, Exception):
+                    results[position] = reservation
+                    continue
+                try:
+                    if reservation.machine not in machine_ids:
+                        machine_ids[reservation.machine] = self._get_Machine_id(reservation)
+                    self._verify_business_hours(reservation)
+                    window = (reservation.machine, reservation.daterange.start_minute,
+                              reservation.daterange.end_minute)
+                    if window not in availability:
+                        try:
+                            self._check_equipment_availability(reservation)
+                            availability[window] = None
+                        except ValueError as e:
+                            availability[window] = e
+                    if availability[window] is not None:
+                        raise availability[window]
+                except ValueError as e:
+                    results[position] = e
+                    continue
+                rows.append((reservation.customer, reservation.machine,
+                             format_db_datetime(reservation.daterange.start_date),
+                             format_db_datetime(reservation.daterange.end_date),
+                             reservation.cost, reservation.down_payment))
+            conn.executemany("""
+                INSERT INTO Remote_Reservation (customer, machine_name,
+                start_date, end_date, total_cost, down_payment)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, rows)
+        return results
+
     def remove_reservation(self, reservation_id):
         """Cancels a reservation"""
         try:
             # Query to get the reservation details for the given reservation_id
             query = """
                 SELECT 
+                    Reservation.reservation_id,
                     Reservation.start_date, 
                     Reservation.end_date,
                     Reservation.down_payment,
@@ -551,9 +1034,7 @@ class ReservationCalendar:
                 end_date = result[0]['end_date']
                 machine_name = result[0]['machine_name']
                 # Create a Reservation instance
-                start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')
-                end_date = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')
-                daterange = DateRange(start_date, end_date)  # Corrected order of arguments
+                daterange = DateRange.from_db(start_date, end_date)
 
                 reservation = Reservation(
                     customer_name="", # Not needed for refund calculation
@@ -566,6 +1047,9 @@ class ReservationCalendar:
                 # Query to delete the reservation
                 delete_query = "DELETE FROM Reservation WHERE reservation_id = ?"
                 self.db_manager.execute_statement(delete_query, (reservation_id,))
+                version = self.db_manager.get_data_version('Reservation')
+                self.availability.remove(result[0]['reservation_id'], version)
+                self.cache.invalidate(daterange.start_minute, daterange.end_minute, version)
                 return refund
             
             return False
@@ -594,9 +1078,7 @@ class ReservationCalendar:
                 end_date = result[0]['end_date']
                 machine_name = result[0]['machine_name']
                 # Create a Reservation instance
-                start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')
-                end_date = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')
-                daterange = DateRange(start_date, end_date)  # Corrected order of arguments
+                daterange = DateRange.from_db(start_date, end_date)
 
                 reservation = Reservation(
                     customer_name="", # Not needed for refund calculation
@@ -641,12 +1123,20 @@ class ReservationCalendar:
                 start_date, end_date, total_cost, down_payment) 
                 VALUES (?, ?, ?, ?, ?, ?)
                 """
-                self.db_manager.execute_statement(reservation_query, (
+                reservation_id = self.db_manager.execute_insert(reservation_query, (
                     reservation.customer, machine_id,
-                    reservation.daterange.start_date,
-                    reservation.daterange.end_date,
+                    format_db_datetime(reservation.daterange.start_date),
+                    format_db_datetime(reservation.daterange.end_date),
                     reservation.cost, reservation.down_payment
                 ))
+                version = self.db_manager.get_data_version('Reservation')
+                self.availability.add(reservation.machine, reservation_id,
+                                      reservation.daterange.start_minute,
+                                      reservation.daterange.end_minute,
+                                      version)
+                self.cache.invalidate(reservation.daterange.start_minute,
+                                      reservation.daterange.end_minute,
+                                      version)
             
             else: # store remote reservation in different table
                 reservation_query = """
@@ -656,8 +1146,8 @@ class ReservationCalendar:
                 """
                 self.db_manager.execute_statement(reservation_query, (
                     reservation.customer, reservation.machine,
-                    reservation.daterange.start_date,
-                    reservation.daterange.end_date,
+                    format_db_datetime(reservation.daterange.start_date),
+                    format_db_datetime(reservation.daterange.end_date),
                     reservation.cost, reservation.down_payment
                 ))
 
@@ -696,45 +1186,43 @@ class ReservationCalendar:
             raise ValueError("Reservations cannot be made more than 30 days in advance.")
         
     def _check_equipment_availability(self, reservation):
-        """Check if equipment is available for a reservation"""
+        """Check if equipment is available for a reservation.
+
+        Capacity is compared against the peak number of machines reserved
+        at the same time during the requested period, so two bookings that
+        overlap the request but not each other only take up one machine.
+        Periods include both ends, so a booking may not start at the minute
+        another one of a conflicting machine ends. Harvesters and scanners
+        exclude each other, only one harvester can be booked at a time, and
+        unknown machines are refused."""
         
         try:
-            overlapping_reservations = self.retrieve_by_date(reservation.daterange)
-            # Count how many scanners, harvesters, and scoopers are reserved in the overlapping period
-            scanner_count = 0
-            harvester_reserved = False
-            scooper_count = 0
-
-            for res in overlapping_reservations:
-                if res['machine_name'] == "scanner":
-                    scanner_count += 1
-                if res['machine_name'] == "harvester":
-                    harvester_reserved = True
-                if res['machine_name'] == "scooper":
-                    scooper_count += 1
+            self.sync_availability()
+            start = reservation.daterange.start_minute
+            end = reservation.daterange.end_minute
 
             # Check constraints for scanners
             if reservation.machine == "scanner":
-                if scanner_count >= self.biz_manager.number_of_scanners: #3
-                    raise ValueError("Maximum number of scanners already reserved for this time period.")
-                if harvester_reserved:
-                    raise ValueError("Scanners cannot operate while the harvester is in use.")
-
-                # Check if the reservation is for a harvester and if any scanner is reserved
-                if reservation.machine == "harvester":
-                    if scanner_count > 0:
-                        raise ValueError("The harvester cannot operate while scanners are in use.")
-                    if harvester_reserved:
-                        raise ValueError("The harvester is already reserved for this time period.")
+                if self.availability.peak("scanner", start, end) >= self.biz_manager.number_of_scanners: #3
+                    raise UnavailableError("Maximum number of scanners already reserved for this time period.")
+                if self.availability.peak("harvester", start, end) > 0:
+                    raise UnavailableError("Scanners cannot operate while the harvester is in use.")
+
+            # Check if the reservation is for a harvester and if any scanner is reserved
+            elif reservation.machine == "harvester":
+                if self.availability.peak("scanner", start, end) > 0:
+                    raise UnavailableError("The harvester cannot operate while scanners are in use.")
+                if self.availability.peak("harvester", start, end) > 0:
+                    raise UnavailableError("The harvester is already reserved for this time period.")
 
             # Check constraints for scoopers
-            if reservation.machine == "scooper":
-                if scooper_count >= self.biz_manager.number_of_scoopers:  #3 # Since there are 4 scoopers, we can reserve up to 3 at the same time
-                    raise ValueError("Only one scooper must remain available; maximum number already reserved.")
+            elif reservation.machine == "scooper":
+                if self.availability.peak("scooper", start, end) >= self.biz_manager.number_of_scoopers:  #3 # Since there are 4 scoopers, we can reserve up to 3 at the same time
+                    raise UnavailableError("Only one scooper must remain available; maximum number already reserved.")
 
-                # General check for other machines (if more types are added in the future)
-                if reservation.machine not in ["scanner", "harvester", "scooper"]:
-                    raise ValueError("Please select from one of our specified machines: scanner, harvester, scooper.")
+            # General check for other machines (if more types are added in the future)
+            else:
+                raise ValueError("Please select from one of our specified machines: scanner, harvester, scooper.")
         
         except sqlite3.Error as e:
             print("Database error: ",str(e))
@@ -750,25 +1238,36 @@ class DateRange:
     Attributes:
         start_date (datetime): The start date of the range.
         end_date (datetime): The end date of the range.
+        start_minute (int): The start date in minutes since the epoch.
+        end_minute (int): The end date in minutes since the epoch.
     
     Methods:
+        from_db(start_date, end_date): Build a range from stored reservation times.
         hours(): Calculate the number of hours between the start and end date.
         start(): Return the start date of the range.
 
 
     '''
-    def __init__(self, start_date, end_date):
+    def __init__(self, start_date, end_date, fmt=API_DATETIME_FORMAT):
         try:
-            self.start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M")
-            self.end_date = datetime.strptime(end_date, "%Y-%m-%d %H:%M")
+            self.start_date = parse_datetime(start_date, fmt)
+            self.end_date = parse_datetime(end_date, fmt)
         except ValueError as e:
             print(f"Error parsing dates: {e}")
             raise ValueError(f"Invalid date format: {e}")
+        # comparisons and the availability index work on whole minutes
+        self.start_minute = epoch_minutes(self.start_date)
+        self.end_minute = epoch_minutes(self.end_date)
+
+    @classmethod
+    def from_db(cls, start_date, end_date):
+        """Build a range from start_date/end_date column values"""
+        return cls(start_date, end_date, DB_DATETIME_FORMAT)
 
     def __eq__(self, other) -> bool:
         # two date ranges are equal if their is any overlap between them
-        return (self.start_date <= other.end_date and self.end_date >= other.start_date) or \
-        (other.start_date <= self.end_date and other.end_date >= self.start_date)
+        return (self.start_minute <= other.end_minute and self.end_minute >= other.start_minute) or \
+        (other.start_minute <= self.end_minute and other.end_minute >= self.start_minute)
     
     def hours(self):
-        return int((self.end_date - self.start_date).total_seconds() / 3600)
+        return int((self.end_minute - self.start_minute) / 60)
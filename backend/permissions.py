@@ -2,7 +2,8 @@
 
 from fastapi import HTTPException, status
 from functools import wraps
-from token_manager import decode_access_token, ExpiredTokenError, InvalidTokenError
+from token_manager import decode_access_token, ExpiredTokenError, InvalidTokenError, TokenCache
+from revocation import RevocationStore
 
 class RolePermissionError(Exception):
     """Base class for role permission errors."""
@@ -17,9 +18,27 @@ class PermissionDeniedError(RolePermissionError):
     pass
 
 
+# Tokens that already passed verification, so a client reusing its token
+# does not pay for a full JWT decode on every request
+token_cache = TokenCache()
+
+# Tokens revoked by /logout; main.py attaches it to the database
+revocation_store = RevocationStore()
+
+
 def validate_user_token(token: str):
+    claims = verified_claims(token)
+    return claims["sub"], claims["role"]
+
+def verified_claims(token: str):
+    """The sub, role, exp and jti claims of a valid, unrevoked token; HTTPException otherwise"""
     if token.startswith('Bearer '):
         token = token[7:]
+    claims = token_cache.get(token)
+    if claims is not None:
+        if revocation_store.is_revoked(claims["jti"]):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return claims
     try:
         payload = decode_access_token(token)
     except ExpiredTokenError as e:
@@ -31,7 +50,11 @@ def validate_user_token(token: str):
     role = payload.get("role")
     if not user or not role:
         raise HTTPException(status_code=401, detail="Invalid token: no user or role")
-    return user, role
+    if revocation_store.is_revoked(payload.get("jti")):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    claims = {"sub": user, "role": role, "exp": payload.get("exp"), "jti": payload.get("jti")}
+    token_cache.put(token, claims)
+    return claims
 
 def validate_user(f):
     @wraps(f)
@@ -39,12 +62,13 @@ def validate_user(f):
         request = kwargs.get('request')
         token = request.headers.get('Authorization')
         try:
-            user, role = validate_user_token(token)
+            claims = verified_claims(token)
         except HTTPException as e:
             raise e
         
-        request.state.user = user
-        request.state.role = role
+        request.state.user = claims["sub"]
+        request.state.role = claims["role"]
+        request.state.claims = claims
         return await f(*args, **kwargs)
     return wrapper
 
@@ -0,0 +1,163 @@
+# profiling.py
+import cProfile
+import io
+import itertools
+import marshal
+import pstats
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from tracing import request_id_var
+
+
+class RequestProfiler:
+    '''
+    Profiles individual HTTP requests with cProfile, on demand.
+
+    A request is profiled when it carries an X-Profile: 1 header and
+    authorize() accepts its Authorization header (main.py only lets admins
+    through), or at random with probability sample_rate. The profile covers
+    everything the request runs on the event loop: dependency resolution,
+    validate_user, role_required and the route body. Work the route hands to
+    worker threads (sqlite3 through run_blocking) only shows up as time
+    spent awaiting. The SQL trace (tracing.py) covers that side.
+
+    cProfile sees every coroutine that runs on the loop while it is on, so
+    only one request is profiled at a time; others pass through untouched.
+    The last max_profiles profiles are kept in memory and can be downloaded
+    as pstats data (for pstats, snakeviz or gprof2dot) or read as text.
+
+    Attributes:
+        sample_rate (float): Share of requests profiled without the header.
+        max_profiles (int): Profiles kept in memory.
+        authorize (callable): Takes an Authorization header, True if it may ask for profiles.
+
+    Methods:
+        wants(scope): Whether a request should be profiled.
+        begin(): Start a profile, or None if one is already running.
+        finish(profile, meta): Stop a profile and keep it.
+        profiles(): Metadata of the kept profiles, newest first.
+        pstats_data(profile_id): A profile as pstats (marshal) bytes.
+        text(profile_id, sort, limit): A profile as a pstats text report.
+    '''
+
+    def __init__(self, sample_rate=0.0, max_profiles=50, authorize=None):
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self.authorize = authorize
+        self._profiles = OrderedDict()  # id -> (meta, pstats.Stats)
+        self._ids = itertools.count(1)
+        self._active = False
+        self._lock = threading.Lock()
+
+    def wants(self, scope):
+        """Whether the request in an ASGI scope asked to be profiled, or was sampled"""
+        profile_header = authorization = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                profile_header = value
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+        if profile_header == b"1" and authorization and self.authorize is not None:
+            return self.authorize(authorization)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self):
+        """Start profiling the calling thread, or return None if a profile is running"""
+        with self._lock:
+            if self._active:
+                return None
+            self._active = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:  # another profiler or debugger owns the thread
+            print(f"Failed to start profiler: {e}")
+            with self._lock:
+                self._active = False
+            return None
+        return profile
+
+    def finish(self, profile, meta):
+        """Stop a profile started by begin() and keep it; returns its id"""
+        profile.disable()
+        with self._lock:
+            self._active = False
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        meta = {"id": next(self._ids), **meta,
+                "functions": len(stats.stats), "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')}
+        with self._lock:
+            self._profiles[meta["id"]] = (meta, stats)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return meta["id"]
+
+    def profiles(self):
+        """Metadata of every kept profile, newest first"""
+        with self._lock:
+            return [meta for meta, _ in reversed(self._profiles.values())]
+
+    def _stats(self, profile_id):
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+        return entry[1] if entry else None
+
+    def pstats_data(self, profile_id):
+        """A profile in the format pstats.Stats(filename) loads, or None"""
+        stats = self._stats(profile_id)
+        return None if stats is None else marshal.dumps(stats.stats)
+
+    def text(self, profile_id, sort="cumulative", limit=50):
+        """A pstats report of the limit most expensive functions by sort, or None"""
+        stats = self._stats(profile_id)
+        if stats is None:
+            return None
+        stream = io.StringIO()
+        with self._lock:
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def clear(self):
+        """Drop every kept profile"""
+        with self._lock:
+            self._profiles.clear()
+
+
+class ProfilingMiddleware:
+    '''
+    ASGI middleware running the requests a RequestProfiler wants under
+    cProfile. Only installed when profiling is enabled, so it costs nothing
+    otherwise.
+    '''
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants(scope):
+            return await self.app(scope, receive, send)
+        profile = self.profiler.begin()
+        if profile is None:
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        began = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.finish(profile, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status[0],
+                "duration_ms": round((time.perf_counter() - began) * 1000, 3),
+                "request_id": request_id_var.get(),
+            })
@@ -0,0 +1,148 @@
+# reservation_cache.py
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class ReservationCache:
+    '''
+    A bounded LRU cache of reservation query results, invalidated by writes.
+
+    Entries are keyed by the filters of a query and its date range in epoch
+    minutes, and remember that range. Saving or cancelling a reservation
+    drops only the entries whose range overlaps the booking; everything else
+    stays cached.
+
+    Like the AvailabilityIndex, the cache remembers the version of the
+    Reservation table it reflects. Every lookup compares it with the stored
+    version and clears the cache when another connection or worker has
+    changed the table. An in-process write is applied on top of the version
+    right before it; anything else clears the cache too.
+
+    The cache holds at most max_entries results taking up roughly max_bytes
+    in total. Least recently used entries are evicted first, and a single result
+    larger than a quarter of max_bytes is never cached.
+
+    Attributes:
+        max_entries (int): Maximum number of cached results; 0 disables the cache.
+        max_bytes (int): Approximate memory budget for cached results.
+        version (int): Reservation table version the cache reflects, or None.
+
+    Methods:
+        for_database(db_manager): Return the cache shared by a database.
+        get(key, version): Return a cached result, or None.
+        put(key, value, size, start, end, version): Cache a result.
+        invalidate(start, end, version): Drop results overlapping a changed booking.
+        clear(): Drop every cached result.
+        stats(): Return hit, miss, eviction and size counters.
+    '''
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries = OrderedDict()  # key -> (value, start, end, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def for_database(cls, db_manager):
+        """Return the cache shared by every calendar using db_manager"""
+        with cls._shared_lock:
+            cache = cls._shared.get(db_manager)
+            if cache is None:
+                cache = cls._shared[db_manager] = cls()
+            return cache
+
+    @staticmethod
+    def estimate_size(rows):
+        """Rough number of bytes a list of row dicts takes up"""
+        size = sys.getsizeof(rows)
+        for row in rows:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+        return size
+
+    def _clear(self, version):
+        self._entries.clear()
+        self._bytes = 0
+        self.version = version
+
+    def get(self, key, version):
+        """Return the result cached under key if the table is still at version"""
+        with self._lock:
+            if version != self.version:
+                self._clear(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, start, end, version):
+        """
+        Cache a result read at the given table version.
+
+        Args:
+            key (tuple): The query filters and range.
+            value: The result to cache.
+            size (int): Approximate bytes value takes up (see estimate_size).
+            start (int): Start of the queried range in epoch minutes.
+            end (int): End of the queried range in epoch minutes.
+            version (int): Reservation table version read before the query.
+        """
+        if self.max_entries <= 0 or version is None:
+            return
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            # a write since the query started makes the result suspect
+            if version != self.version:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+            self._entries[key] = (value, start, end, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, start, end, version):
+        """Drop the results whose range overlaps [start, end], a booking changed at version"""
+        with self._lock:
+            if self.version is None or version != self.version + 1:
+                self._clear(version)
+                return
+            self.version = version
+            for key in [key for key, entry in self._entries.items()
+                        if entry[1] <= end and entry[2] >= start]:
+                self._bytes -= self._entries.pop(key)[3]
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached result"""
+        with self._lock:
+            self._clear(None)
+
+    def stats(self):
+        """Return hit, miss, eviction and invalidation counters and the current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
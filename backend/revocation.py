@@ -0,0 +1,80 @@
+# revocation.py
+import sqlite3
+import threading
+import time
+
+
+class RevocationStore:
+    '''
+    The ids (jti claims) of access tokens revoked before they expired.
+
+    Lookups are a dict membership test and never touch the database, so
+    checking every request on the event loop is cheap. Revocations are also
+    stored in the RevokedToken table so every worker sees them: the server
+    calls refresh() on a worker thread every few seconds (see main.py),
+    which compares the table's DataVersion counter with the one last loaded
+    and reloads the table only when another worker revoked a token. Rows
+    are pruned once the token they revoke has expired.
+
+    Attributes:
+        db_manager_factory (callable): Returns the DatabaseManager to use, or None to keep revocations in memory only.
+
+    Methods:
+        attach(db_manager_factory): Start storing revocations in a database.
+        revoke(jti, expires_at): Revoke a token until it expires.
+        is_revoked(jti): Check whether a token id was revoked.
+        refresh(): Reload the revocations if the table changed.
+    '''
+
+    def __init__(self, db_manager_factory=None):
+        self.db_manager_factory = db_manager_factory
+        self.version = None
+        self._revoked = {}  # jti -> expires_at (epoch seconds)
+        self._lock = threading.Lock()
+
+    def attach(self, db_manager_factory):
+        """Store revocations through db_manager_factory() from now on"""
+        with self._lock:
+            self.db_manager_factory = db_manager_factory
+            self.version = None
+
+    def is_revoked(self, jti):
+        """True if the token with this jti was revoked, as of the last refresh()"""
+        return jti is not None and jti in self._revoked
+
+    def refresh(self):
+        """Reload the revocations if another worker changed the table (blocking)"""
+        if self.db_manager_factory is None:
+            return
+        with self._lock:
+            try:
+                db_manager = self.db_manager_factory()
+                version = db_manager.get_data_version('RevokedToken')
+                if version is None or version == self.version:
+                    return
+                rows = db_manager.execute_query(
+                    "SELECT jti, expires_at FROM RevokedToken WHERE expires_at > ?", (int(time.time()),))
+            except sqlite3.Error as e:
+                print("Failed to load revoked tokens: ", str(e))
+                return
+            self._revoked = {row['jti']: row['expires_at'] for row in rows}
+            self.version = version
+
+    def revoke(self, jti, expires_at):
+        """
+        Revoke a token until it expires, pruning revocations that no longer matter.
+
+        Args:
+            jti (str): The token's jti claim.
+            expires_at (int): The token's exp claim, in epoch seconds.
+        """
+        now = int(time.time())
+        if self.db_manager_factory is not None:
+            with self.db_manager_factory().transaction() as conn:
+                conn.execute("DELETE FROM RevokedToken WHERE expires_at <= ?", (now,))
+                conn.execute("INSERT OR REPLACE INTO RevokedToken (jti, expires_at) VALUES (?, ?)",
+                             (jti, int(expires_at)))
+        with self._lock:
+            revoked = {key: expiry for key, expiry in self._revoked.items() if expiry > now}
+            revoked[jti] = int(expires_at)
+            self._revoked = revoked
@@ -14,6 +14,8 @@ $(document).ready(function() {
         }
 
         fetchLoginFormConfig() {
+            // served with an ETag and Cache-Control: no-cache, so the browser
+            // revalidates its cached copy and usually gets a 304
             fetch('/login-form')
                 .then(response => response.json())
                 .then(data => {
@@ -98,19 +100,32 @@ $(document).ready(function() {
                 jsonData[key] = value;
             });
 
-            // Send login request
+            // Send login request; if we still hold an interface, offer its
+            // ETag so the server can leave the interface out of the response
+            const headers = {
+                'Content-Type': 'application/json'
+            };
+            const cachedEtag = localStorage.getItem('interfaceEtag');
+            if (cachedEtag && localStorage.getItem('interface')) {
+                headers['If-None-Match'] = cachedEtag;
+            }
             fetch(command.route, {
                 method: command.method,
-                headers: {
-                    'Content-Type': 'application/json'
-                },
+                headers: headers,
                 body: JSON.stringify(jsonData)
             })
             .then(response => response.json())
             .then(data => {
                 if (data.access_token) {
                     localStorage.setItem('token', data.access_token);
-                    this.buildInterface(data.interface);
+                    let menuJson = data.interface;
+                    if (menuJson) {
+                        localStorage.setItem('interfaceEtag', data.interface_etag);
+                        localStorage.setItem('interface', JSON.stringify(menuJson));
+                    } else {
+                        menuJson = JSON.parse(localStorage.getItem('interface'));
+                    }
+                    this.buildInterface(menuJson);
                     this.showOnly(this.menuContainer);
                 } else {
                     this.displayError('Login failed. Please try again.');
@@ -1,15 +1,38 @@
 from fastapi.testclient import TestClient
 from fastapi import Request, HTTPException, status
 import time
-from permissions import role_required, validate_user, validate_user_token, check_role_permissions, RoleNotFoundError, PermissionDeniedError
-from token_manager import create_access_token, decode_access_token, SECRET_KEY, ALGORITHM, ExpiredTokenError, InvalidTokenError, TokenCreationError
+from permissions import role_required, validate_user, validate_user_token, check_role_permissions, RoleNotFoundError, PermissionDeniedError, token_cache
+from token_manager import create_access_token, decode_access_token, SECRET_KEY, ALGORITHM, ExpiredTokenError, InvalidTokenError, TokenCreationError, TokenCache
 import sqlite3
 from datetime import datetime, timedelta, timezone
 from jose import jwt, ExpiredSignatureError, JWTError
-from modules import DateRange, Reservation, ReservationCalendar, UserManager, DatabaseManager, BusinessManager
+from modules import DateRange, Reservation, ReservationCalendar, UserManager, DatabaseManager, BusinessManager, parse_datetime, epoch_minutes
 import pytest
-from main import app
+from main import app, API_KEY, sql_tracer, request_profiler
 import hashlib
+import threading
+import random
+import shutil
+from migrations import MIGRATIONS
+from hashing import PasswordHasher, HashingBusyError
+import asyncio
+from availability import AvailabilityIndex, MachineIntervals
+from connection_pool import ConnectionPool, PoolTimeoutError, DEFAULT_PRAGMAS, apply_pragmas
+from audit import AuditLogWriter, OperationLog
+from archive import OperationArchive
+from reservation_cache import ReservationCache
+from dispatch import BlockingDispatcher
+from revocation import RevocationStore
+from webbuilder import WebBuilder, role_menu
+from federation import FederationClient, CircuitBreaker
+from timezones import convert_timezone, convert_timezones, _convert_timezone_dateutil
+from metrics import Counter, Histogram, statement_name
+from tracing import SQLTracer, normalize_sql, request_id_var
+from profiling import RequestProfiler, ProfilingMiddleware
+import httpx
+import json
+import tracemalloc
+import pstats
 
 
 # The in memory copy ensures the original database won't be corrupted, 
@@ -65,7 +88,9 @@ def client(db):
 @pytest.fixture(scope="session")
 def db_manager(db):
     # Instantiate DatabaseManager with the in-memory database connection
-    return DatabaseManager(connection=db)
+    manager = DatabaseManager(connection=db)
+    manager.apply_migrations()
+    return manager
 
 
 @pytest.fixture
@@ -82,6 +107,105 @@ def calendar(db_manager):
 
 ############ Database Tests ############
 
+def test_pool_reuses_connections(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=2, max_overflow=0)
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    assert pool.stats()["idle"] == 1
+    pool.close()
+
+def test_pool_overflow_connections_are_closed(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=1)
+    first = pool.checkout()
+    second = pool.checkout()
+    assert pool.stats()["size"] == 2
+    pool.checkin(second)
+    pool.checkin(first)
+    assert pool.stats()["size"] == 1
+    assert pool.stats()["idle"] == 1
+    pool.close()
+
+def test_pool_timeout(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=0, timeout=0.1)
+    conn = pool.checkout()
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout()
+    pool.checkin(conn)
+    pool.close()
+
+def test_pool_waits_for_checkin(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=0, timeout=2)
+    conn = pool.checkout()
+    waiting = []
+    threading.Timer(0.05, lambda: waiting.append(pool.stats()["waiting"])).start()
+    threading.Timer(0.1, pool.checkin, args=(conn,)).start()
+    assert pool.checkout() is conn
+    assert waiting == [1] and pool.stats()["waiting"] == 0
+    pool.close()
+
+def test_pool_replaces_broken_connection(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=0, ping_interval=0)
+    conn = pool.checkout()
+    pool.checkin(conn)
+    conn.close()
+    with pool.connection() as new_conn:
+        assert new_conn is not conn
+        assert new_conn.execute("SELECT 1").fetchone() == (1,)
+    pool.close()
+
+def test_pool_rolls_back_on_checkin(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=0)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+    pool.close()
+
+
+def test_pool_applies_pragma_profile(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, max_overflow=0,
+                          on_connect=lambda conn: apply_pragmas(conn, DEFAULT_PRAGMAS))
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+        assert conn.execute("PRAGMA synchronous").fetchone() == (1,)  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone() == (2,)  # MEMORY
+        assert conn.execute("PRAGMA busy_timeout").fetchone() == (5000,)
+    pool.close()
+
+def test_migrations_are_idempotent(db_manager):
+    version = db_manager.apply_migrations()
+    assert version == len(MIGRATIONS)
+    assert db_manager.apply_migrations() == version
+
+def query_plan(db_manager, query, params):
+    rows = db_manager.execute_query("EXPLAIN QUERY PLAN " + query, params)
+    return " ".join(row['detail'] for row in rows)
+
+@pytest.mark.parametrize("method, args, index", [
+    ("retrieve_by_date", (), "idx_reservation_dates"),
+    ("retrieve_by_machine", ("scanner",), "idx_reservation_machine_dates"),
+    ("retrieve_by_customer", ("akshatha",), "idx_reservation_customer_start"),
+    ("retrieve_by_machine_and_customer", ("scanner", "akshatha"), "idx_reservation_"),
+])
+def test_retrieve_queries_use_indexes(db_manager, calendar, method, args, index):
+    captured = {}
+    original = db_manager.execute_query
+    def capture(query, params=None):
+        captured['query'], captured['params'] = query, params
+        return original(query, params)
+    db_manager.execute_query = capture
+    try:
+        getattr(calendar, method)(DateRange("2024-01-01 10:00", "2025-01-01 10:00"), *args)
+    finally:
+        del db_manager.execute_query
+    plan = query_plan(db_manager, captured['query'], captured['params'])
+    assert f"SEARCH Reservation USING INDEX {index}" in plan
+    assert "SCAN Reservation" not in plan
+
 
 ############ API ROUTES Tests ############
 # @pytest.mark.parametrize("username, password, expected_status, expected_detail", [
@@ -146,6 +270,64 @@ def test_authenticate_user_fail(setup_db, user_manager):
     result = user_manager.authenticate_user("fake", "adminpass")
     assert result == False
 
+def test_authenticate_user_async(setup_db, user_manager):
+    assert asyncio.run(user_manager.authenticate_user_async("adminTest", "adminpass"))['username'] == "adminTest"
+    assert asyncio.run(user_manager.authenticate_user_async("adminTest", "wrongpass")) == False
+
+def test_hasher_matches_pbkdf2(setup_db):
+    hasher = PasswordHasher(max_workers=1)
+    expected = hashlib.pbkdf2_hmac('sha256', b"adminpass", b"admin_salt", 100000).hex()
+    assert asyncio.run(hasher.hash_async("adminpass", "admin_salt")) == expected
+    assert asyncio.run(hasher.verify_async("adminpass", expected, "admin_salt"))
+    hasher.shutdown()
+
+def test_dispatcher_runs_off_the_event_loop(setup_db):
+    dispatcher = BlockingDispatcher(max_threads=2)
+    running = []
+    peak = []
+
+    def blocking(i):
+        running.append(i)
+        peak.append(len(running))
+        time.sleep(0.02)
+        running.remove(i)
+        return threading.get_ident()
+
+    async def main():
+        return await asyncio.gather(*(dispatcher.run(blocking, i) for i in range(6)))
+
+    idents = asyncio.run(main())
+    assert threading.get_ident() not in idents
+    assert max(peak) == 2
+
+def test_hasher_rejects_when_saturated(setup_db):
+    hasher = PasswordHasher(iterations=2000000, max_workers=1, max_pending=1)
+    async def storm():
+        first = asyncio.create_task(hasher.hash_async("a", "salt"))
+        await asyncio.sleep(0)  # let the first hash take the only slot
+        with pytest.raises(HashingBusyError):
+            await hasher.hash_async("b", "salt")
+        await first
+        assert hasher.pending() == 0
+    asyncio.run(storm())
+    hasher.shutdown()
+
+def test_hasher_keeps_slot_until_cancelled_hash_finishes(setup_db):
+    hasher = PasswordHasher(iterations=2000000, max_workers=1, max_pending=1)
+    async def cancel():
+        first = asyncio.create_task(hasher.hash_async("a", "salt"))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # the worker thread is still hashing, so its slot is still taken
+        assert hasher.pending() == 1
+        with pytest.raises(HashingBusyError):
+            await hasher.hash_async("b", "salt")
+    asyncio.run(cancel())
+    hasher.shutdown()
+    assert hasher.pending() == 0
+
 def test_update_role(setup_db, user_manager):
     user_manager.update_user_role("scheduler","adminTest")
     user = user_manager.get_user("adminTest")
@@ -205,6 +387,294 @@ def test_retrieve_by_customer_empty(setup_db, calendar):
     assert result is not None    
     assert len(result) == 0
 
+@pytest.fixture
+def paged_reservations(db_manager):
+    # two share a start time, so pages have to break ties on reservation_id
+    starts = ["2031-03-03 10:00:00", "2031-03-03 10:00:00", "2031-03-03 12:00:00", "2031-03-04 09:00:00"]
+    with db_manager.transaction() as conn:
+        for start in starts:
+            conn.execute("""INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+                            VALUES ('pager', 1, ?, datetime(?, '+1 hour'), 10, 5)""", (start, start))
+    yield [row['reservation_id'] for row in db_manager.execute_query(
+        "SELECT reservation_id FROM Reservation WHERE customer = 'pager' ORDER BY start_date, reservation_id")]
+    db_manager.execute_statement("DELETE FROM Reservation WHERE customer = 'pager'")
+
+def test_retrieve_keyset_pages(calendar, paged_reservations):
+    daterange = DateRange("2031-03-01 00:00", "2031-03-31 00:00")
+    seen, cursor = [], None
+    while True:
+        rows, cursor = calendar.retrieve(daterange, customer="pager", cursor=cursor, limit=3)
+        seen.extend(row['reservation_id'] for row in rows)
+        if cursor is None:
+            break
+    assert seen == paged_reservations
+    assert calendar.retrieve(daterange, customer="pager")[0] == calendar.retrieve_by_customer(daterange, "pager")
+
+def test_retrieve_projects_fields(calendar, paged_reservations):
+    daterange = DateRange("2031-03-01 00:00", "2031-03-31 00:00")
+    rows, cursor = calendar.retrieve(daterange, customer="pager", fields=["machine_name", "total_cost"], limit=2)
+    assert rows == [{"machine_name": rows[0]["machine_name"], "total_cost": 10.0}] * 2
+    rows, _ = calendar.retrieve(daterange, customer="pager", fields=["reservation_id"], cursor=cursor)
+    assert [row['reservation_id'] for row in rows] == paged_reservations[2:]
+    with pytest.raises(ValueError):
+        calendar.retrieve(daterange, fields=["password_hash"])
+    with pytest.raises(ValueError):
+        calendar.retrieve(daterange, cursor="bogus")
+
+def test_get_reservations_paginated(client, paged_reservations):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    params = {"customer": "pager", "start_date": "2031-03-01 00:00", "end_date": "2031-03-31 00:00",
+              "limit": 2, "fields": "reservation_id,start_date"}
+    response = client.get("/reservations", params=params, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert list(page["reservations"][0]) == ["reservation_id", "start_date"]
+    response = client.get("/reservations", params={**params, "cursor": page["next_cursor"]}, headers=headers)
+    assert [row['reservation_id'] for row in page["reservations"] + response.json()["reservations"]] \
+        == paged_reservations
+    assert response.json()["next_cursor"] is None
+    assert client.get("/reservations", params={**params, "fields": "salt"}, headers=headers).status_code == 400
+
+def test_reservation_cache_invalidates_overlapping_ranges(db_manager, paged_reservations):
+    cache = ReservationCache()
+    calendar = ReservationCalendar(db_manager, cache=cache)
+    march = DateRange("2031-03-01 00:00", "2031-03-31 00:00")
+    june = DateRange("2031-06-01 00:00", "2031-06-30 00:00")
+    first = calendar.retrieve_by_customer(march, "pager")
+    assert calendar.retrieve_by_customer(march, "pager") is first
+    calendar.retrieve_by_customer(june, "pager")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+    # cancelling a March booking drops the March result but keeps June's
+    calendar.remove_reservation(paged_reservations[0])
+    assert cache.stats()["invalidations"] == 1
+    calendar.retrieve_by_customer(june, "pager")
+    assert cache.stats()["hits"] == 2
+    assert [row['reservation_id'] for row in calendar.retrieve_by_customer(march, "pager")] \
+        == paged_reservations[1:]
+
+    # a write the cache was not told about is caught by the version check
+    db_manager.execute_statement("DELETE FROM Reservation WHERE reservation_id = ?", (paged_reservations[1],))
+    assert [row['reservation_id'] for row in calendar.retrieve_by_customer(march, "pager")] \
+        == paged_reservations[2:]
+
+def test_reservation_cache_is_bounded():
+    cache = ReservationCache(max_entries=2, max_bytes=100000)
+    cache.get("warm", 1)
+    rows = [{"reservation_id": 1, "customer": "pager"}]
+    for key in ("a", "b", "c"):
+        cache.put(key, rows, 100, 0, 10, 1)
+    assert cache.get("a", 1) is None and cache.get("c", 1) is rows
+    assert cache.stats()["evictions"] == 1
+    cache.put("big", rows, 30000, 0, 10, 1)
+    assert cache.get("big", 1) is None  # larger than a quarter of the budget
+    cache.put("stale", rows, 100, 0, 10, 0)
+    assert cache.get("stale", 1) is None  # read before a write the cache has seen
+
+def test_reservation_cache_stats_endpoint(client):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    response = client.get("/reservations/cache", headers=headers)
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions", "invalidations", "entries", "bytes"} <= set(response.json())
+
+def test_histogram_merges_thread_shards():
+    histogram = Histogram("work_seconds", "Work", ("kind",), buckets=(0.1, 1.0))
+    threads = [threading.Thread(target=lambda: [histogram.observe(value, "a") for value in (0.05, 0.5, 5)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.observe(0.1, "b")
+    lines = histogram.collect()
+    assert 'work_seconds_bucket{kind="a",le="0.1"} 4' in lines
+    assert 'work_seconds_bucket{kind="a",le="1"} 8' in lines
+    assert 'work_seconds_bucket{kind="a",le="+Inf"} 12' in lines
+    assert 'work_seconds_count{kind="a"} 12' in lines
+    assert 'work_seconds_bucket{kind="b",le="0.1"} 1' in lines  # bounds are inclusive
+
+def test_sharded_metrics_retire_exited_threads():
+    counter = Counter("jobs_total", "Jobs", ("kind",))
+    histogram = Histogram("job_seconds", "Jobs", buckets=(1.0,))
+    def work():
+        counter.inc("a")
+        histogram.observe(0.5)
+    for _ in range(50):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    # only the last thread's shard can still be listed; the rest were folded away
+    assert len(counter._shards) <= 1 and len(histogram._shards) <= 1
+    assert counter.values() == {("a",): 50}
+    assert len(counter._shards) == 0
+    assert histogram.values() == {(): ([50, 0], 25.0)}
+    counter.inc("a")
+    assert counter.values() == {("a",): 51}
+
+def test_statement_name():
+    assert statement_name("SELECT * FROM Reservation r JOIN Machine m ON 1") == "select_reservation"
+    assert statement_name("\n  INSERT INTO Operation (type) VALUES (?)") == "insert_operation"
+    assert statement_name("UPDATE User SET role = ?") == "update_user"
+    assert statement_name("SELECT 1") == "select"
+
+def test_metrics_endpoint(client, db_manager):
+    db_manager.execute_query("SELECT COUNT(*) FROM Reservation")
+    assert client.get("/metrics").status_code == 403
+    response = client.get("/metrics", headers={"API-Key": API_KEY})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/metrics",status="403"}' in text
+    assert 'db_query_duration_seconds_bucket{statement="select_reservation",le="+Inf"}' in text
+    assert "# TYPE audit_log_queue_depth gauge" in text
+    assert 'reservation_cache_lookups_total{result="hit"}' in text
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT *\n   FROM  Reservation WHERE id IN (?, ?, ?) AND name = 'o''k' LIMIT 10") \
+        == "SELECT * FROM Reservation WHERE id IN (?, ...) AND name = ? LIMIT ?"
+    assert normalize_sql("SELECT t1.col2 FROM t1") == "SELECT t1.col2 FROM t1"
+
+def test_sql_tracer_groups_statements_by_request(db_manager, monkeypatch):
+    tracer = SQLTracer(enabled=True)
+    monkeypatch.setattr(db_manager, "tracer", tracer)
+
+    def booking():
+        db_manager.execute_query("SELECT * FROM Machine WHERE name = ?", ("scanner",))
+        db_manager.execute_statement("UPDATE Machine SET name = name WHERE name = 'none'")
+
+    token = request_id_var.set("req-1")
+    try:
+        booking()
+    finally:
+        request_id_var.reset(token)
+    db_manager.execute_query("SELECT 1")  # outside a request, not traced
+
+    trace = tracer.trace("req-1")
+    assert [entry["statement"] for entry in trace["statements"]] == [
+        "SELECT * FROM Machine WHERE name = ?", "UPDATE Machine SET name = name WHERE name = ?"]
+    assert [(entry["params"], entry["rows"]) for entry in trace["statements"]] == [(1, 1), (0, 0)]
+    assert trace["statements"][0]["caller"].endswith("booking")
+    assert [summary["request_id"] for summary in tracer.requests()] == ["req-1"]
+    assert tracer.slow_queries() == []
+
+def test_slow_query_log_captures_plan(db_manager, monkeypatch, tmp_path):
+    tracer = SQLTracer(slow_query_ms=1e-6, log_path=str(tmp_path / "slow.jsonl"))
+    monkeypatch.setattr(db_manager, "tracer", tracer)
+    db_manager.execute_query("SELECT * FROM Reservation WHERE start_date < ? AND end_date > ?",
+                             ("2024-06-03 12:00:00", "2024-06-03 10:00:00"))
+    slow = tracer.slow_queries()
+    assert slow[0]["statement"] == "SELECT * FROM Reservation WHERE start_date < ? AND end_date > ?"
+    assert any("Reservation" in step for step in slow[0]["plan"])
+    assert tracer.trace(None) is None  # tracing itself is still off
+    with open(tmp_path / "slow.jsonl") as f:
+        assert json.loads(f.readline())["plan"] == slow[0]["plan"]
+
+def test_sql_trace_endpoint(client, monkeypatch):
+    monkeypatch.setattr(sql_tracer, "enabled", True)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    response = client.get("/operations", params={"limit": 1}, headers={**headers, "X-Request-ID": "trace-me"})
+    assert response.headers["X-Request-ID"] == "trace-me"
+    assert client.get("/reservations/cache", headers=headers).headers["X-Request-ID"] != "trace-me"
+
+    response = client.get("/debug/sql/trace-me", headers=headers)
+    assert response.status_code == 200
+    assert any("FROM Operation" in entry["statement"] for entry in response.json()["statements"])
+    assert client.get("/debug/sql/unknown", headers=headers).status_code == 404
+    assert "trace-me" in [summary["request_id"] for summary in client.get("/debug/sql", headers=headers).json()["requests"]]
+    assert client.get("/debug/slow-queries", headers=headers).status_code == 200
+
+def test_profiling_only_admin_requests_that_ask(client, tmp_path):
+    profiled = TestClient(ProfilingMiddleware(app, request_profiler))
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    customer = {"Authorization": f"Bearer {create_access_token({'sub': 'christian', 'role': 'customer'})}"}
+    try:
+        profiled.get("/reservations/cache", headers=admin)
+        profiled.get("/reservations/cache", headers={**customer, "X-Profile": "1"})
+        assert request_profiler.profiles() == []
+
+        assert profiled.get("/reservations/cache", headers={**admin, "X-Profile": "1"}).status_code == 200
+        [meta] = client.get("/debug/profiles", headers=admin).json()["profiles"]
+        assert (meta["path"], meta["status"]) == ("/reservations/cache", 200)
+
+        report = client.get(f"/debug/profiles/{meta['id']}", params={"sort": "tottime", "limit": 1000}, headers=admin).text
+        assert "reservation_cache_stats" in report and "permissions.py" in report
+        response = client.get(f"/debug/profiles/{meta['id']}", params={"format": "pstats"}, headers=admin)
+        (tmp_path / "request.pstats").write_bytes(response.content)
+        assert pstats.Stats(str(tmp_path / "request.pstats")).total_calls > 0
+        assert client.get(f"/debug/profiles/{meta['id']}", params={"sort": "bogus"}, headers=admin).status_code == 400
+        assert client.get("/debug/profiles/999", headers=admin).status_code == 404
+    finally:
+        request_profiler.clear()
+
+def test_profiler_samples_and_runs_one_profile_at_a_time():
+    profiler = RequestProfiler(sample_rate=1.0)
+    assert profiler.wants({"headers": []})
+    assert not RequestProfiler().wants({"headers": [(b"x-profile", b"1")]})
+    profile = profiler.begin()
+    assert profiler.begin() is None
+    profiler.finish(profile, {"path": "/"})
+    assert [meta["path"] for meta in profiler.profiles()] == ["/"]
+
+def test_export_reservations_endpoint(client, paged_reservations):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    params = {"customer": "pager", "start_date": "2031-03-01 00:00", "end_date": "2031-03-31 00:00"}
+    response = client.get("/reservations/export", params=params, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['reservation_id'] for row in rows] == paged_reservations
+    assert rows[0]['machine_name'] and rows[0]['down_payment'] == 5
+
+    response = client.get("/reservations/export", headers=headers,
+                          params={**params, "format": "csv", "fields": "reservation_id,start_date"})
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "reservation_id,start_date"
+    assert [int(line.split(",")[0]) for line in lines[1:]] == paged_reservations
+
+    empty = {**params, "format": "csv", "fields": "customer", "customer": "nobody"}
+    assert client.get("/reservations/export", params=empty, headers=headers).text == "customer\r\n"
+    assert client.get("/reservations/export", params={**params, "format": "xml"}, headers=headers).status_code == 400
+    assert client.get("/reservations/export", params={**params, "fields": "salt"}, headers=headers).status_code == 400
+
+def test_validate_query_rejects_unknown_arguments():
+    ReservationCalendar.validate_query(["reservation_id", "machine_name"], "csv")
+    with pytest.raises(ValueError, match="salt"):
+        ReservationCalendar.validate_query(["reservation_id", "salt"])
+    with pytest.raises(ValueError, match="xml"):
+        ReservationCalendar.validate_query(None, "xml")
+
+def test_export_million_reservations_in_constant_memory(db_manager, calendar):
+    with db_manager.transaction() as conn:
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < 999999)
+            INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+            SELECT 'exporter', 1 + i % 3, datetime('2033-01-01 09:00:00', '+' || (i % 129600) || ' minutes'),
+                   datetime('2033-01-01 10:00:00', '+' || (i % 129600) || ' minutes'), 100, 50
+            FROM n
+            """)
+    daterange = DateRange("2033-01-01 00:00", "2033-05-01 00:00")
+
+    async def export():
+        lines = size = 0
+        async for chunk in BlockingDispatcher().iterate(calendar.export, daterange, customer="exporter",
+                                                        fields=["reservation_id", "start_date", "total_cost"]):
+            lines += chunk.count(b"\n")
+            size += len(chunk)
+        return lines, size
+
+    tracemalloc.start()
+    try:
+        lines, size = asyncio.run(export())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        db_manager.execute_statement("DELETE FROM Reservation WHERE customer = 'exporter'")
+    assert lines == 1000000
+    # tens of megabytes went out, but only a chunk or two were ever held at once
+    assert size > 50_000_000
+    assert peak < 5_000_000
+
 def test_add_reservation(setup_db, transaction, calendar, biz_manager):
     daterange = DateRange("2024-06-20 11:00","2025-06-20 12:00")
     reservation = Reservation("akshatha", "scooper", daterange, biz_manager)
@@ -309,6 +779,250 @@ def test_calculate_refund_fail(setup_db, transaction, calendar, biz_manager):
         assert cost > 0
         assert isinstance(cost, float)
 
+@pytest.mark.parametrize("text", ["2024-06-03 10:00", "2024-6-3 9:05", "2024-06-03 23:59"])
+def test_parse_datetime_matches_strptime(text):
+    assert parse_datetime(text) == datetime.strptime(text, "%Y-%m-%d %H:%M")
+
+@pytest.mark.parametrize("text", ["2024-06-03T10:00", "2024-06-03 10:00:00", "2024-06-03 10+00", "2024-13-03 10:00"])
+def test_parse_datetime_rejects_other_formats(text):
+    with pytest.raises(ValueError):
+        parse_datetime(text)
+
+def test_date_range_minutes(setup_db):
+    daterange = DateRange.from_db("2024-06-03 10:00:00", "2024-06-03 12:30:00")
+    assert daterange.start_minute == int(datetime(2024, 6, 3, 10, tzinfo=timezone.utc).timestamp()) // 60
+    assert daterange.end_minute - daterange.start_minute == 150
+    assert daterange.hours() == 2
+    assert daterange == DateRange("2024-06-03 12:30", "2024-06-03 13:00")
+    assert not daterange == DateRange("2024-06-03 12:31", "2024-06-03 13:00")
+
+def test_peak_counts_concurrent_not_overlapping(setup_db):
+    intervals = MachineIntervals()  # times in minutes
+    intervals.add(600, 660, 1)
+    intervals.add(700, 760, 2)
+    # both overlap the window, but never at the same time
+    assert intervals.peak(540, 900) == 1
+    assert intervals.peak(661, 699) == 0
+    # intervals are closed: back-to-back bookings share their boundary minute
+    intervals.add(660, 700, 3)
+    assert intervals.peak(540, 900) == 2
+    assert intervals.peak(760, 800) == 1 and intervals.peak(761, 800) == 0
+    assert intervals.peak(540, 600) == 1 and intervals.peak(540, 599) == 0
+    assert intervals.remove(660, 700, 3)
+    assert intervals.peak(540, 900) == 1
+
+def test_availability_index_goes_stale_on_missed_change(setup_db):
+    index = AvailabilityIndex()
+    index.load([(1, "scanner", 600, 720)], 5)
+    index.add("scanner", 2, 600, 720, 6)
+    assert index.version == 6
+    assert index.peak("scanner", 660, 720) == 2
+    index.remove(2, 8)  # version 7 was never seen
+    assert index.version is None
+
+def test_availability_follows_other_connections(setup_db, calendar, biz_manager, db):
+    daterange = DateRange("2030-06-04 10:00", "2030-06-04 12:00")
+    reservation = Reservation("graham", "harvester", daterange, biz_manager)
+    calendar._check_equipment_availability(reservation)
+    # a change made behind the calendar's back bumps the table version
+    db.execute("""INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+                  VALUES ('graham', 3, '2030-06-04 11:00:00', '2030-06-04 13:00:00', 1, 1)""")
+    db.commit()
+    try:
+        with pytest.raises(ValueError):
+            calendar._check_equipment_availability(reservation)
+    finally:
+        db.execute("DELETE FROM Reservation WHERE start_date = '2030-06-04 11:00:00'")
+        db.commit()
+    calendar._check_equipment_availability(reservation)
+
+def test_availability_machine_rules(setup_db, calendar, biz_manager, db):
+    def check(machine, start, end):
+        calendar._check_equipment_availability(
+            Reservation("graham", machine, DateRange(f"2030-06-05 {start}", f"2030-06-05 {end}"), biz_manager))
+
+    db.execute("""INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+                  VALUES ('graham', 3, '2030-06-05 10:00:00', '2030-06-05 12:00:00', 1, 1)""")
+    db.commit()
+    try:
+        with pytest.raises(ValueError, match="harvester is already reserved"):
+            check("harvester", "11:00", "13:00")
+        # periods include both ends, so a booking cannot start when the harvester's ends
+        with pytest.raises(ValueError, match="harvester is already reserved"):
+            check("harvester", "12:00", "13:00")
+        with pytest.raises(ValueError, match="harvester is in use"):
+            check("scanner", "09:00", "10:00")
+        check("harvester", "12:01", "13:00")
+        check("scanner", "12:01", "13:00")
+        check("scooper", "11:00", "12:00")
+        tractor = Reservation("graham", "scooper", DateRange("2030-06-05 14:00", "2030-06-05 15:00"), biz_manager)
+        tractor.machine = "tractor"
+        with pytest.raises(ValueError, match="specified machines"):
+            calendar._check_equipment_availability(tractor)
+    finally:
+        db.execute("DELETE FROM Reservation WHERE start_date = '2030-06-05 10:00:00'")
+        db.commit()
+
+def next_weekday(days_ahead):
+    day = datetime.now() + timedelta(days=days_ahead)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+def test_transaction_rolls_back_on_error(setup_db, db_manager):
+    with pytest.raises(ValueError):
+        with db_manager.transaction():
+            db_manager.execute_statement("UPDATE BusinessRules SET harvester_price = -1")
+            raise ValueError("abort")
+    assert db_manager.execute_query("SELECT harvester_price FROM BusinessRules")[0]['harvester_price'] != -1
+
+def test_database_manager_reopens_after_close(tmp_path, monkeypatch):
+    # the singleton outlives a server lifespan, so a second one must still get connections
+    path = str(tmp_path / "reopen.db")
+    shutil.copy('../reservationDB.db', path)
+    monkeypatch.setattr(DatabaseManager, "_instance", None)
+    manager = DatabaseManager(path, pool_size=1)
+    query = "SELECT COUNT(*) AS machines FROM Machine"
+    machines = manager.execute_query(query)
+    manager.close()
+    assert DatabaseManager(path).execute_query(query) == machines
+    manager.close()
+
+def test_concurrent_bookings_never_exceed_capacity(tmp_path, monkeypatch):
+    # a separate file database, so bookings race on real pooled connections
+    path = str(tmp_path / "stress.db")
+    shutil.copy('../reservationDB.db', path)
+    monkeypatch.setattr(DatabaseManager, "_instance", None)
+    manager = DatabaseManager(path, pool_size=8, max_overflow=8, pool_timeout=30)
+    manager.apply_migrations()
+    calendar = ReservationCalendar(manager)
+    day = next_weekday(3)
+    rng = random.Random(51220)
+    requests = []
+    for _ in range(300):
+        start = rng.randrange(9 * 60, 17 * 60, 15)
+        end = min(start + rng.choice([30, 60, 90, 120]), 18 * 60)
+        requests.append((rng.choice(["scanner", "scanner", "scooper", "harvester"]),
+                         f"{day} {start // 60:02d}:{start % 60:02d}",
+                         f"{day} {end // 60:02d}:{end % 60:02d}"))
+
+    barrier = threading.Barrier(len(requests))
+    def book(machine, start, end):
+        reservation = Reservation("graham", machine, DateRange(start, end), calendar.biz_manager)
+        barrier.wait()
+        try:
+            calendar.add_reservation(reservation)
+        except ValueError:
+            pass
+
+    threads = [threading.Thread(target=book, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rows = manager.execute_query("""
+        SELECT Machine.name AS machine_name, start_date, end_date
+        FROM Reservation JOIN Machine ON Reservation.machine_id = Machine.machine_id
+        WHERE start_date LIKE ?""", (f"{day}%",))
+    manager.close()
+    booked = {}
+    for row in rows:
+        booked.setdefault(row['machine_name'], MachineIntervals()).add(
+            epoch_minutes(datetime.strptime(row['start_date'], "%Y-%m-%d %H:%M:%S")),
+            epoch_minutes(datetime.strptime(row['end_date'], "%Y-%m-%d %H:%M:%S")), len(booked))
+    assert rows
+    day_start = epoch_minutes(datetime.strptime(day, "%Y-%m-%d"))
+    day_end = day_start + 1440
+    for machine, capacity in [("scanner", calendar.biz_manager.number_of_scanners),
+                              ("scooper", calendar.biz_manager.number_of_scoopers),
+                              ("harvester", 1)]:
+        if machine in booked:
+            assert booked[machine].peak(day_start, day_end) <= capacity
+    # scanners and the harvester never run at the same time
+    for start, end, _ in booked.get("harvester", MachineIntervals()).intervals:
+        assert "scanner" not in booked or booked["scanner"].peak(start, end) == 0
+
+def test_outside_request_batch(setup_db, db_manager, client, monkeypatch):
+    day = next_weekday(3)
+    request = {"start_time": f"{day} 10:00", "end_time": f"{day} 11:00", "client_name": "partner",
+               "machine_name": "scooper", "time_zone": "GMT-5", "blocks": "Null"}
+    batch = [request, request,
+             {**request, "machine_name": "spaceship"},
+             {**request, "start_time": "not a date"},
+             {**request, "start_time": f"{day} 06:00"}]
+    checks = []
+    check = ReservationCalendar._check_equipment_availability
+    monkeypatch.setattr(ReservationCalendar, "_check_equipment_availability",
+                        lambda self, reservation: checks.append(reservation) or check(self, reservation))
+    try:
+        response = client.post("/outside-requests/batch", json=batch, headers={"API-Key": API_KEY})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["reservation_made_success"] for result in results] == [True, True, False, False, False]
+        assert results[0]["cost"] == results[1]["cost"] > 0
+        assert results[0]["down_payment"] == results[0]["cost"] / 2
+        assert len(checks) == 1  # both bookings share one machine and window
+        rows = db_manager.execute_query("SELECT * FROM Remote_Reservation WHERE customer = 'partner'")
+        assert len(rows) == 2
+    finally:
+        db_manager.execute_statement("DELETE FROM Remote_Reservation WHERE customer = 'partner'")
+
+def test_outside_request_batch_limit(client, monkeypatch):
+    monkeypatch.setattr("main.OUTSIDE_BATCH_LIMIT", 1)
+    request = {"start_time": "2024-06-03 10:00", "end_time": "2024-06-03 11:00", "client_name": "partner",
+               "machine_name": "scooper", "time_zone": "GMT-5", "blocks": "Null"}
+    response = client.post("/outside-requests/batch", json=[request, request], headers={"API-Key": API_KEY})
+    assert response.status_code == 413
+
+@pytest.mark.parametrize("from_zone", ["GMT-5", "GMT+2", "GMT", "UTC-3", "GMT+5:30", "GMT+0530", "GMT-12", "GMT+14"])
+@pytest.mark.parametrize("to_zone", ["GMT-5", "GMT+5:30", "UTC", "America/Chicago"])
+def test_convert_timezone_matches_dateutil(from_zone, to_zone):
+    times = ["2024-06-03 10:00", "2024-12-31 23:30", "2024-03-10 07:59", "2024-11-03 06:30"]
+    expected = [_convert_timezone_dateutil(time, from_zone, to_zone) for time in times]
+    assert [convert_timezone(time, from_zone, to_zone) for time in times] == expected
+    assert convert_timezones(times, from_zone, to_zone) == expected
+
+@pytest.mark.parametrize("time, from_zone", [("2024-6-3 9:05", "GMT-5"), ("2024-06-03T10:00", "GMT-5"),
+                                             ("2024-06-03 10:00", "EST")])
+def test_convert_timezone_falls_back_to_dateutil(time, from_zone):
+    expected = _convert_timezone_dateutil(time, from_zone, "America/Chicago")
+    assert convert_timezone(time, from_zone, "America/Chicago") == expected
+    assert convert_timezones(["2024-06-03 10:00", time], from_zone, "America/Chicago")[1] == expected
+
+def test_convert_timezones_rejects_bad_input():
+    with pytest.raises(ValueError):
+        convert_timezones(["2024-06-03 10:00", "not a date"], "GMT-5", "America/Chicago")
+
+def test_business_rules_snapshot_is_shared(setup_db, db_manager, biz_manager):
+    other = BusinessManager(db_manager)
+    assert other.rules is biz_manager.rules
+    with pytest.raises(TypeError):
+        other.rules['harvester_price'] = 1
+
+def test_update_rule_swaps_snapshot(setup_db, db_manager, biz_manager):
+    original = biz_manager.harvester_price
+    try:
+        biz_manager.update_rule("harvester_price", original + 1)
+        assert biz_manager.harvester_price == original + 1
+        assert BusinessManager(db_manager).harvester_price == original + 1
+    finally:
+        biz_manager.update_rule("harvester_price", original)
+
+def test_business_rules_reload_after_external_change(setup_db, db, db_manager, biz_manager):
+    original = biz_manager.scanner_price_per_hour
+    db.execute("UPDATE BusinessRules SET scanner_price_per_hour = ?", (original + 10,))
+    db.commit()
+    try:
+        assert BusinessManager(db_manager).scanner_price_per_hour == original + 10
+    finally:
+        db.execute("UPDATE BusinessRules SET scanner_price_per_hour = ?", (original,))
+        db.commit()
+
+def test_update_unknown_rule(setup_db, biz_manager):
+    with pytest.raises(ValueError):
+        biz_manager.update_rule("harvester_price = 0 --", 1)
+
 def test_get_rule(setup_db, biz_manager):
     value = biz_manager.get_rule("week_refund")
     assert value is not None
@@ -321,6 +1035,266 @@ def test_get_rule_fail(setup_db, biz_manager):
         assert isinstance(value, str)
 
 
+############ Federation Tests ############
+
+def stub_facilities(behaviour):
+    """A transport standing in for partner servers, keyed by host"""
+    async def handler(request):
+        action = behaviour[request.url.host]
+        if action == "down":
+            raise httpx.ConnectError("connection refused", request=request)
+        if action == "error":
+            return httpx.Response(500)
+        delay, success = action
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"reservation_made_success": success,
+                                          "message": "(990.0,495.0)" if success else "unavailable"})
+    return httpx.MockTransport(handler)
+
+REMOTE_PAYLOAD = {"start_time": "2024-06-03 10:00", "end_time": "2024-06-03 11:00", "client_name": "graham",
+                  "machine_name": "scanner", "time_zone": "GMT-5", "blocks": "Null"}
+
+def test_federation_first_success_wins():
+    transport = stub_facilities({"slow": (2, True), "fast": (0.05, True), "full": (0, False), "broken": "error"})
+    client = FederationClient(["http://slow", "http://fast", "http://full", "http://broken"], "key",
+                              transport=transport)
+    began = time.perf_counter()
+    result = asyncio.run(client.reserve(REMOTE_PAYLOAD))
+    assert time.perf_counter() - began < 1  # the slow partner was cancelled, not awaited
+    assert result["peer"] == "http://fast"
+    assert result["response"]["message"] == "(990.0,495.0)"
+    assert result["latency_ms"]["http://slow"] is None
+    assert result["latency_ms"]["http://fast"] >= 50
+    assert set(result["errors"]) == {"http://full", "http://broken"}
+
+def test_federation_timeouts_open_the_circuit():
+    transport = stub_facilities({"hung": (1, True), "down": "down"})
+    client = FederationClient(["http://hung", "http://down"], "key", timeout=0.05,
+                              failure_threshold=2, transport=transport)
+
+    async def attempts():
+        return [await client.reserve(REMOTE_PAYLOAD) for _ in range(3)]
+
+    results = asyncio.run(attempts())
+    assert all(result["peer"] is None for result in results)
+    assert results[2]["errors"] == {"http://hung": "circuit open", "http://down": "circuit open"}
+    assert client.stats()["http://hung"]["state"] == "open"
+
+def test_circuit_breaker_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.allow()      # one trial request
+    assert not breaker.allow()  # and only one
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+############ Audit Log Tests ############
+
+@pytest.fixture
+def audit_rows(db_manager):
+    yield lambda: db_manager.execute_query(
+        "SELECT user_id, description FROM Operation WHERE type = 'audit test' ORDER BY operation_id")
+    db_manager.execute_statement("DELETE FROM Operation WHERE type = 'audit test'")
+
+def test_audit_log_writes_batches(setup_db, db_manager, audit_rows):
+    writer = AuditLogWriter(lambda: db_manager, batch_size=3, flush_interval=0.05)
+    for i in range(7):
+        assert writer.log("adminTest", "audit test", f"entry {i}", datetime.now())
+    writer.stop()
+    rows = audit_rows()
+    assert [row['description'] for row in rows] == [f"entry {i}" for i in range(7)]
+    assert writer.stats() == {"queued": 0, "written": 7, "dropped": 0, "skipped": 0}
+
+def test_audit_log_skips_unknown_user(setup_db, db_manager, audit_rows):
+    writer = AuditLogWriter(lambda: db_manager)
+    writer.log("noSuchUser", "audit test", "ghost", datetime.now())
+    writer.log("adminTest", "audit test", "real", datetime.now())
+    writer.stop()
+    assert [row['description'] for row in audit_rows()] == ["real"]
+    assert writer.skipped == 1
+
+def test_audit_log_drops_when_full(setup_db, db_manager, audit_rows):
+    writer = AuditLogWriter(lambda: db_manager, max_queue=2)
+    writer.start = lambda: None  # no writer thread, so the queue stays full
+    results = [writer.log("adminTest", "audit test", f"entry {i}", datetime.now()) for i in range(3)]
+    assert results == [True, True, False]
+    assert writer.dropped == 1
+    writer.flush()
+    assert len(audit_rows()) == 2
+
+def test_audit_log_counts_drops_from_many_threads(setup_db, db_manager):
+    writer = AuditLogWriter(lambda: db_manager, max_queue=1)
+    writer.start = lambda: None
+    writer.log("adminTest", "audit test", "fills the queue", datetime.now())
+    def flood():
+        for _ in range(2000):
+            writer.log("adminTest", "audit test", "dropped", datetime.now())
+    threads = [threading.Thread(target=flood) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.stats()["dropped"] == 16000
+    writer._take(1)  # never written
+
+class FlakyTransactions:
+    """A DatabaseManager whose first few transactions fail with 'database is locked'"""
+    def __init__(self, db_manager, failures):
+        self.db_manager = db_manager
+        self.failures = failures
+
+    def execute_query(self, *args):
+        return self.db_manager.execute_query(*args)
+
+    def transaction(self):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.db_manager.transaction()
+
+def test_audit_log_retries_locked_database(setup_db, db_manager, audit_rows):
+    writer = AuditLogWriter(lambda: flaky, retries=2, retry_delay=0)
+    flaky = FlakyTransactions(db_manager, failures=2)
+    writer.start = lambda: None
+    writer.log("noSuchUser", "audit test", "ghost", datetime.now())
+    writer.log("adminTest", "audit test", "entry", datetime.now())
+    writer.flush()
+    assert [row['description'] for row in audit_rows()] == ["entry"]
+    assert writer.stats() == {"queued": 0, "written": 1, "dropped": 0, "skipped": 1}
+
+def test_audit_log_drops_batch_after_retries(setup_db, db_manager, audit_rows):
+    writer = AuditLogWriter(lambda: flaky, retries=2, retry_delay=0)
+    flaky = FlakyTransactions(db_manager, failures=3)
+    writer.start = lambda: None
+    for i in range(2):
+        writer.log("adminTest", "audit test", f"entry {i}", datetime.now())
+    writer.flush()
+    assert audit_rows() == []
+    assert writer.stats() == {"queued": 0, "written": 0, "dropped": 2, "skipped": 0}
+
+@pytest.fixture
+def logged_operations(setup_db, db_manager, audit_rows):
+    # three rows share a timestamp, so pages have to break ties on operation_id
+    user_id = db_manager.execute_query("SELECT user_id FROM User WHERE username = 'adminTest'")[0]['user_id']
+    timestamps = ["2024-05-01 10:00:00", "2024-05-01 11:00:00", "2024-05-01 11:00:00",
+                  "2024-05-01 11:00:00", "2024-05-02 09:00:00"]
+    with db_manager.transaction() as conn:
+        conn.executemany("INSERT INTO Operation (user_id, type, description, timestamp) VALUES (?, 'audit test', ?, ?)",
+                         [(user_id, f"entry {i}", timestamp) for i, timestamp in enumerate(timestamps)])
+    return [f"entry {i}" for i in (4, 3, 2, 1, 0)]  # newest first
+
+def test_operation_log_keyset_pages(db_manager, logged_operations):
+    operation_log = OperationLog(db_manager)
+    seen, cursor = [], None
+    while True:
+        rows, cursor = operation_log.page(type="audit test", cursor=cursor, limit=2)
+        seen.extend(row['description'] for row in rows)
+        if cursor is None:
+            break
+    assert seen == logged_operations
+    rows, _ = operation_log.page(user="adminTest", type="audit test",
+                                 since="2024-05-01 11:00:00", until="2024-05-02 00:00:00")
+    assert [row['description'] for row in rows] == logged_operations[1:4]
+    assert all(row['username'] == "adminTest" for row in rows)
+    assert operation_log.page(user="nobody", type="audit test") == ([], None)
+    with pytest.raises(ValueError):
+        operation_log.page(cursor="not a cursor")
+
+def test_operation_log_oldest_first(db_manager, logged_operations):
+    pages = list(OperationLog(db_manager).iter_pages(type="audit test", limit=2, oldest_first=True))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [row['description'] for page in pages for row in page] == logged_operations[::-1]
+
+def test_operation_archive_moves_old_rows(tmp_path, db_manager, logged_operations):
+    archive = OperationArchive(str(tmp_path), lambda: db_manager, retention_days=1, batch_size=2)
+    # everything before 2024-05-02 is past the horizon: entries 0 to 3
+    assert archive.run(now=datetime(2024, 5, 3, 12)) == 4
+    assert archive.run(now=datetime(2024, 5, 3, 12)) == 0
+    remaining, _ = OperationLog(db_manager).page(type="audit test")
+    assert [row['description'] for row in remaining] == logged_operations[:1]
+
+    assert [segment['name'] for segment in archive.segments()] == ["operations-2024-05-01.jsonl.gz"]
+    assert archive.segments()[0]['rows'] == 4
+    archived = list(archive.read(type="audit test"))
+    assert [row['description'] for row in archived] == logged_operations[:0:-1]
+    assert archived[0]['username'] == "adminTest"
+    assert [row['description'] for row in archive.read(type="audit test", since="2024-05-01 10:30:00")] \
+        == logged_operations[3:0:-1]
+    assert list(archive.read(type="audit test", until="2024-05-01 00:00:00")) == []
+
+def test_operation_archive_recovers_from_interrupted_run(tmp_path, db_manager, logged_operations):
+    archive = OperationArchive(str(tmp_path), lambda: db_manager, retention_days=1)
+    assert archive.run(now=datetime(2024, 5, 3, 12)) == 4
+    segment = tmp_path / "operations-2024-05-01.jsonl.gz"
+    # a run that died after appending but before updating the index
+    with open(segment, "ab") as f:
+        f.write(b"partial gzip member")
+    # the last row archived and indexed, as if its delete never committed
+    last = list(archive.read(type="audit test"))[-1]
+    assert archive.load_index()["archived_through"] == [last['timestamp'], last['operation_id']]
+    db_manager.execute_statement(
+        "INSERT INTO Operation (operation_id, user_id, timestamp, type, description) VALUES (?, ?, ?, ?, ?)",
+        (last['operation_id'], last['user_id'], last['timestamp'], last['type'], last['description']))
+    # only entry 4 is newly archived; the reinserted row is dropped, not archived twice
+    assert archive.run(now=datetime(2024, 5, 4, 12)) == 1
+    assert segment.stat().st_size == archive.load_index()["segments"][segment.name]["size"]
+    assert [row['description'] for row in archive.read(type="audit test")] == logged_operations[::-1]
+    assert OperationLog(db_manager).page(type="audit test") == ([], None)
+
+def test_operation_archive_recovers_once_per_run(tmp_path, db_manager, logged_operations, monkeypatch):
+    archive = OperationArchive(str(tmp_path), lambda: db_manager, retention_days=1, batch_size=1)
+    recoveries = []
+    recover = archive._recover
+    monkeypatch.setattr(archive, "_recover", lambda: recoveries.append(recover()))
+    assert archive.run(now=datetime(2024, 5, 3, 12)) == 4
+    assert len(recoveries) == 1
+
+def test_list_archived_operations_endpoint(tmp_path, db_manager, client, logged_operations, monkeypatch):
+    archive = OperationArchive(str(tmp_path), lambda: db_manager, retention_days=1)
+    archive.run(now=datetime(2024, 5, 3, 12))
+    monkeypatch.setattr("main.operation_archive", archive)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    response = client.get("/operations/archive", params={"type": "audit test", "since": "2024-05-01 11:00"},
+                          headers=headers)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['description'] for row in lines] == logged_operations[3:0:-1]
+
+@pytest.mark.parametrize("where, index", [("", "idx_operation_timestamp"),
+                                          ("WHERE user_id = 1", "idx_operation_user_timestamp"),
+                                          ("WHERE type = 'login'", "idx_operation_type_timestamp")])
+def test_operation_queries_use_indexes(db_manager, where, index):
+    plan = db_manager.execute_query(f"EXPLAIN QUERY PLAN SELECT * FROM Operation {where} "
+                                    "ORDER BY timestamp DESC, operation_id DESC LIMIT 10")
+    assert any(index in row['detail'] for row in plan)
+    assert not any("TEMP B-TREE" in row['detail'] for row in plan)
+
+def test_list_operations_endpoint(db_manager, client, logged_operations):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}"}
+    response = client.get("/operations", params={"type": "audit test", "limit": 3}, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [row['description'] for row in page["operations"]] == logged_operations[:3]
+    response = client.get("/operations", params={"type": "audit test", "cursor": page["next_cursor"]},
+                          headers=headers)
+    assert [row['description'] for row in response.json()["operations"]] == logged_operations[3:]
+    assert response.json()["next_cursor"] is None
+
+    response = client.get("/operations", params={"type": "audit test", "since": "2024-05-01 10:30",
+                                                 "limit": 1, "stream": True}, headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['description'] for row in lines] == logged_operations[:4]
+
+    assert client.get("/operations", params={"cursor": "bogus"}, headers=headers).status_code == 400
+    assert client.get("/operations", params={"since": "yesterday"}, headers=headers).status_code == 400
+    customer = {"Authorization": f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'customer'})}"}
+    assert client.get("/operations", headers=customer).status_code == 403
+
+
 
 
 
@@ -434,6 +1408,95 @@ def test_validate_user_token_no_user_or_role():
     assert excinfo.value.status_code == 401
     assert excinfo.value.detail == "Invalid token: no user or role"
 
+def test_validate_user_token_uses_cache(monkeypatch):
+    token = create_access_token({"sub": "testuser", "role": "customer"})
+    calls = []
+    monkeypatch.setattr("permissions.decode_access_token",
+                        lambda t: calls.append(t) or decode_access_token(t))
+    for _ in range(3):
+        assert validate_user_token(f"Bearer {token}") == ("testuser", "customer")
+    assert len(calls) == 1
+
+def test_validate_user_token_does_not_cache_invalid():
+    size = len(token_cache)
+    for i in range(5):
+        with pytest.raises(HTTPException):
+            validate_user_token(f"Bearer invalid_token_{i}")
+    assert len(token_cache) == size
+
+@pytest.fixture
+def revoked_tokens(db_manager):
+    yield
+    db_manager.execute_statement("DELETE FROM RevokedToken")
+
+def test_revocation_is_shared_between_workers(setup_db, db_manager, revoked_tokens):
+    worker_a = RevocationStore(lambda: db_manager)
+    worker_b = RevocationStore(lambda: db_manager)
+    worker_b.refresh()
+    assert not worker_b.is_revoked("abc")
+    worker_a.revoke("abc", time.time() + 60)
+    assert worker_a.is_revoked("abc")
+    assert not worker_b.is_revoked("abc")  # lookups never query the database
+    worker_b.refresh()
+    assert worker_b.is_revoked("abc")
+
+def test_revocation_prunes_expired(setup_db, db_manager, revoked_tokens):
+    store = RevocationStore(lambda: db_manager)
+    store.revoke("old", time.time() - 1)
+    store.revoke("new", time.time() + 60)
+    rows = db_manager.execute_query("SELECT jti FROM RevokedToken")
+    assert [row['jti'] for row in rows] == ["new"]
+    assert not store.is_revoked("old")
+
+def test_logout_revokes_token(setup_db, db_manager, client, revoked_tokens, monkeypatch):
+    token = create_access_token({"sub": "adminTest", "role": "admin"})
+    assert validate_user_token(f"Bearer {token}") == ("adminTest", "admin")
+    def decode(token):
+        raise AssertionError("the token was already verified")
+    monkeypatch.setattr("permissions.decode_access_token", decode)
+    response = client.post("/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    monkeypatch.undo()
+    with pytest.raises(HTTPException) as excinfo:
+        validate_user_token(f"Bearer {token}")
+    assert excinfo.value.detail == "Token has been revoked"
+    # a fresh token for the same user still works
+    assert validate_user_token(f"Bearer {create_access_token({'sub': 'adminTest', 'role': 'admin'})}")
+
+def test_login_form_revalidates_with_etag(client):
+    response = client.get("/login-form")
+    assert response.status_code == 200
+    assert response.json() == WebBuilder().build_menu()
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+    response = client.get("/login-form", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_login_omits_known_interface(setup_db, db_manager, client):
+    credentials = {"username": "adminTest", "password": "adminpass"}
+    response = client.post("/login", json=credentials)
+    assert response.status_code == 200
+    body = response.json()
+    role = decode_access_token(body["access_token"])["role"]  # other tests change adminTest's role
+    assert body["interface"] == WebBuilder(role).build_menu()
+    assert body["interface_etag"] == role_menu(role).etag
+    response = client.post("/login", json=credentials, headers={"If-None-Match": body["interface_etag"]})
+    assert response.status_code == 200
+    assert "interface" not in response.json()
+    assert response.json()["access_token"]
+
+def test_token_cache_evicts_expired_and_oldest():
+    cache = TokenCache(maxsize=2)
+    cache.put("expired", {"sub": "a", "role": "customer", "exp": time.time() - 1})
+    assert cache.get("expired") is None
+    assert len(cache) == 0
+    for name in ("a", "b", "c"):
+        cache.put(name, {"sub": name, "role": "customer", "exp": time.time() + 60})
+    assert cache.get("a") is None
+    assert cache.get("c")["sub"] == "c"
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 2}
+
 
 def is_customer_accessing_own_data(user_username, **kwargs):
     customer_name = kwargs.get('customer')
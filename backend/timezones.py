@@ -0,0 +1,97 @@
+# timezones.py
+import re
+from datetime import timedelta, timezone
+from functools import lru_cache
+
+from dateutil import parser, tz
+
+from modules import parse_datetime
+
+# 'GMT-5', 'UTC+3', 'GMT+5:30', 'GMT+0530' or a bare 'GMT'/'UTC'; the
+# offset is east of UTC, so GMT-5 is five hours behind UTC
+_GMT_OFFSET = re.compile(r'(?:GMT|UTC)(?:([+-])(\d{1,2})(?::?(\d{2}))?)?')
+
+
+@lru_cache(maxsize=256)
+def gmt_offset(name):
+    """The fixed-offset tzinfo of a 'GMT±N' name, or None for other names"""
+    match = _GMT_OFFSET.fullmatch(name)
+    if match is None:
+        return None
+    sign, hours, minutes = match.groups()
+    offset = timedelta(hours=int(hours or 0), minutes=int(minutes or 0))
+    if offset >= timedelta(hours=24) or int(minutes or 0) >= 60:
+        return None
+    return timezone(-offset if sign == '-' else offset)
+
+
+@lru_cache(maxsize=256)
+def resolve_timezone(name):
+    """The tzinfo of a time zone name, resolved once per name"""
+    return gmt_offset(name) or tz.gettz(name)
+
+
+def _convert_timezone_dateutil(date_string, from_timezone, to_timezone):
+    # free-form fallback for input the fast path does not understand
+
+    # dateutil uses opposite sign conventions
+    if "+" in from_timezone:
+        from_timezone = from_timezone.replace("+","-")
+    else:
+        from_timezone = from_timezone.replace("-","+")
+
+    datetime_obj = parser.parse(date_string + ' ' + from_timezone)
+
+    to_timezone = tz.gettz(to_timezone)
+
+    # Convert the datetime object to the target timezone
+    datetime_obj = datetime_obj.astimezone(to_timezone)
+
+    # Format the datetime object back to string
+    return datetime_obj.strftime('%Y-%m-%d %H:%M')
+
+
+def _format(value):
+    return value.replace(tzinfo=None).isoformat(' ', 'minutes')
+
+
+def convert_timezone(date_string, from_timezone, to_timezone):
+    """
+    Converts a 'YYYY-MM-DD HH:MM' string from one timezone to another.
+
+    'GMT±N' source zones and zero-padded times take a fast path; anything
+    else goes through dateutil's free-form parser as before.
+    """
+    from_zone = gmt_offset(from_timezone)
+    if from_zone is not None:
+        try:
+            value = parse_datetime(date_string)
+        except ValueError:
+            pass
+        else:
+            return _format(value.replace(tzinfo=from_zone).astimezone(resolve_timezone(to_timezone)))
+    return _convert_timezone_dateutil(date_string, from_timezone, to_timezone)
+
+
+def convert_timezones(date_strings, from_timezone, to_timezone):
+    """
+    Convert many 'YYYY-MM-DD HH:MM' strings between the same two time zones.
+
+    When both zones are fixed offsets the conversion is the same shift for
+    every timestamp, so it is computed once and only added per item.
+
+    Raises:
+        ValueError: If any of the strings cannot be parsed at all.
+    """
+    from_zone = gmt_offset(from_timezone)
+    to_zone = resolve_timezone(to_timezone)
+    try:
+        if from_zone is not None and isinstance(to_zone, timezone):
+            shift = to_zone.utcoffset(None) - from_zone.utcoffset(None)
+            return [(parse_datetime(text) + shift).isoformat(' ', 'minutes') for text in date_strings]
+        if from_zone is not None:
+            return [_format(parse_datetime(text).replace(tzinfo=from_zone).astimezone(to_zone))
+                    for text in date_strings]
+    except ValueError:
+        pass  # some strings need the free-form parser
+    return [convert_timezone(text, from_timezone, to_timezone) for text in date_strings]
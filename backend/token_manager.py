@@ -1,5 +1,9 @@
 # token_manager.py
 from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+import threading
+import time
+import uuid
 from jose import jwt, ExpiredSignatureError, JWTError
 
 SECRET_KEY = "SUPER_SECRET_KEY"
@@ -28,6 +32,8 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
         else:
             expire = datetime.now(timezone.utc) + timedelta(minutes=15)  # Default to 15 minutes
         to_encode.update({"exp": expire})
+        # a unique id, so a single token can be revoked on logout
+        to_encode.setdefault("jti", uuid.uuid4().hex)
 
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
@@ -36,13 +42,80 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 def decode_access_token(token: str):
     try:
-        decoded_token = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        exp_timestamp = decoded_token.get("exp")
-        exp_datetime = datetime.fromtimestamp(exp_timestamp, tz=timezone.utc)
-        if exp_datetime < datetime.now(timezone.utc):
-            raise ExpiredTokenError("Token has expired")
-        return decoded_token
+        # jwt.decode verifies the signature and rejects an expired exp claim
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError:
         raise ExpiredTokenError("Token has expired")
     except JWTError:
         raise InvalidTokenError("Invalid token during decoding")
+
+
+class TokenCache:
+    '''
+    A bounded LRU cache of tokens that have already been verified.
+
+    Verifying a JWT means an HMAC over the token plus JSON decoding, and a
+    client sends the same token with every request until it expires. Only
+    tokens that passed verification are stored, so random or forged tokens
+    never take up space, and at most maxsize entries are kept. An entry is
+    dropped as soon as it is looked up at or after its exp claim.
+
+    Attributes:
+        maxsize (int): Maximum number of cached tokens; 0 disables the cache.
+
+    Methods:
+        get(token): Return the cached claims of a token, or None.
+        put(token, claims): Cache the claims of a verified token.
+        discard(token): Drop a token from the cache.
+        clear(): Drop every cached token.
+        stats(): Return the size and hit and miss counters.
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # token -> claims
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        """Return the cached claims of an unexpired token, or None"""
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims["exp"] <= time.time():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token, claims):
+        """Cache the claims of a token that passed verification"""
+        if self.maxsize <= 0 or not isinstance(claims.get("exp"), (int, float)):
+            return
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        """Drop a token from the cache"""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        """Drop every cached token"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the number of cached tokens and the hit and miss counters"""
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,230 @@
+# tracing.py
+import contextvars
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+# set by RequestIdMiddleware; asyncio tasks and anyio worker threads inherit it
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![A-Za-z_0-9.])\d+(?:\.\d+)?")
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+# statements EXPLAIN QUERY PLAN can describe
+_EXPLAINABLE = ("select", "with", "insert", "update", "delete", "replace")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """Collapse whitespace and replace literals and IN (?, ?, ...) lists with ?"""
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _STRING.sub("?", query)
+    query = _NUMBER.sub("?", query)
+    return _PLACEHOLDERS.sub("?, ...", query)
+
+
+class SQLTracer:
+    '''
+    Records what SQL each request runs and logs slow statements.
+
+    When enabled, every statement DatabaseManager runs is recorded under
+    the ID of the request that ran it. An entry holds the normalized
+    statement text, the number of parameters, the duration, the rows
+    returned or changed and the method that issued it. Traces of the last
+    max_requests requests are kept in memory.
+
+    Independently of enabled, a statement taking slow_query_ms or longer is
+    added to the slow-query log together with its EXPLAIN QUERY PLAN. The
+    plan runs on the same connection with the same parameters and is cached
+    per statement text. The log keeps the last max_slow entries in memory,
+    and each entry is also appended as one JSON line to log_path if set.
+
+    With tracing disabled and no slow statement, DatabaseManager only
+    compares the statement's duration with slow_threshold.
+
+    Attributes:
+        enabled (bool): Record every statement per request.
+        slow_query_ms (float): Threshold of the slow-query log; 0 disables it.
+        log_path (str): File the slow-query log is appended to, if any.
+        max_requests (int): Request traces kept in memory.
+        max_statements (int): Statements kept per request trace.
+
+    Methods:
+        record(conn, query, params, duration, rows, caller): Record one statement.
+        trace(request_id): The statements a request ran.
+        requests(): Summaries of the traced requests, newest first.
+        slow_queries(): The slow-query log, newest first.
+    '''
+
+    def __init__(self, enabled=False, slow_query_ms=0, log_path=None, max_requests=256,
+                 max_statements=500, max_slow=500):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.log_path = log_path
+        self.max_requests = max_requests
+        self.max_statements = max_statements
+        self._traces = OrderedDict()  # request ID -> {"statements": [...], "truncated": n}
+        self._slow = deque(maxlen=max_slow)
+        self._plans = OrderedDict()  # normalized statement -> plan
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    @property
+    def slow_query_ms(self):
+        return self._slow_query_ms
+
+    @slow_query_ms.setter
+    def slow_query_ms(self, value):
+        self._slow_query_ms = value
+        # seconds, compared with every statement's duration
+        self.slow_threshold = value / 1000 if value and value > 0 else float("inf")
+
+    def record(self, conn, query, params, duration, rows, caller):
+        """
+        Record one statement that ran on conn.
+
+        Args:
+            conn (sqlite3.Connection): The connection the statement ran on.
+            query (str): The statement text.
+            params (tuple): Its parameters.
+            duration (float): Seconds it took.
+            rows (int): Rows returned or changed, None if unknown.
+            caller (frame): The frame of the method that issued it.
+        """
+        statement = normalize_sql(query)
+        code = caller.f_code if caller is not None else None
+        entry = {
+            "statement": statement,
+            "params": len(params) if params else 0,
+            "duration_ms": round(duration * 1000, 3),
+            "rows": rows,
+            "caller": getattr(code, "co_qualname", getattr(code, "co_name", None)),
+        }
+        request_id = request_id_var.get()
+        if self.enabled and request_id is not None:
+            with self._lock:
+                trace = self._traces.get(request_id)
+                if trace is None:
+                    trace = self._traces[request_id] = {"statements": [], "truncated": 0}
+                    while len(self._traces) > self.max_requests:
+                        self._traces.popitem(last=False)
+                if len(trace["statements"]) < self.max_statements:
+                    trace["statements"].append(entry)
+                else:
+                    trace["truncated"] += 1
+        if duration >= self.slow_threshold:
+            self._log_slow(conn, query, params, statement, {**entry, "request_id": request_id})
+
+    def _explain(self, conn, query, params, statement):
+        with self._lock:
+            plan = self._plans.get(statement)
+        if plan is not None:
+            return plan
+        if query.lstrip().split(None, 1)[0].lower() not in _EXPLAINABLE:
+            return None
+        try:
+            plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params or ())]
+        except sqlite3.Error as e:
+            print(f"Failed to explain slow query: {e}")
+            return None
+        with self._lock:
+            self._plans[statement] = plan
+            while len(self._plans) > 256:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _log_slow(self, conn, query, params, statement, entry):
+        entry["plan"] = self._explain(conn, query, params, statement)
+        entry["timestamp"] = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._slow.append(entry)
+        if self.log_path:
+            try:
+                with self._log_lock, open(self.log_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                print(f"Failed to write slow-query log: {e}")
+
+    def trace(self, request_id):
+        """The statements request_id ran, or None if it was not traced"""
+        with self._lock:
+            trace = self._traces.get(request_id)
+            if trace is None:
+                return None
+            statements = list(trace["statements"])
+            truncated = trace["truncated"]
+        return {
+            "request_id": request_id,
+            "statements": statements,
+            "truncated": truncated,
+            "total_ms": round(sum(entry["duration_ms"] for entry in statements), 3),
+        }
+
+    def requests(self):
+        """Statement count and total SQL time of every traced request, newest first"""
+        with self._lock:
+            traces = [(request_id, list(trace["statements"])) for request_id, trace in self._traces.items()]
+        return [{"request_id": request_id,
+                 "statements": len(statements),
+                 "total_ms": round(sum(entry["duration_ms"] for entry in statements), 3)}
+                for request_id, statements in reversed(traces)]
+
+    def slow_queries(self):
+        """The slow-query log kept in memory, newest first"""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def clear(self):
+        """Forget every trace, slow query and cached plan"""
+        with self._lock:
+            self._traces.clear()
+            self._slow.clear()
+            self._plans.clear()
+
+
+class RequestIdMiddleware:
+    '''
+    ASGI middleware giving every HTTP request an ID.
+
+    The ID comes from the request's X-Request-ID header when it is a short
+    token, otherwise a new one is made. It is stored in request_id_var for
+    SQL tracing and returned in the X-Request-ID response header.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                value = value.decode("latin-1")
+                if _REQUEST_ID.match(value):
+                    request_id = value
+                break
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+        header = (b"x-request-id", request_id.encode())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [header]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
+
+
+default_tracer = SQLTracer()
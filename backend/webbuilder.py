@@ -1,4 +1,6 @@
+import hashlib
 import json
+import threading
 
 class WebBuilder:
 
@@ -317,3 +319,48 @@ class WebBuilder:
                             filtered_command["inputs"].append(input_field)
                 filtered_menu["commands"].append(filtered_command)
         return filtered_menu
+
+
+class RoleMenu:
+    '''
+    The menu of one role, built and serialized once.
+
+    Menus only change with the code, so each role's menu is filtered out of
+    WebBuilder's command list a single time, encoded to JSON bytes, and given
+    a strong ETag derived from those bytes. Clients that already hold the
+    menu can revalidate it by ETag instead of downloading it again.
+
+    Attributes:
+        role (str): The role the menu is for.
+        menu (dict): The filtered menu.
+        body (bytes): The menu encoded as JSON.
+        etag (str): Quoted strong ETag of body.
+
+    Methods:
+        embed(payload): Encode payload as JSON with the menu under "interface".
+    '''
+
+    def __init__(self, role):
+        self.role = role
+        self.menu = WebBuilder(role).build_menu()
+        self.body = json.dumps(self.menu, separators=(",", ":")).encode()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    def embed(self, payload):
+        """JSON bytes of payload with the pre-encoded menu added as "interface\""""
+        head = json.dumps(payload, separators=(",", ":")).encode()[:-1]
+        return head + (b',' if payload else b'') + b'"interface":' + self.body + b"}"
+
+
+MENU_ROLES = ("unverified", "admin", "scheduler", "customer", "_temp")
+_role_menus = {role: RoleMenu(role) for role in MENU_ROLES}
+_role_menus_lock = threading.Lock()
+
+
+def role_menu(role):
+    """Return the precomputed RoleMenu of a role"""
+    menu = _role_menus.get(role)
+    if menu is None:
+        with _role_menus_lock:
+            menu = _role_menus.setdefault(role, RoleMenu(role))
+    return menu
@@ -0,0 +1,144 @@
+"""
+GET /reservations throughput as concurrent clients grow, with database calls
+made inline on the event loop vs dispatched to worker threads.
+
+The app is driven in-process through httpx's ASGI transport against a copy of
+reservationDB.db seeded with synthetic reservations. With --writer, another
+connection holds the write lock most of the time (think of a bulk import) and
+one extra client keeps posting /business-rules updates, which have to wait
+for that lock. Inline, the waiting write stalls the event loop and every
+reader with it; dispatched, readers keep making progress. Only the readers'
+requests are reported.
+
+Usage (from the repository root):
+    python benchmarks/async_concurrency.py --clients 1 4 16 --seconds 3 --writer
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+DB_PATH = os.path.join(BACKEND, "..", "reservationDB.db")
+
+workdir = tempfile.mkdtemp()
+os.environ["RESERVATION_DB"] = os.path.join(workdir, "bench.db")
+shutil.copy(DB_PATH, os.environ["RESERVATION_DB"])
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)  # the app mounts static/ and templates/ relative to backend
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from token_manager import create_access_token  # noqa: E402
+
+
+def seed(path, count):
+    """Add count random one-to-three hour reservations spread over 2024"""
+    conn = sqlite3.connect(path)
+    base = datetime(2024, 1, 1, 9)
+    rows = []
+    for _ in range(count):
+        start = base + timedelta(days=random.randrange(365), hours=random.randrange(8))
+        end = start + timedelta(hours=random.randint(1, 3))
+        rows.append(("christian", random.randint(1, 3),
+                     start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), 100.0, 50.0))
+    conn.executemany("""
+        INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+    conn.close()
+
+
+async def inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def hold_write_lock(path, stop):
+    """Hold the write lock 50 ms out of every 55 ms until stop is set"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(0.05)
+        conn.execute("COMMIT")
+        time.sleep(0.005)
+    conn.close()
+
+
+async def measure(clients, seconds, token, writer):
+    transport = httpx.ASGITransport(app=main.app)
+    headers = {"Authorization": token}
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def client(http):
+        while time.perf_counter() < deadline:
+            day = datetime(2024, 1, 1) + timedelta(days=random.randrange(364), hours=random.randrange(9, 17))
+            params = {"machine": random.choice(["scanner", "scooper", "harvester"]),
+                      "start_date": day.strftime('%Y-%m-%d %H:%M'),
+                      "end_date": (day + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M')}
+            began = time.perf_counter()
+            response = await http.get("/reservations", params=params, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - began)
+
+    async def rule_writer(http):
+        while time.perf_counter() < deadline:
+            response = await http.post("/business-rules", headers=headers,
+                                       json={"rule": "week_refund", "value": "0.75"})
+            response.raise_for_status()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        tasks = [client(http) for _ in range(clients)]
+        if writer:
+            tasks.append(rule_writer(http))
+        await asyncio.gather(*tasks)
+
+    latencies.sort()
+    return {
+        "requests_per_sec": round(len(latencies) / seconds),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--writer", action="store_true", help="keep a writer busy during the run")
+    args = parser.parse_args()
+
+    main.get_db_manager().apply_migrations()
+    seed(os.environ["RESERVATION_DB"], args.rows)
+    token = create_access_token(data={"sub": "akshatha", "role": "admin"})
+    threaded = main.run_blocking
+
+    stop = threading.Event()
+    if args.writer:
+        threading.Thread(target=hold_write_lock, args=(os.environ["RESERVATION_DB"], stop), daemon=True).start()
+    try:
+        for mode, dispatch in (("inline", inline), ("threads", threaded)):
+            main.run_blocking = dispatch
+            for clients in args.clients:
+                result = asyncio.run(measure(clients, args.seconds, token, args.writer))
+                print(json.dumps({"mode": mode, "clients": clients, "writer": args.writer, **result}))
+    finally:
+        stop.set()
+        main.audit_log.stop()
+        main.get_db_manager().close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_()
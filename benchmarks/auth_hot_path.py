@@ -0,0 +1,37 @@
+"""
+Cost of authenticating one request (permissions.validate_user_token) with the
+verified-token cache and without it.
+
+Usage (from the repository root):
+    python benchmarks/auth_hot_path.py --calls 50000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import permissions  # noqa: E402
+from token_manager import TokenCache, create_access_token  # noqa: E402
+
+
+def run(label, cache, calls, header):
+    permissions.token_cache = cache
+    seconds = timeit.timeit(lambda: permissions.validate_user_token(header), number=calls)
+    return {"mode": label, "calls": calls, "us_per_call": round(seconds / calls * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+
+    header = "Bearer " + create_access_token({"sub": "akshatha", "role": "admin"})
+    print(json.dumps(run("no cache", TokenCache(maxsize=0), args.calls, header)))
+    print(json.dumps(run("cache", TokenCache(), args.calls, header)))
+
+
+if __name__ == "__main__":
+    main()
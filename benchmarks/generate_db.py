@@ -0,0 +1,152 @@
+"""
+Build a synthetic reservationDB.db for load tests.
+
+Starts from a copy of the repository's reservationDB.db (machines, business
+rules, the demo users), brings its schema up to date, and adds:
+
+- --users customers named bench_user_<n>, plus a bench_admin, all with the
+  password "benchpass" (hashed once and shared, so generation does not spend
+  minutes in PBKDF2)
+- --reservations weekday reservations over the --years before --anchor,
+  the way past bookings pile up
+- --operations audit log rows over the same span
+
+The same --seed and --anchor always produce the same database, so a file
+generated once can be reused to compare commits. Nothing is booked after
+--anchor, so POST /reservations in a load test finds free machines.
+
+Usage (from the repository root):
+    python benchmarks/generate_db.py --out /tmp/bench.db --reservations 2000000 --users 5000 --operations 1000000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+DB_PATH = os.path.join(BACKEND, "..", "reservationDB.db")
+sys.path.insert(0, BACKEND)
+
+from hashing import PBKDF2_ITERATIONS  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+PASSWORD = "benchpass"
+SALT = "bench_salt"
+BATCH = 50000
+OPERATION_TYPES = ("login", "add reservation", "cancel reservation", "get reservations", "logout")
+
+
+def batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def weekday_slots(rng, anchor, days):
+    """Endless random (start, end) weekday slots between 9:00 and 18:00 in the days before anchor"""
+    while True:
+        day = anchor - timedelta(days=rng.randint(1, days))
+        if day.weekday() >= 5:
+            continue
+        start = datetime(day.year, day.month, day.day, rng.randint(9, 16), rng.choice((0, 30)))
+        yield start, start + timedelta(minutes=rng.choice((30, 60, 90, 120)))
+
+
+def add_users(conn, count):
+    password_hash = hashlib.pbkdf2_hmac('sha256', PASSWORD.encode(), SALT.encode(), PBKDF2_ITERATIONS).hex()
+    rows = [("bench_admin", password_hash, "admin", SALT)]
+    rows += [(f"bench_user_{n}", password_hash, "customer", SALT) for n in range(count)]
+    conn.executemany("INSERT INTO User (username, password_hash, role, salt) VALUES (?, ?, ?, ?)", rows)
+    return [row[0] for row in conn.execute(
+        "SELECT user_id FROM User WHERE username LIKE 'bench_user_%' ORDER BY user_id")]
+
+
+def add_reservations(conn, rng, count, users, anchor, days):
+    machines = conn.execute("SELECT Machine_id, rate FROM Machine ORDER BY Machine_id").fetchall()
+    slots = weekday_slots(rng, anchor, days)
+
+    def rows():
+        for _ in range(count):
+            machine_id, rate = rng.choice(machines)
+            start, end = next(slots)
+            cost = round(rate * (end - start).total_seconds() / 3600, 2)
+            yield (f"bench_user_{rng.randrange(users)}", machine_id,
+                   start.isoformat(' '), end.isoformat(' '), cost, cost / 2)
+
+    for batch in batched(rows()):
+        conn.executemany("""
+            INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, batch)
+
+
+def add_operations(conn, rng, count, user_ids, anchor, days):
+    span = days * 86400
+
+    def rows():
+        base = datetime(anchor.year, anchor.month, anchor.day)
+        for _ in range(count):
+            timestamp = base - timedelta(seconds=rng.randrange(span))
+            kind = rng.choice(OPERATION_TYPES)
+            yield (rng.choice(user_ids), timestamp.isoformat(' ', 'seconds'), kind, f"synthetic {kind}")
+
+    for batch in batched(rows()):
+        conn.executemany("INSERT INTO Operation (user_id, timestamp, type, description) VALUES (?, ?, ?, ?)", batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", required=True, help="Path of the database to create")
+    parser.add_argument("--reservations", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--operations", type=int, default=500000)
+    parser.add_argument("--years", type=int, default=5, help="Span of history before --anchor")
+    parser.add_argument("--anchor", default=date.today().isoformat(),
+                        help="Last day of history, YYYY-MM-DD (default today)")
+    parser.add_argument("--seed", type=int, default=51220)
+    parser.add_argument("--force", action="store_true", help="Overwrite --out")
+    args = parser.parse_args()
+
+    if os.path.exists(args.out) and not args.force:
+        parser.error(f"{args.out} exists, pass --force to overwrite it")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.out + suffix):
+            os.remove(args.out + suffix)
+    shutil.copy(DB_PATH, args.out)
+
+    rng = random.Random(args.seed)
+    anchor = date.fromisoformat(args.anchor)
+    days = args.years * 365
+    began = time.perf_counter()
+    conn = sqlite3.connect(args.out)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    apply_migrations(conn)
+    with conn:
+        user_ids = add_users(conn, args.users)
+        add_reservations(conn, rng, args.reservations, args.users, anchor, days)
+        add_operations(conn, rng, args.operations, user_ids, anchor, days)
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("User", "Reservation", "Operation")}
+    conn.close()
+
+    print(json.dumps({"out": args.out, "seed": args.seed, "anchor": args.anchor, "years": args.years,
+                      "rows": counts, "seconds": round(time.perf_counter() - began, 1),
+                      "bytes": os.path.getsize(args.out)}))
+
+
+if __name__ == "__main__":
+    main()
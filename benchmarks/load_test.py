@@ -0,0 +1,313 @@
+"""
+Throughput and latency of the backend under a mixed load, served by uvicorn.
+
+Copies a database made by generate_db.py, so every run starts from the same
+data. It then starts uvicorn on it and drives it over HTTP from --concurrency
+clients for --duration seconds. Each request is drawn from --mix, a weighted
+choice of:
+
+    get       GET /reservations of one customer over a week, as that customer
+    post      POST /reservations of a weekday slot in the next 30 days
+    delete    DELETE /reservations of a historical reservation, as admin
+    login     POST /login of a customer (a full PBKDF2 check)
+    outside   POST /outside-requests from a partner facility (API key)
+
+Requests made during the first --warmup seconds are not counted. The report
+is one JSON document with the commit it ran against, the configuration and,
+per scenario and overall, requests/sec and p50/p95/p99 latency. Non-2xx
+statuses are counted per scenario. A booking refused because the slot is
+full is a normal result under load. Pass --baseline with an earlier report
+to add the change in p50/p99/RPS against it.
+
+Usage (from the repository root):
+    python benchmarks/generate_db.py --out /tmp/bench.db
+    python benchmarks/load_test.py --db /tmp/bench.db --concurrency 32 --duration 30 > after.json
+    python benchmarks/load_test.py --db /tmp/bench.db --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+INVOKED_FROM = os.getcwd()  # --db, --baseline and --out are relative to it
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)  # the app mounts static/ and templates/ relative to backend
+
+import httpx  # noqa: E402
+from main import API_KEY  # noqa: E402
+from token_manager import create_access_token  # noqa: E402
+
+SCENARIOS = ("get", "post", "delete", "login", "outside")
+DEFAULT_MIX = "get=60,post=15,delete=10,login=5,outside=10"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def git_commit():
+    root = os.path.join(BACKEND, "..")
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(latencies, q):
+    """Nearest-rank percentile of a sorted list"""
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, max(0, int(round(q / 100 * len(latencies) + 0.5)) - 1))]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ms = lambda value: None if value is None else round(value * 1000, 2)  # noqa: E731
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 1),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "statuses": statuses,
+    }
+
+
+class Workload:
+    '''
+    Builds the requests of each scenario from the benchmark database.
+
+    Attributes:
+        customers (list of str): Customers requests are made as.
+        delete_ids (list of int): Reservations left to cancel, in random order.
+    '''
+
+    def __init__(self, db_path, rng, customers=200):
+        conn = sqlite3.connect(db_path)
+        self.customers = [row[0] for row in conn.execute(
+            "SELECT username FROM User WHERE username LIKE 'bench_user_%' ORDER BY user_id LIMIT ?",
+            (customers,))]
+        if not self.customers:
+            raise SystemExit(f"{db_path} has no bench users; create it with benchmarks/generate_db.py")
+        # enough distinct ids that a run never cancels the same reservation twice
+        self.delete_ids = [row[0] for row in conn.execute(
+            "SELECT reservation_id FROM Reservation WHERE customer LIKE 'bench_user_%' "
+            "ORDER BY reservation_id LIMIT 200000")]
+        history = conn.execute("SELECT MIN(start_date), MAX(start_date) FROM Reservation "
+                               "WHERE customer LIKE 'bench_user_%'").fetchone()
+        conn.close()
+        rng.shuffle(self.delete_ids)
+        self.rng = rng
+        self.history = [datetime.fromisoformat(value) for value in history]
+        self.tokens = {customer: f"Bearer {create_access_token({'sub': customer, 'role': 'customer'})}"
+                       for customer in self.customers}
+        self.admin = f"Bearer {create_access_token({'sub': 'bench_admin', 'role': 'admin'})}"
+
+    def _slot(self):
+        while True:
+            day = date.today() + timedelta(days=self.rng.randint(1, 29))
+            if day.weekday() < 5:
+                start = datetime(day.year, day.month, day.day, self.rng.randint(9, 16), self.rng.choice((0, 30)))
+                return start, start + timedelta(hours=1)
+
+    def request(self, scenario):
+        """(method, url, keyword arguments for httpx) of one request"""
+        customer = self.rng.choice(self.customers)
+        if scenario == "get":
+            first, last = self.history
+            start = first + timedelta(days=self.rng.randrange(max(1, (last - first).days - 7)))
+            return "GET", "/reservations", {
+                "headers": {"Authorization": self.tokens[customer]},
+                "params": {"customer": customer, "start_date": start.strftime('%Y-%m-%d 00:00'),
+                           "end_date": (start + timedelta(days=7)).strftime('%Y-%m-%d 00:00')}}
+        if scenario == "post":
+            start, end = self._slot()
+            return "POST", "/reservations", {
+                "headers": {"Authorization": self.tokens[customer]},
+                "json": {"customer": customer, "machine": self.rng.choice(("scanner", "scooper", "harvester")),
+                         "start_date": start.strftime('%Y-%m-%d %H:%M'), "end_date": end.strftime('%Y-%m-%d %H:%M')}}
+        if scenario == "delete":
+            if not self.delete_ids:
+                return None
+            return "DELETE", "/reservations", {
+                "headers": {"Authorization": self.admin},
+                "params": {"reservation_id": self.delete_ids.pop()}}
+        if scenario == "login":
+            return "POST", "/login", {"json": {"username": customer, "password": "benchpass"}}
+        start, end = self._slot()
+        return "POST", "/outside-requests", {
+            "headers": {"API-Key": API_KEY},
+            "json": {"start_time": start.strftime('%Y-%m-%d %H:%M'), "end_time": end.strftime('%Y-%m-%d %H:%M'),
+                     "client_name": f"partner_{self.rng.randrange(20)}", "machine_name": "scooper",
+                     "time_zone": "GMT-5", "blocks": "Null"}}
+
+
+async def client(http, workload, mix, warmup_end, deadline, samples):
+    scenarios, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        scenario = workload.rng.choices(scenarios, weights)[0]
+        request = workload.request(scenario)
+        if request is None:
+            await asyncio.sleep(0)  # nothing left to cancel
+            continue
+        method, url, kwargs = request
+        began = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        if began >= warmup_end and finished <= deadline:
+            samples[scenario].append((finished - began, status))
+
+
+async def drive(base_url, workload, mix, concurrency, warmup, duration):
+    samples = {scenario: [] for scenario in mix}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        start = time.perf_counter()
+        warmup_end, deadline = start + warmup, start + warmup + duration
+        await asyncio.gather(*(client(http, workload, mix, warmup_end, deadline, samples)
+                               for _ in range(concurrency)))
+    return samples
+
+
+def start_server(db_path, port, workers, env_overrides):
+    env = {**os.environ, "RESERVATION_DB": db_path, **env_overrides}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 300  # the availability index is built at startup
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"uvicorn exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/login-form", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not start within 300 seconds")
+
+
+def compare(report, baseline):
+    """Relative change of p50, p99 and RPS against a baseline report"""
+    changes = {}
+    for name, result in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        changes[name] = {key: round(result[key] / before[key] - 1, 4)
+                         for key in ("p50_ms", "p99_ms", "rps") if result.get(key) and before.get(key)}
+    return {"commit": baseline.get("commit"), "change": changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", required=True, help="Database made by benchmarks/generate_db.py")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Weighted scenarios (default {DEFAULT_MIX})")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=51220)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra server environment, e.g. --env DB_POOL_SIZE=10")
+    parser.add_argument("--baseline", help="Earlier report to compare with")
+    parser.add_argument("--out", help="Write the report here instead of stdout")
+    args = parser.parse_args()
+    for name in ("db", "baseline", "out"):
+        if getattr(args, name):
+            setattr(args, name, os.path.join(INVOKED_FROM, getattr(args, name)))
+
+    # archiving and profiling would make runs depend on the clock and on flags
+    env_overrides = {"AUDIT_RETENTION_DAYS": "0", "PROFILING": "0", "SQL_TRACE": "0"}
+    env_overrides.update(item.split("=", 1) for item in args.env)
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(args.db, db_path)
+    rng = random.Random(args.seed)
+    workload = Workload(db_path, rng)
+    port = free_port()
+    server = start_server(db_path, port, args.workers, env_overrides)
+    try:
+        samples = asyncio.run(drive(f"http://127.0.0.1:{port}", workload, args.mix,
+                                    args.concurrency, args.warmup, args.duration))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    conn = sqlite3.connect(args.db)
+    rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("User", "Reservation", "Operation")}
+    conn.close()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+                   "mix": args.mix, "workers": args.workers, "seed": args.seed, "env": env_overrides,
+                   "db_rows": rows},
+        "results": {scenario: summarize(scenario_samples, args.duration)
+                    for scenario, scenario_samples in samples.items()},
+    }
+    report["results"]["total"] = summarize([sample for scenario_samples in samples.values()
+                                            for sample in scenario_samples], args.duration)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["baseline"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
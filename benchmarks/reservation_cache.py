@@ -0,0 +1,113 @@
+"""
+Latency of a repeated GET /reservations poll with the result cache and
+without it, in-process (ReservationCalendar.retrieve) and through the app.
+
+The app is driven through httpx's ASGI transport against a copy of
+reservationDB.db seeded with synthetic reservations. Every poll asks for the
+same machine and week, the way a dashboard does.
+
+Usage (from the repository root):
+    python benchmarks/reservation_cache.py --rows 50000 --polls 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+DB_PATH = os.path.join(BACKEND, "..", "reservationDB.db")
+
+workdir = tempfile.mkdtemp()
+os.environ["RESERVATION_DB"] = os.path.join(workdir, "bench.db")
+shutil.copy(DB_PATH, os.environ["RESERVATION_DB"])
+sys.path.insert(0, BACKEND)
+os.chdir(BACKEND)  # the app mounts static/ and templates/ relative to backend
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from modules import DateRange, ReservationCalendar  # noqa: E402
+from token_manager import create_access_token  # noqa: E402
+
+
+def seed(path, count):
+    """Add count random one-to-three hour reservations spread over 2024"""
+    conn = sqlite3.connect(path)
+    base = datetime(2024, 1, 1, 9)
+    rows = []
+    for _ in range(count):
+        start = base + timedelta(days=random.randrange(365), hours=random.randrange(8))
+        end = start + timedelta(hours=random.randint(1, 3))
+        rows.append(("christian", random.randint(1, 3),
+                     start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), 100.0, 50.0))
+    conn.executemany("""
+        INSERT INTO Reservation (customer, machine_id, start_date, end_date, total_cost, down_payment)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+    conn.close()
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {"p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+            "p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 1)}
+
+
+def retrieve(polls):
+    calendar = ReservationCalendar(main.get_db_manager(), cache=main.reservation_cache)
+    daterange = DateRange("2024-06-03 00:00", "2024-06-10 00:00")
+    latencies = []
+    for _ in range(polls):
+        began = time.perf_counter()
+        calendar.retrieve_by_machine(daterange, "scanner")
+        latencies.append(time.perf_counter() - began)
+    return latencies
+
+
+async def http(polls, token):
+    transport = httpx.ASGITransport(app=main.app)
+    params = {"machine": "scanner", "start_date": "2024-06-03 00:00", "end_date": "2024-06-10 00:00"}
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(polls):
+            began = time.perf_counter()
+            response = await client.get("/reservations", params=params, headers={"Authorization": token})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - began)
+    return latencies
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--polls", type=int, default=500)
+    args = parser.parse_args()
+
+    main.get_db_manager().apply_migrations()
+    seed(os.environ["RESERVATION_DB"], args.rows)
+    token = create_access_token(data={"sub": "akshatha", "role": "admin"})
+    cache = main.reservation_cache
+    try:
+        for label, max_entries in (("no cache", 0), ("cache", cache.max_entries or 1024)):
+            cache.clear()
+            cache.max_entries = max_entries
+            result = {"mode": label, "rows": args.rows}
+            result["retrieve"] = percentiles(retrieve(args.polls))
+            result["http"] = percentiles(asyncio.run(http(args.polls, token)))
+            result["stats"] = cache.stats()
+            print(json.dumps(result))
+    finally:
+        main.audit_log.stop()
+        main.get_db_manager().close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,46 @@
+"""
+Cost of converting partner request times to local time: the original dateutil
+conversion, the cached fast path one timestamp at a time, and the bulk path.
+
+Usage (from the repository root):
+    python benchmarks/timezone_conversion.py --times 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from timezones import _convert_timezone_dateutil, convert_timezone, convert_timezones  # noqa: E402
+
+
+def run(label, convert, times, from_zone, to_zone):
+    began = time.perf_counter()
+    convert(times, from_zone, to_zone)
+    seconds = time.perf_counter() - began
+    return {"mode": label, "from": from_zone, "to": to_zone, "times": len(times),
+            "us_per_time": round(seconds / len(times) * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--times", type=int, default=20000)
+    args = parser.parse_args()
+
+    base = datetime(2024, 1, 1)
+    times = [(base + timedelta(minutes=random.randrange(525600))).strftime('%Y-%m-%d %H:%M')
+             for _ in range(args.times)]
+    modes = (("dateutil", lambda ts, f, t: [_convert_timezone_dateutil(x, f, t) for x in ts]),
+             ("single", lambda ts, f, t: [convert_timezone(x, f, t) for x in ts]),
+             ("bulk", convert_timezones))
+    for from_zone, to_zone in (("GMT-5", "GMT-5"), ("GMT+2", "America/Chicago")):
+        for label, convert in modes:
+            print(json.dumps(run(label, convert, times, from_zone, to_zone)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Read/write concurrency on the reservation database, rollback journal vs WAL.
+
+Reader threads run the GET /reservations query while one writer thread inserts
+audit rows the way log_operation does. Each mode runs against a fresh copy of
+reservationDB.db so the two runs start from the same data.
+
+Usage (from the repository root):
+    python benchmarks/wal_concurrency.py --readers 8 --seconds 5
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from connection_pool import ConnectionPool, DEFAULT_PRAGMAS, apply_pragmas
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "reservationDB.db")
+
+PROFILES = {
+    # what a bare sqlite3.connect() gives you
+    "delete": {"journal_mode": "DELETE", "synchronous": "FULL"},
+    "wal": DEFAULT_PRAGMAS,
+}
+
+READ_QUERY = """
+    SELECT Reservation.*, Machine.name AS machine_name
+    FROM Reservation
+    JOIN Machine ON Reservation.machine_id = Machine.machine_id
+    WHERE Reservation.start_date <= ? AND Reservation.end_date >= ?
+"""
+WRITE_QUERY = """
+    INSERT INTO Operation (user_id, type, description, timestamp)
+    VALUES (1, 'bench', 'benchmark write', datetime('now'))
+"""
+
+
+def run(profile, readers, seconds):
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "bench.db")
+    shutil.copy(DB_PATH, path)
+    pool = ConnectionPool(path, max_size=readers + 1, max_overflow=0, timeout=30,
+                          on_connect=lambda conn: apply_pragmas(conn, PROFILES[profile]))
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "read_waits": 0.0}
+    lock = threading.Lock()
+
+    def reader():
+        done, waited = 0, 0.0
+        with pool.connection() as conn:
+            while not stop.is_set():
+                began = time.perf_counter()
+                conn.execute(READ_QUERY, ("2024-12-31 00:00:00", "2024-01-01 00:00:00")).fetchall()
+                waited = max(waited, time.perf_counter() - began)
+                done += 1
+        with lock:
+            counts["reads"] += done
+            counts["read_waits"] = max(counts["read_waits"], waited)
+
+    def writer():
+        done = 0
+        with pool.connection() as conn:
+            while not stop.is_set():
+                conn.execute(WRITE_QUERY)
+                conn.commit()
+                done += 1
+        counts["writes"] = done
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    shutil.rmtree(workdir)
+
+    return {
+        "profile": profile,
+        "readers": readers,
+        "reads_per_sec": round(counts["reads"] / seconds),
+        "writes_per_sec": round(counts["writes"] / seconds),
+        "worst_read_ms": round(counts["read_waits"] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    for profile in PROFILES:
+        print(json.dumps(run(profile, args.readers, args.seconds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+-- Schema version 0 (PRAGMA user_version = 0). Indexes, triggers and later
+-- tables come from backend/migrations.py, which the server applies on startup.
+
 CREATE TABLE Machine (
     Machine_id INTEGER PRIMARY KEY,
     Name TEXT NOT NULL,
@@ -54,4 +57,4 @@ INSERT INTO Machine (machine_id, name, quantity, cooldown, rate) VALUES
     end_date DATETIME NOT NULL, 
     total_cost REAL NOT NULL,  
     down_payment REAL NOT NULL
-);
\ No newline at end of file
+);
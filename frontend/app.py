@@ -368,17 +368,28 @@ class APIHandler:
    
     Methods:
         set_token(token): Sets the token in the headers for authorization once recieved from logging in
+        set_interface(response): Remembers the interface ETag returned by a login
         make_request(command, data): Makes a request to the API with the given command (from menu) and data (from user input).
     '''
     def __init__(self, base_url):
         self.base_url = base_url
         self.headers = {}
+        self.interface_etag = None
 
 
     def set_token(self, token):
         self.headers['Authorization'] = f'Bearer {token}'
 
 
+    def set_interface(self, response):
+        '''
+        set_interface keeps the interface ETag of a login response and sends it
+        with the next login, so the server can leave out an interface it already sent.
+        '''
+        if 'interface_etag' in response:
+            self.interface_etag = response['interface_etag']
+
+
     def make_request(self, command, data):
         '''
         make_request makes a request to the API with the given command and data.
@@ -397,6 +408,8 @@ class APIHandler:
             JSON: The response from the API as a JSON object.
         '''
         headers = self.headers
+        if command["route"] == "/login" and self.interface_etag:
+            headers = {**headers, 'If-None-Match': self.interface_etag}
         method = getattr(requests, command["method"].lower(), requests.post)
         call_method = command["method"].lower()
         try:
@@ -522,6 +535,7 @@ class CLI:
         response = self.api_handler.make_request(command, data)
         if command["name"] == "Login" and 'access_token' in response:
             self.api_handler.set_token(response['access_token'])
+            self.api_handler.set_interface(response)
         print("Response:", response)
 
 
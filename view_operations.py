@@ -1,16 +1,20 @@
-import sqlite3
-from tabulate import tabulate
+import os
+import sys
 
-conn = sqlite3.connect('reservationDB.db')
-cursor= conn.cursor()
-cursor.execute("""
-               SELECT Operation.operation_id, User.username, Operation.timestamp,
-               Operation.type, Operation.description
-               FROM Operation JOIN User
-               ON Operation.user_id = User.user_id
-               """
-              )
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from modules import DatabaseManager
+from audit import OperationLog
 
-res = cursor.fetchall()
-headers = ["Operation ID","Username","Timestamp","Operation Type","Description"] 
-print(tabulate(res, headers=headers))
\ No newline at end of file
+db_manager = DatabaseManager('reservationDB.db')
+headers = ["Operation ID","Username","Timestamp","Operation Type","Description"]
+# fixed column widths, so the pages below print as one table
+row_format = "{:>12}  {:<20}  {:<19}  {:<20}  {}"
+
+print(row_format.format(*headers))
+print(row_format.format(*("-" * width for width in (12, 20, 19, 20, 11))))
+# print one page at a time instead of loading the whole history into memory
+for page in OperationLog(db_manager).iter_pages(limit=1000, oldest_first=True):
+    for row in page:
+        print(row_format.format(row['operation_id'], row['username'], row['timestamp'],
+                                row['type'], str(row['description'])))
+db_manager.close()